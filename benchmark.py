@@ -0,0 +1,342 @@
+"""Offline benchmarks: the apps' hot paths against the local stub server, no API key needed.
+
+    python benchmark.py
+    python benchmark.py --latency 0.4 --token-rate 40 --chunk-words 3 --turns 40 --sessions 8
+    python benchmark.py --json before.json
+    python benchmark.py --baseline before.json   # exits 1 if a p95 got more than --tolerance worse
+    python benchmark.py --fail-rate 0.2 --drop-rate 0.05 --seed 1   # the same under injected API faults
+
+Measures, with p50/p95/p99 where there are samples:
+- generate(), the path behind sermon_assistant.py: latency and time to first token
+- a Digital Barnabas chat turn (Scripture lookup, archive retrieval, routed stream, triggers,
+  ledger and library writes): latency, time to first token and tokenizer CPU time
+- the Streamlit scripts themselves, run headlessly with AppTest: time per rerun
+- building each export format for the benchmarked conversation
+- memory held by one session as its conversation grows
+- with injected faults, the share of chat turns that failed outright or were cut short
+
+Everything the apps would write goes to a temporary directory, removed afterwards, never to ~/.sermon_assistant.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+# Point every store at a scratch directory and lift the per-user limits before the package reads them
+SCRATCH = tempfile.mkdtemp(prefix="sermon-benchmark-")
+for name, file_name in [
+    ("CONVERSATION_STORE_PATH", "conversations.sqlite3"), ("COST_LEDGER_PATH", "costs.sqlite3"),
+    ("CONTENT_LIBRARY_PATH", "library.sqlite3"), ("RESPONSE_CACHE_PATH", "responses.sqlite3"),
+    ("SERMON_ARCHIVE_PATH", "archive.sqlite3"), ("ARCHIVE_UPLOADS_PATH", "archive-uploads"),
+    ("JOBS_PATH", "jobs.sqlite3"), ("SCRIPTURE_INDEX_PATH", "scripture.sqlite3"),
+]:
+    os.environ[name] = os.path.join(SCRATCH, file_name)
+os.environ.setdefault("USER_RPM", "0")
+os.environ.setdefault("USER_TPM", "0")
+os.environ["OPENAI_API_KEY"] = "benchmark"
+
+from sermon_assistant.stub_server import start_stub_server
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+NOISE_SECONDS = 0.001
+NOISE_RATE = 0.01
+MESSAGES = [
+    "I've been really anxious about my job lately and I don't know how to pray about it.",
+    "What does James 1:2-4 mean when it says to consider trials pure joy?",
+    "Why should I believe any of this?",
+    "My father passed away last month and the grief comes in waves.",
+    "Can you give me a short devotional thought on Psalm 23?",
+    "How do I forgive someone who keeps hurting me?",
+    "Thanks, that helps. What should I read this week?",
+    "I feel far from God and I'm not sure why.",
+]
+
+
+def percentiles(values):
+    """Nearest-rank p50, p95 and p99 of ``values``; None when there are none (e.g. every turn failed)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return {f"p{p}": ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)] for p in (50, 95, 99)}
+
+
+class TimedTokenizer:
+    """Wraps a tokenizer and adds up the CPU time spent encoding on each thread's behalf."""
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.seconds = 0.0
+
+    def encode(self, text):
+        start = time.thread_time()
+        try:
+            return self.tokenizer.encode(text)
+        finally:
+            self.seconds += time.thread_time() - start
+
+
+def bench_generation(runs):
+    from sermon_assistant import generate, get_prompts
+    from sermon_assistant.service import REPLY_ERRORS
+
+    content_types = list(get_prompts().content_types)
+    latency, first_token = [], []
+    for i in range(runs):
+        start = time.perf_counter()
+        first = []
+        try:
+            generate(
+                content_types[i % len(content_types)], f"Hope in hard seasons {i}", "Romans 5:1-5", "General",
+                use_cache=False, on_text=lambda chunk: first or first.append(time.perf_counter()),
+            )
+        except REPLY_ERRORS:
+            continue
+        latency.append(time.perf_counter() - start)
+        first_token.append(first[0] - start)
+    return {"generate latency": latency, "generate time to first token": first_token}
+
+
+def chat_turn(conversation, prompts, mode_key, user_input, user):
+    """One Digital Barnabas turn, as digital_barnabas_app.py runs it; returns the time of the first reply chunk and the reply."""
+    from sermon_assistant import find_passages, format_passages, get_sermon_archive, ground_prompt, route, stream_reply, with_archive
+
+    mode = prompts.modes[mode_key]
+    conversation.add("user", user_input)
+    passages = find_passages(user_input)
+    sources = get_sermon_archive().retrieve(user_input)
+    prompt_messages = with_archive(ground_prompt(conversation.prompt(), passages), sources)
+    reply = stream_reply(prompt_messages, **route(mode["profile"], user_input), user=user, priority=mode.get("priority"))
+    first = None
+    for _ in reply:
+        if first is None:
+            first = time.perf_counter()
+    suffix = "".join(f"\n\n{text}" for text in prompts.triggered(mode_key, user_input))
+    suffix += f"\n\n{random.choice(mode['follow_ups'])}"
+    prefix = format_passages(passages) + "\n\n" if passages else ""
+    conversation.add_reply(reply, suffix, prefix=prefix)
+    return first, reply
+
+
+def chat_session(turns, mode_key, number):
+    from sermon_assistant import Conversation, get_content_library, get_conversation_store, get_prompts, get_tokenizer
+    from sermon_assistant.service import REPLY_ERRORS
+
+    prompts = get_prompts()
+    mode = prompts.modes[mode_key]
+    store = get_conversation_store()
+    tokenizer = TimedTokenizer(get_tokenizer())
+    conversation = Conversation(
+        mode["system_prompt"], mode["starting_prompt"], tokenizer=tokenizer, store=store,
+        session_id=store.create_session("digital_barnabas", mode_key), app="digital_barnabas", mode=mode_key,
+        library=get_content_library(),
+    )
+    samples = {"chat turn latency": [], "chat time to first token": [], "tokenizer CPU per turn": []}
+    outcomes = {"failed": 0, "partial": 0}
+    for turn in range(turns):
+        encoded = tokenizer.seconds
+        start = time.perf_counter()
+        try:
+            first, reply = chat_turn(conversation, prompts, mode_key, MESSAGES[(turn + number) % len(MESSAGES)], f"benchmark-{number}")
+        except REPLY_ERRORS:
+            # What the app shows as "Try again"; the user's message stays unanswered
+            outcomes["failed"] += 1
+            continue
+        outcomes["partial"] += reply.error is not None
+        samples["chat turn latency"].append(time.perf_counter() - start)
+        samples["chat time to first token"].append(first - start)
+        samples["tokenizer CPU per turn"].append(tokenizer.seconds - encoded)
+    return samples, outcomes, conversation
+
+
+def bench_chat(turns, sessions, mode_key):
+    samples, outcomes = {}, {"failed": 0, "partial": 0}
+    with ThreadPoolExecutor(max_workers=sessions) as executor:
+        results = list(executor.map(lambda number: chat_session(turns, mode_key, number), range(sessions)))
+    for session_samples, session_outcomes, _ in results:
+        for name, values in session_samples.items():
+            samples.setdefault(name, []).extend(values)
+        for name, count in session_outcomes.items():
+            outcomes[name] += count
+    rates = {f"chat turns {name}": count / (turns * sessions) for name, count in outcomes.items()} if turns * sessions else {}
+    return samples, rates, results[0][2]
+
+
+def bench_apps(turns):
+    from streamlit.testing.v1 import AppTest
+
+    samples = {"digital_barnabas_app.py rerun": [], "sermon_assistant.py generate": []}
+    app = AppTest.from_file(os.path.join(APP_DIR, "digital_barnabas_app.py"), default_timeout=120).run()
+    for turn in range(turns):
+        start = time.perf_counter()
+        app.chat_input[0].set_value(MESSAGES[turn % len(MESSAGES)]).run()
+        samples["digital_barnabas_app.py rerun"].append(time.perf_counter() - start)
+        if app.exception:
+            raise RuntimeError(app.exception[0].value)
+    app = AppTest.from_file(os.path.join(APP_DIR, "sermon_assistant.py"), default_timeout=120).run()
+    next(box for box in app.checkbox if box.label.startswith("Reuse")).uncheck().run()
+    for _ in range(turns):
+        start = time.perf_counter()
+        app.button[0].click().run()
+        samples["sermon_assistant.py generate"].append(time.perf_counter() - start)
+        if app.exception:
+            raise RuntimeError(app.exception[0].value)
+    return samples
+
+
+def bench_exports(transcript, runs):
+    from sermon_assistant import export_docx, export_html, export_json, export_markdown, export_pdf, export_text
+
+    samples = {}
+    for exporter in (export_text, export_markdown, export_html, export_json, export_docx, export_pdf):
+        # The uncached build: the exporters otherwise hand back the same bytes for an unchanged transcript
+        build = getattr(exporter, "__wrapped__", exporter)
+        name = f"export {exporter.__name__.replace('export_', '')}"
+        samples[name] = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            build(transcript)
+            samples[name].append(time.perf_counter() - start)
+    return samples
+
+
+def session_memory(lengths, mode_key, reply_words):
+    """Bytes held by one conversation after each number of turns in ``lengths``, without calling the API."""
+    from sermon_assistant import MODEL, Conversation, CostLedger, extractive_summarizer, get_prompts, stub_server
+
+    mode = get_prompts().modes[mode_key]
+    words = stub_server.REPLY.split(" ")
+    usage = SimpleNamespace(prompt_tokens=500, completion_tokens=reply_words)
+    ledger = CostLedger(os.path.join(SCRATCH, "memory-costs.sqlite3"))
+    sizes = {}
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        conversation = Conversation(mode["system_prompt"], mode["starting_prompt"], summarize=extractive_summarizer, ledger=ledger)
+        for turn in range(1, max(lengths) + 1):
+            conversation.add("user", f"{MESSAGES[turn % len(MESSAGES)]} ({turn})")
+            conversation.prompt()
+            # A fresh string per reply, as real replies are, so none of them is shared
+            text = " ".join(words[i % len(words)] for i in range(reply_words)) + f" ({turn})"
+            conversation.add_reply(SimpleNamespace(text=text, usage=usage, model=MODEL))
+            if turn in lengths:
+                sizes[turn] = tracemalloc.get_traced_memory()[0] - baseline
+    finally:
+        tracemalloc.stop()
+    return sizes
+
+
+def report(samples, memory, rates):
+    results = {}
+    print(f"{'metric':<38}{'n':>5}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, values in samples.items():
+        stats = percentiles(values)
+        if stats is None:
+            # Left out of the results, so it is not compared with a baseline either
+            print(f"{name:<38}{0:>5}" + f"{'n/a':>10}" * 3)
+            continue
+        results[name] = dict(stats, n=len(values))
+        print(f"{name:<38}{len(values):>5}" + "".join(f"{stats[p] * 1000:>10.1f}" for p in ("p50", "p95", "p99")))
+    print()
+    for turns, size in memory.items():
+        results[f"session memory at {turns} turns"] = {"bytes": size}
+        print(f"session memory at {turns:>4} turns: {size / 1024:>8.1f} KiB")
+    for name, rate in rates.items():
+        results[name] = {"rate": rate}
+        print(f"{name}: {rate:.1%}")
+    return results
+
+
+def regressions(results, baseline, tolerance):
+    # A p95 (or a memory figure, or a failure rate) more than ``tolerance`` above the baseline run's;
+    # sub-millisecond timings jitter by more than that, so a time must also have grown by NOISE_SECONDS
+    found = []
+    for name, old in baseline.items():
+        new = results.get(name)
+        key = next(key for key in ("p95", "bytes", "rate") if key in old)
+        floor = {"p95": NOISE_SECONDS, "bytes": 0, "rate": NOISE_RATE}[key]
+        # A failure rate up from zero counts too
+        if new and (old[key] or key == "rate") and new[key] > old[key] * (1 + tolerance) and new[key] - old[key] > floor:
+            found.append(f"{name}: {key} {old[key]:.4g} -> {new[key]:.4g}")
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the sermon assistant against a local stub server.")
+    parser.add_argument("--latency", type=float, default=0.2, help="stub delay before each reply, in seconds")
+    parser.add_argument("--token-rate", type=float, default=80, help="stub reply tokens per second (0: no pacing)")
+    parser.add_argument("--chunk-words", type=int, default=1, help="words per streamed chunk")
+    parser.add_argument("--reply-words", type=int, default=120, help="stub reply length in words")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of stub requests answered with an error")
+    parser.add_argument("--fail-status", type=int, default=503, help="HTTP status of the injected errors")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="share of stub streams cut off half way")
+    parser.add_argument("--seed", type=int, help="seed for the injected faults")
+    parser.add_argument("--runs", type=int, default=10, help="generate() calls")
+    parser.add_argument("--turns", type=int, default=20, help="chat turns per session")
+    parser.add_argument("--sessions", type=int, default=1, help="chat sessions run at the same time")
+    parser.add_argument("--mode", default="grief_support", help="Digital Barnabas mode for the chat turns")
+    parser.add_argument("--app-turns", type=int, default=5, help="headless Streamlit reruns per app (0 to skip)")
+    parser.add_argument("--export-runs", type=int, default=5)
+    parser.add_argument("--memory-turns", default="10,50,100,200", help="conversation lengths to measure memory at")
+    parser.add_argument("--archive", help="folder of past sermons to ingest first, so retrieval has something to search")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results JSON from an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown against the baseline, e.g. 0.25 for 25%%")
+    args = parser.parse_args(argv)
+
+    server = start_stub_server(
+        latency=args.latency, token_rate=args.token_rate, chunk_words=args.chunk_words, reply_words=args.reply_words,
+        fail_rate=args.fail_rate, fail_status=args.fail_status, drop_rate=args.drop_rate, seed=args.seed,
+    )
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+    from sermon_assistant import get_sermon_archive
+
+    if args.archive:
+        for _ in get_sermon_archive().ingest(args.archive):
+            pass
+    print(
+        f"Stub: {args.latency}s latency, {args.token_rate or 'unpaced'} tokens/s, {args.chunk_words} word(s) per chunk, "
+        f"{args.reply_words}-word replies"
+        + (f", {args.fail_rate:.0%} {args.fail_status} errors, {args.drop_rate:.0%} dropped streams" if args.fail_rate or args.drop_rate else "")
+        + "\n"
+    )
+
+    try:
+        results = run(args)
+    finally:
+        shutil.rmtree(SCRATCH, ignore_errors=True)
+    print(f"\n{server.requests} requests served by the stub" + (f", {server.failures} of them errors" if server.failures else ""))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"settings": vars(args), "results": results}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            found = regressions(results, json.load(f)["results"], args.tolerance)
+        for line in found:
+            print(f"REGRESSION {line}")
+        return 1 if found else 0
+    return 0
+
+
+def run(args):
+    samples = {}
+    samples.update(bench_generation(args.runs))
+    chat_samples, rates, conversation = bench_chat(args.turns, args.sessions, args.mode)
+    samples.update(chat_samples)
+    if args.app_turns:
+        samples.update(bench_apps(args.app_turns))
+    samples.update(bench_exports(conversation.transcript, args.export_runs))
+    memory = session_memory([int(turns) for turns in args.memory_turns.split(",")], args.mode, args.reply_words)
+    return report(samples, memory, rates)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
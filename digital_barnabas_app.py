@@ -1,223 +1,102 @@
 import streamlit as st
-import openai
-import os
-import tiktoken
-from io import BytesIO
-from docx import Document
-from fpdf import FPDF
 import random
-
-# ========== MODE DEFINITIONS ==========
-MODES = {
-    "just_talk": {
-        "name": "Just Talk",
-        "tone": "gentle",
-        "description": "Conversational companion for people who want to reflect, vent, or process life through faith.",
-        "starting_prompt": "What's on your heart today?",
-        "follow_ups": [
-            "Would you like to talk about how this connects to your faith?",
-            "Is there a Scripture or prayer that might help you right now?",
-            "Would you like to reflect on Psalm 34:18—'The Lord is close to the brokenhearted'?"
-        ],
-        "emotionally_healthy": True
-    },
-    "bible_study": {
-        "name": "Bible Study Companion",
-        "tone": "thoughtful",
-        "description": "Helps reflect on Scripture, provides insights and related verses.",
-        "starting_prompt": "What verse or passage are you exploring today?",
-        "follow_ups": [
-            "Would you like a related Scripture?",
-            "Want to reflect on how this might apply to your life?"
-        ],
-        "emotionally_healthy": False
-    },
-    "devotional": {
-        "name": "Devotional Creator",
-        "tone": "encouraging",
-        "description": "Helps turn thoughts, verses, or struggles into devotionals with reflection and prayer.",
-        "starting_prompt": "Would you like to write a devotional based on a verse, a theme, or your current season?",
-        "follow_ups": [
-            "Would you like a prayer to go with this?",
-            "Want to add a personal reflection point or takeaway?"
-        ],
-        "emotionally_healthy": True
-    },
-    "grief_support": {
-        "name": "Grief & Anxiety Support",
-        "tone": "compassionate",
-        "description": "Walks with those experiencing grief, fear, or emotional overwhelm.",
-        "starting_prompt": "How are you feeling today? What are you carrying right now?",
-        "follow_ups": [
-            "Would you like a Scripture to sit with right now?",
-            "Would it help to pray together through this?"
-        ],
-        "emotionally_healthy": True
-    },
-    "marriage_parenting": {
-        "name": "Marriage & Parenting Help",
-        "tone": "wise",
-        "description": "Provides biblical support for relationship challenges and family life.",
-        "starting_prompt": "Is there something you’re facing in your marriage or family today?",
-        "follow_ups": [
-            "Would you like a Scripture that speaks to this?",
-            "Want help turning this into a conversation with your spouse or child?"
-        ],
-        "emotionally_healthy": True
-    },
-    "evangelism": {
-        "name": "Exploring Faith / Evangelism",
-        "tone": "respectful",
-        "description": "Gently helps seekers process doubts, questions, or spiritual curiosity.",
-        "starting_prompt": "Where are you at in your journey with faith or God?",
-        "follow_ups": [
-            "Would you like to hear what Jesus said about this?",
-            "Want to see how others wrestled with this in the Bible?"
-        ],
-        "emotionally_healthy": False,
-        "gospel_clarity_level": "high"
-    },
-    "pastor_support": {
-        "name": "Pastor Support",
-        "tone": "empathetic",
-        "description": "Offers guidance, sermon support, and emotional care for ministry leaders.",
-        "starting_prompt": "How are you holding up lately—in your soul, your work, your home?",
-        "follow_ups": [
-            "Would you like help preparing for this Sunday?",
-            "Need a moment to talk through what you're carrying?"
-        ],
-        "emotionally_healthy": True,
-        "resource_suggestions": [
-            "Emotionally Healthy Leader by Peter Scazzero",
-            "The Resilient Pastor by Glenn Packiam",
-            "Carey Nieuwhof Leadership Podcast",
-            "Barna Group research for church trends"
-        ]
-    }
-}
-# ========== OPENAI SETUP ==========
-client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-MODEL = "gpt-3.5-turbo"
-PRICE_PER_1K_INPUT = 0.0015
-PRICE_PER_1K_OUTPUT = 0.002
-encoder = tiktoken.encoding_for_model(MODEL)
+from sermon_assistant import (
+    export_text,
+    find_passages,
+    get_prompts,
+    get_sermon_archive,
+    ground_prompt,
+    route,
+    stream_reply,
+    with_archive,
+)
+from sermon_assistant.chat_ui import (
+    archive_panel,
+    export_button,
+    new_conversation,
+    open_conversation,
+    past_sessions,
+    retry_input,
+    search_panel,
+    show_costs,
+    show_history,
+    show_scripture,
+    show_sources,
+    waiting_line,
+    write_reply,
+)
+
+APP = "digital_barnabas"
 
 st.title("Digital Barnabas – Faith Conversation Assistant")
 
 # ========== MODE SELECTION ==========
-mode_keys = list(MODES.keys())
-selected_mode_key = st.selectbox("Choose a conversation mode:", mode_keys, format_func=lambda key: MODES[key]["name"])
-selected_mode = MODES[selected_mode_key]
-
-# ========== SESSION INIT ==========
-if "messages" not in st.session_state or st.session_state.get("last_mode") != selected_mode_key:
-    st.session_state.messages = [
-        {"role": "system", "content": f"You are a {selected_mode['tone']} spiritual companion. {selected_mode['description']}"},
-        {"role": "assistant", "content": selected_mode["starting_prompt"]}
-    ]
-    st.session_state.last_mode = selected_mode_key
-
-# ========== DISPLAY MESSAGES ==========
-for msg in st.session_state.messages:
-    if msg["role"] in ["user", "assistant"]:
-        with st.chat_message(msg["role"]):
-            st.write(msg["content"])
+# From the prompt registry, so edits to the prompt file show up on the next rerun
+prompts = get_prompts()
+modes = prompts.modes
+mode_keys = list(modes.keys())
+past_sessions(APP, "mode", mode_keys, format_mode=lambda key: modes[key]["name"])
+search_panel(APP)
+archive_panel()
+selected_mode_key = st.selectbox("Choose a conversation mode:", mode_keys, format_func=lambda key: modes[key]["name"], key="mode")
+selected_mode = modes[selected_mode_key]
+
+# ========== SESSION INIT (saved as it goes, resumable) ==========
+conversation = open_conversation(APP, selected_mode_key, selected_mode["system_prompt"], selected_mode["starting_prompt"])
+
+# ========== DISPLAY MESSAGES (latest page) ==========
+show_history(conversation)
 
 # ========== CHAT INPUT ==========
 user_input = st.chat_input("Type here...")
+turn = None
+if user_input:
+    conversation.add("user", user_input)
+else:
+    # After a failed reply, "Try again" answers the message already in the history
+    user_input = retry_input(conversation)
 if user_input:
-    st.session_state.messages.append({"role": "user", "content": user_input})
-    input_tokens = len(encoder.encode(user_input))
-
-    # Response
-    response = client.chat.completions.create(
-        model=MODEL,
-        messages=st.session_state.messages,
-        temperature=0.7,
-        max_tokens=1200,
-    )
-    output_text = response.choices[0].message.content
-
-    # Add gospel anchor if evangelism mode and question includes belief
-    if selected_mode_key == "evangelism" and any(word in user_input.lower() for word in ["believe", "jesus", "god", "why"]):
-        output_text += "\n\n💬 At the heart of Christianity is this: Jesus came to rescue, not just to teach. He said, 'I am the way, the truth, and the life. No one comes to the Father except through me.' (John 14:6)"
-
-    output_tokens = len(encoder.encode(output_text))
-    input_cost = (input_tokens / 1000) * PRICE_PER_1K_INPUT
-    output_cost = (output_tokens / 1000) * PRICE_PER_1K_OUTPUT
-    total_cost = input_cost + output_cost
-
-    follow_up = random.choice(selected_mode["follow_ups"])
-    output_text += f"\n\n{follow_up}"
+    # Verses the user cites are looked up locally and their exact text given to the model
+    passages = find_passages(user_input)
+    # Only the passages of past sermons that match this message, within the archive's token budget
+    sources = get_sermon_archive().retrieve(user_input)
+    prompt_messages = with_archive(ground_prompt(conversation.prompt(), passages), sources)
 
     with st.chat_message("assistant"):
-        st.write(output_text)
+        scripture = show_scripture(passages)
+
+        # Response, rendered chunk by chunk as it is generated, on the model sized for this turn
+        reply = stream_reply(prompt_messages, **route(selected_mode["profile"], user_input), **waiting_line(selected_mode))
+        write_reply(reply)
+        show_sources(sources)
+
+        # Crisis resources, Scripture hints and the gospel anchor, from one pass over the message
+        suffix = "".join(f"\n\n{text}" for text in prompts.triggered(selected_mode_key, user_input))
+
+        follow_up = random.choice(selected_mode["follow_ups"])
+        suffix += f"\n\n{follow_up}"
+
+        # Triggered notes and follow-up go below the streamed reply in the same bubble
+        st.write(suffix)
 
-    st.session_state.messages.append({"role": "assistant", "content": output_text})
+    # Charged for the whole prompt actually sent (history and system prompt included),
+    # as reported by the API, rather than just the latest message
+    turn = conversation.add_reply(reply, suffix, prefix=scripture)
 
 # ========== EXPORT ==========
-transcript = ""
-for msg in st.session_state.messages:
-    if msg["role"] == "user":
-        transcript += f"You: {msg['content']}\n\n"
-    elif msg["role"] == "assistant":
-        transcript += f"Assistant: {msg['content']}\n\n"
-
-def export_text(content):
-    return BytesIO(content.encode())
-
-def export_docx(content):
-    doc = Document()
-    for block in content.split('\n\n'):
-        doc.add_paragraph(block)
-    buffer = BytesIO()
-    doc.save(buffer)
-    buffer.seek(0)
-    return buffer
-
-def export_pdf(content):
-    def sanitize_text(text):
-        replacements = {
-            "—": "-",    # em-dash
-            "–": "-",    # en-dash
-            "“": '"',    # left quote
-            "”": '"',    # right quote
-            "‘": "'",    # left apostrophe
-            "’": "'",    # right apostrophe
-            "…": "...",  # ellipsis
-        }
-        for orig, repl in replacements.items():
-            text = text.replace(orig, repl)
-        return ''.join([c if ord(c) < 256 else '?' for c in text])
-
-    sanitized_content = sanitize_text(content)
-    pdf = FPDF()
-    pdf.add_page()
-    pdf.set_font("Arial", size=12)
-    for line in sanitized_content.split('\n'):
-        pdf.multi_cell(0, 10, line)
-    return BytesIO(pdf.output(dest='S').encode('latin-1'))
+transcript = conversation.transcript
 
 st.divider()
 st.write("### 💾 Save this conversation")
 col1, col2 = st.columns([1, 1])
 with col1:
     st.download_button("📝 Save as Text", export_text(transcript), file_name="conversation.txt")
-    st.download_button("📄 Save as Word", export_docx(transcript), file_name="conversation.docx")
-    st.download_button("📰 Save as PDF", export_pdf(transcript), file_name="conversation.pdf")
+    export_button("📄 Save as Word", transcript, file_name="conversation.docx", session_id=conversation.session_id)
+    export_button("📰 Save as PDF", transcript, file_name="conversation.pdf", session_id=conversation.session_id)
 
 with col2:
-    if "input_tokens" in locals():
-        with st.expander("💡 Behind the Scenes"):
-            st.write(f"Input Tokens: {input_tokens}")
-            st.write(f"Output Tokens: {output_tokens}")
-            st.write(f"Estimated Cost: ${round(total_cost, 4)}")
-    else:
-        st.info("Send a message to view token usage.")
+    show_costs(conversation, turn, format_mode=lambda key: modes[key]["name"])
 
 if st.button("🧹 Start Over"):
-    st.session_state.messages = [
-        {"role": "system", "content": f"You are a {selected_mode['tone']} spiritual companion. {selected_mode['description']}"},
-        {"role": "assistant", "content": selected_mode["starting_prompt"]}
-    ]
+    new_conversation(APP, selected_mode_key, selected_mode["system_prompt"], selected_mode["starting_prompt"])
     st.success("Conversation reset.")
@@ -1,104 +1,144 @@
 import streamlit as st
-import openai
-import os
-import tiktoken
+from sermon_assistant import (
+    batch_requests,
+    find_passages,
+    format_passages,
+    get_prompts,
+    get_response_cache,
+    read_topics_csv,
+    summarize_batch,
+)
+from sermon_assistant.chat_ui import archive_panel, follow_job, search_panel, session_user
+from sermon_assistant.jobs import get_job_queue
+from sermon_assistant.scheduler import BATCH_PRIORITY
 
-# Initialize OpenAI Client with API Key from environment
-client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Saved-results cache
+cache = get_response_cache()
+# Generations run as background jobs, so clicking anything while one is written neither loses it nor pays for it twice
+jobs = get_job_queue()
+# Content types and audiences from the prompt registry, re-read on every rerun
+prompts = get_prompts()
 
-# Set model
-MODEL = "gpt-3.5-turbo"
+SINGLE, FULL_SET, SERIES = "One item", "All content types for one topic", "Sermon series from CSV"
 
-# Token pricing for GPT-3.5 Turbo
-PRICE_PER_1K_INPUT = 0.0015
-PRICE_PER_1K_OUTPUT = 0.002
 
-# Setup tokenizer
-tokenizer = tiktoken.encoding_for_model(MODEL)
+def show_cache_stats():
+    stats = cache.stats()
+    st.info(f"🗄️ Cache Hit Rate: {stats['hit_rate']:.0%} ({stats['hits']} of {stats['hits'] + stats['misses']}) | Saved So Far: ${stats['saved_cost']:.4f}")
+
+
+def show_result(result):
+    content_type = result["content_type"]
+    st.success(f"{content_type} generated:" if not result["cached"] else f"{content_type} (saved result, served instantly):")
+    st.write(result["text"])
+    if result.get("partial"):
+        st.warning("⚠️ The connection dropped before this was finished, so it ends early and was not saved for reuse. Generate it again for the rest.")
+    if result["sources"]:
+        st.caption("📚 Drawing on your past sermons: " + ", ".join(result["sources"]))
+
+    st.info(f"🔢 Estimated Tokens Used: Input: {result['input_tokens']} | Output: {result['output_tokens']}")
+    st.info(f"💰 Estimated Cost: ${result['cost']:.4f} (Input: ${result['input_cost']:.4f} | Output: ${result['output_cost']:.4f})"
+            + (" — not charged, served from cache" if result["cached"] else ""))
+    show_cache_stats()
+
 
 # --- APP TITLE ---
-st.title("AI Ministry Content Assistant (GPT-3.5 Turbo)")
+st.title("AI Ministry Content Assistant")
 st.write("Create sermon outlines, devotionals, Bible studies, and more. Token usage and cost tracked per request.")
 
+# Everything generated before, searchable so it can be reused instead of regenerated
+search_panel()
+# Past sermons that new content is kept consistent with
+archive_panel()
+
+batch_mode = st.radio("Generate", [SINGLE, FULL_SET, SERIES], horizontal=True)
+
 # --- SELECT CONTENT TYPE ---
-content_type = st.selectbox("What do you want to generate?", [
-    "Sermon Outline",
-    "Devotional",
-    "Bible Study Guide",
-    "Small Group Discussion",
-    "Children's Lesson",
-    "Social Media Post"
-])
+if batch_mode == SINGLE:
+    content_type = st.selectbox("What do you want to generate?", list(prompts.content_types))
+else:
+    content_types = st.multiselect("Content types for each topic", list(prompts.content_types), default=list(prompts.content_types))
 
 # --- INPUT FIELDS ---
-topic = st.text_input("Enter your topic", "Faith in Difficult Times")
-scripture = st.text_input("Enter key scripture (optional)", "James 1:2-4")
-audience = st.selectbox("Select audience", ["General", "Men", "Women", "Youth", "Children"])
-
-# --- ADJUST PROMPT BASED ON CONTENT TYPE ---
-if content_type == "Sermon Outline":
-    system_prompt = (
-        "You are a friendly and encouraging AI sermon assistant who writes in a personal, pastoral tone. "
-        "Generate a sermon outline with 3-5 main points for the given topic and scripture, tailored to the given audience. "
-        "Include supporting Bible verses for each point."
-    )
-elif content_type == "Devotional":
-    system_prompt = (
-        "You are a devotional writer. Create a devotional thought for the given topic and scripture, "
-        "including a reflection, prayer, and a life application. Keep the tone warm, personal, and encouraging."
-    )
-elif content_type == "Bible Study Guide":
-    system_prompt = (
-        "You are a Bible study guide writer. Create a structured Bible study guide for the given topic and scripture, "
-        "including key questions, main points, and application steps for group discussion."
-    )
-elif content_type == "Small Group Discussion":
-    system_prompt = (
-        "You are a small group discussion guide writer. Create a discussion starter based on the topic and scripture, "
-        "including 3-5 open-ended questions that encourage personal reflection and group interaction."
-    )
-elif content_type == "Children's Lesson":
-    system_prompt = (
-        "You are a children's Bible lesson writer. Create a simple and fun Bible lesson with a story, key point, and activity suggestion for kids. "
-        "Make sure it's understandable for children."
-    )
-elif content_type == "Social Media Post":
-    system_prompt = (
-        "You are a social media content creator for a Christian audience. Write a short, engaging post based on the given topic and scripture, "
-        "including a call to action and hashtags."
-    )
+if batch_mode == SERIES:
+    series_file = st.file_uploader("Upload a CSV with a 'topic' column (optional 'scripture' and 'audience')", type="csv")
+else:
+    topic = st.text_input("Enter your topic", "Faith in Difficult Times")
+    scripture = st.text_input("Enter key scripture (optional)", "James 1:2-4")
+    # The passage itself, looked up locally as soon as a reference is entered
+    passages = find_passages(scripture)
+    if passages:
+        st.markdown(format_passages(passages))
+    audience = st.selectbox("Select audience", prompts.audiences)
+use_cache = st.checkbox("Reuse a saved result for the same request (uncheck to regenerate)", value=True)
 
 # --- GENERATE OUTLINE BUTTON ---
-if st.button("Generate Content"):
+generate_clicked = st.button("Generate Content")
+
+if generate_clicked and batch_mode == SINGLE:
+    request = {"content_type": content_type, "topic": topic, "scripture": scripture, "audience": audience, "use_cache": use_cache}
+    # A second click while the first is still being written gets the same job back
+    job_id = jobs.submit("generate", request, user=session_user(), priority=prompts.content_types[content_type].get("priority"))
+    st.session_state.generation = {"mode": SINGLE, "requests": [request], "jobs": [job_id]}
+
+elif generate_clicked:
+    if not content_types:
+        st.warning("Pick at least one content type.")
+        st.stop()
+    if batch_mode == SERIES:
+        if series_file is None:
+            st.warning("Upload a CSV of topics first.")
+            st.stop()
+        try:
+            rows = read_topics_csv(series_file.getvalue())
+        except ValueError as error:
+            st.error(str(error))
+            st.stop()
+    else:
+        rows = [{"topic": topic, "scripture": scripture, "audience": audience}]
+
+    # --- QUEUE THE BATCH, one job per item; the job workers run them in parallel ---
+    requests = [dict(request, use_cache=use_cache) for request in batch_requests(rows, content_types)]
+    st.session_state.generation = {
+        "mode": batch_mode, "requests": requests, "jobs": [jobs.submit("generate", request, priority=BATCH_PRIORITY) for request in requests],
+    }
+
+# The latest generation is shown on every rerun, following it while it is still being written
+generation = st.session_state.get("generation")
+
+if generation and generation["mode"] == SINGLE:
     with st.spinner("Generating content..."):
-        user_prompt = f"Topic: {topic}\nScripture: {scripture}\nAudience: {audience}\n\nPlease provide the {content_type.lower()}."
-
-        # Count input tokens
-        prompt_tokens = len(tokenizer.encode(system_prompt)) + len(tokenizer.encode(user_prompt))
-
-        # Call OpenAI API
-        response = client.chat.completions.create(
-            model=MODEL,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-            temperature=0.7,
-            max_tokens=1200,
-        )
-
-        # Get output and calculate tokens
-        output_text = response.choices[0].message.content
-        output_tokens = len(tokenizer.encode(output_text))
-
-        # Calculate estimated cost
-        input_cost = (prompt_tokens / 1000) * PRICE_PER_1K_INPUT
-        output_cost = (output_tokens / 1000) * PRICE_PER_1K_OUTPUT
-        total_cost = input_cost + output_cost
-
-        # --- DISPLAY RESULTS ---
-        st.success(f"{content_type} generated:")
-        st.write(output_text)
-
-        st.info(f"🔢 Estimated Tokens Used: Input: {prompt_tokens} | Output: {output_tokens}")
-        st.info(f"💰 Estimated Cost: ${total_cost:.4f} (Input: ${input_cost:.4f} | Output: ${output_cost:.4f})")
+        draft = st.empty()
+        job = follow_job(generation["jobs"][0], on_progress=draft.markdown)
+        draft.empty()
+
+    # --- DISPLAY RESULTS ---
+    if job is None:
+        del st.session_state.generation
+    elif job["status"] == "failed":
+        st.error(f"Could not generate this item: {job['error']}")
+    else:
+        show_result(job["result"])
+
+elif generation:
+    requests = generation["requests"]
+    progress = st.progress(0.0, text=f"Generating {len(requests)} items...")
+    results = []
+    for request, job_id in zip(requests, generation["jobs"]):
+        job = follow_job(job_id)
+        results.append(job["result"] if job and job["status"] == "done" else dict(request, error=job["error"] if job else "expired"))
+        progress.progress(len(results) / len(requests), text=f"{len(results)} of {len(requests)} ready — {request['content_type']}: {request['topic']}")
+
+    # --- DISPLAY RESULTS in series order ---
+    for result in results:
+        with st.expander(f"{result['topic']} — {result['content_type']}" + (" (saved result)" if result.get("cached") else "")):
+            if "error" in result:
+                st.error(f"Could not generate this item: {result['error']}")
+            else:
+                st.write(result["text"])
+
+    totals = summarize_batch(results)
+    st.success(f"{totals['items']} items generated ({totals['cached']} from cache)" + (f", {totals['failed']} failed" if totals["failed"] else ""))
+    st.info(f"🔢 Estimated Tokens Used: Input: {totals['input_tokens']} | Output: {totals['output_tokens']}")
+    st.info(f"💰 Estimated Cost: ${totals['cost']:.4f} for this batch")
+    show_cache_stats()
@@ -0,0 +1,36 @@
+import importlib
+
+# Each name is imported from its module on first use, so commands that never call the API
+# (python -m sermon_assistant types, --help) do not pay for importing openai and httpx
+_MODULES = {
+    "archive": ["SermonArchive", "archive_prompt", "chunk_text", "get_sermon_archive", "with_archive"],
+    "client": ["MODEL", "complete", "get_client", "get_tokenizer", "stream_reply"],
+    "context": ["ContextWindow", "TOKENS_PER_MESSAGE", "TOKENS_PER_REPLY", "extractive_summarizer", "llm_summarizer"],
+    "conversation": ["Conversation"],
+    "conversation_store": ["ConversationStore", "get_conversation_store"],
+    "costs": ["PRICES", "check_prices", "estimate_cost", "load_prices", "price_for"],
+    "exporters": ["export_docx", "export_html", "export_json", "export_markdown", "export_pdf", "export_text", "sanitize_text"],
+    "generation": ["batch_requests", "generate", "generate_batch", "read_topics_csv", "summarize_batch"],
+    "jobs": ["JobQueue", "get_job_queue"],
+    "ledger": ["CostLedger", "get_cost_ledger"],
+    "library": ["ContentLibrary", "get_content_library", "hashed_embedding"],
+    "metrics": ["REGISTRY", "span", "start_metrics_server", "timed"],
+    "prompts": ["PromptRegistry", "Prompts", "get_prompt_registry", "get_prompts"],
+    "resilience": ["CircuitBreaker", "CircuitOpenError"],
+    "response_cache": ["ResponseCache", "get_response_cache"],
+    "routing": ["PROFILES", "ROUTES", "load_routes", "route"],
+    "scripture": ["Reference", "VerseIndex", "find_passages", "find_references", "format_passages", "get_verse_index", "ground_prompt", "lookup"],
+    "service": ["CompletionService", "get_service"],
+    "transcript": ["SPEAKERS", "Transcript"],
+    "triggers": ["TriggerEngine", "phrase_pattern"],
+}
+_EXPORTS = {name: module for module, names in _MODULES.items() for name in names}
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{_EXPORTS[name]}", __name__), name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,311 @@
+"""A church's own past sermons, chunked and indexed locally for retrieval.
+
+Files are read and chunked in parallel and written to the index one by one as they
+finish, so a large folder starts paying off before it is done. Re-ingesting a folder only
+re-reads files whose size or modification time changed. Retrieval sends the model the few
+chunks that best match a request, held under a token budget, never whole documents.
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from functools import lru_cache
+
+from . import metrics
+from .client import get_tokenizer
+from .library import VectorIndex, fts_query, hashed_embedding
+from .transcript import paragraphs
+
+try:
+    import numpy as np
+except ImportError:  # retrieval then ranks by keywords alone
+    np = None
+
+ARCHIVE_PATH = os.getenv("SERMON_ARCHIVE_PATH", os.path.join(os.path.expanduser("~"), ".sermon_assistant", "archive.sqlite3"))
+CHUNK_TOKENS = int(os.getenv("ARCHIVE_CHUNK_TOKENS", "300"))
+# What one request may spend on archive passages, and how many it may use at most
+CONTEXT_TOKENS = int(os.getenv("ARCHIVE_CONTEXT_TOKENS", "1200"))
+TOP_K = int(os.getenv("ARCHIVE_TOP_K", "4"))
+INGEST_WORKERS = int(os.getenv("ARCHIVE_INGEST_WORKERS", "4"))
+# Reciprocal-rank fusion constant for merging keyword and similarity rankings
+RRF_K = 60
+# A passage is only used if it clears one of these: a keyword match at least this strong
+# (FTS5's BM25, negated so higher is better) or a cosine similarity at least this high
+MIN_BM25 = float(os.getenv("ARCHIVE_MIN_BM25", "0.5"))
+MIN_SIMILARITY = float(os.getenv("ARCHIVE_MIN_SIMILARITY", "0.2"))
+# Words that match every sermon and say nothing about what the request is after
+STOPWORDS = frozenset("""
+a about after again all also am an and any are as at be because been before being but by can could did do does
+doing for from had has have having he her here hers him his how i if in into is it its just me more most my no
+not of on or our ours out over please she should so some than that the their theirs them then there these they
+this those through to too under up very was we were what when where which while who whom why will with would
+you your yours
+""".split())
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT UNIQUE NOT NULL,
+    title TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    chunks INTEGER NOT NULL,
+    indexed REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    document_id INTEGER NOT NULL REFERENCES documents (id),
+    position INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    tokens INTEGER NOT NULL,
+    vector BLOB
+);
+CREATE INDEX IF NOT EXISTS chunks_document ON chunks (document_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(text, content='chunks', content_rowid='id', tokenize='porter unicode61');
+CREATE TRIGGER IF NOT EXISTS chunks_ai AFTER INSERT ON chunks BEGIN
+    INSERT INTO chunks_fts (rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS chunks_ad AFTER DELETE ON chunks BEGIN
+    INSERT INTO chunks_fts (chunks_fts, rowid, text) VALUES ('delete', old.id, old.text);
+END;
+"""
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def read_text(path):
+    with open(path, encoding="utf-8", errors="replace") as f:
+        return f.read()
+
+
+def read_docx(path):
+    # Imported here, like the exporters, so nothing pays for python-docx until a .docx is read
+    from docx import Document
+    return "\n\n".join(paragraph.text for paragraph in Document(path).paragraphs)
+
+
+def read_pdf(path):
+    from pypdf import PdfReader
+    return "\n\n".join(page.extract_text() or "" for page in PdfReader(path).pages)
+
+
+READERS = {".txt": read_text, ".md": read_text, ".docx": read_docx, ".pdf": read_pdf}
+
+
+def chunk_text(text, tokenizer, max_tokens=None):
+    """[(chunk, tokens), ...] of about ``max_tokens`` each, split between paragraphs where possible.
+
+    A paragraph longer than the limit is split between sentences instead.
+    """
+    max_tokens = max_tokens or CHUNK_TOKENS
+    pieces = []
+    for paragraph in paragraphs(text):
+        paragraph = " ".join(paragraph.split())
+        tokens = len(tokenizer.encode(paragraph))
+        if tokens <= max_tokens:
+            pieces.append((paragraph, tokens))
+        else:
+            pieces.extend((sentence, len(tokenizer.encode(sentence))) for sentence in SENTENCE_RE.split(paragraph))
+    chunks, current, size = [], [], 0
+    for piece, tokens in pieces:
+        if current and size + tokens > max_tokens:
+            chunks.append(("\n\n".join(current), size))
+            current, size = [], 0
+        current.append(piece)
+        size += tokens
+    if current:
+        chunks.append(("\n\n".join(current), size))
+    return chunks
+
+
+def document_title(path):
+    return os.path.splitext(os.path.basename(path))[0].replace("_", " ").strip()
+
+
+class SermonArchive:
+    """Past sermons in SQLite: a keyword index over their chunks, plus chunk vectors when NumPy is installed."""
+
+    def __init__(self, path=None, tokenizer=None, embed=None):
+        self.path = path or ARCHIVE_PATH
+        self.tokenizer = tokenizer or get_tokenizer()
+        self.embed = embed or (hashed_embedding if np is not None else None)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._vectors = None
+        self._vectors_version = None
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=10)
+        db.row_factory = sqlite3.Row
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def _prepare(self, path):
+        # Runs on a worker thread: everything slow about a file, before the index is touched
+        text = READERS[os.path.splitext(path)[1].lower()](path)
+        chunks = chunk_text(text, self.tokenizer)
+        vectors = [self.embed(chunk).astype("float32").tobytes() if self.embed else None for chunk, _ in chunks]
+        return chunks, vectors
+
+    def _store(self, path, stat, chunks, vectors):
+        with self._connect() as db:
+            row = db.execute("SELECT id FROM documents WHERE path = ?", (path,)).fetchone()
+            if row:
+                db.execute("DELETE FROM chunks WHERE document_id = ?", (row["id"],))
+                db.execute(
+                    "UPDATE documents SET size = ?, mtime = ?, chunks = ?, indexed = ? WHERE id = ?",
+                    (stat.st_size, stat.st_mtime, len(chunks), time.time(), row["id"]),
+                )
+                document_id = row["id"]
+            else:
+                document_id = db.execute(
+                    "INSERT INTO documents (path, title, size, mtime, chunks, indexed) VALUES (?, ?, ?, ?, ?, ?)",
+                    (path, document_title(path), stat.st_size, stat.st_mtime, len(chunks), time.time()),
+                ).lastrowid
+            db.executemany(
+                "INSERT INTO chunks (document_id, position, text, tokens, vector) VALUES (?, ?, ?, ?, ?)",
+                [(document_id, position, text, tokens, vector) for position, ((text, tokens), vector) in enumerate(zip(chunks, vectors))],
+            )
+        return "updated" if row else "added"
+
+    def ingest(self, folder, workers=None, prune=True):
+        """Index every .txt, .md, .docx and .pdf under ``folder``, yielding a status dict per file as it finishes.
+
+        Files unchanged since they were last indexed are skipped; with ``prune``, files
+        that have gone from the folder are dropped from the index.
+        """
+        folder = os.path.abspath(folder)
+        found = {}
+        for root, _, names in os.walk(folder):
+            for name in sorted(names):
+                if os.path.splitext(name)[1].lower() in READERS and not name.startswith("~$"):
+                    path = os.path.join(root, name)
+                    found[path] = os.stat(path)
+        with self._connect() as db:
+            known = {row["path"]: (row["size"], row["mtime"]) for row in db.execute("SELECT path, size, mtime FROM documents")}
+
+        changed = {}
+        for path, stat in found.items():
+            if known.get(path) == (stat.st_size, stat.st_mtime):
+                yield {"path": path, "status": "unchanged"}
+            else:
+                changed[path] = stat
+        with ThreadPoolExecutor(max_workers=workers or INGEST_WORKERS, thread_name_prefix="ingest") as executor:
+            futures = {executor.submit(self._prepare, path): path for path in changed}
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    chunks, vectors = future.result()
+                except Exception as error:
+                    yield {"path": path, "status": "failed", "error": str(error)}
+                    continue
+                status = self._store(path, changed[path], chunks, vectors)
+                yield {"path": path, "status": status, "chunks": len(chunks)}
+
+        if prune:
+            for path in known:
+                if path.startswith(folder + os.sep) and path not in found:
+                    self.remove(path)
+                    yield {"path": path, "status": "removed"}
+
+    def remove(self, path):
+        with self._connect() as db:
+            row = db.execute("SELECT id FROM documents WHERE path = ?", (path,)).fetchone()
+            if row:
+                db.execute("DELETE FROM chunks WHERE document_id = ?", (row["id"],))
+                db.execute("DELETE FROM documents WHERE id = ?", (row["id"],))
+
+    def stats(self):
+        with self._connect() as db:
+            documents, chunks, tokens = db.execute(
+                "SELECT (SELECT count(*) FROM documents), count(*), coalesce(sum(tokens), 0) FROM chunks"
+            ).fetchone()
+        return {"documents": documents, "chunks": chunks, "tokens": tokens}
+
+    def _vector_index(self, db):
+        # Rebuilt only after chunks were added or replaced since the last retrieval
+        version = tuple(db.execute("SELECT count(*), max(id) FROM chunks").fetchone())
+        with self._lock:
+            if version != self._vectors_version:
+                dimensions = len(self.embed(""))
+                rows = db.execute("SELECT id, vector FROM chunks WHERE length(vector) = ? ORDER BY id", (dimensions * 4,)).fetchall()
+                ids = np.array([row[0] for row in rows], dtype=np.int64)
+                matrix = np.frombuffer(b"".join(row[1] for row in rows), dtype=np.float32).reshape(len(rows), dimensions)
+                self._vectors = VectorIndex(ids, matrix)
+                self._vectors_version = version
+            return self._vectors
+
+    @metrics.timed("archive_retrieve")
+    def retrieve(self, query, max_tokens=None, k=None):
+        """The archive chunks most relevant to ``query``, best first, within ``max_tokens`` in total.
+
+        Keyword (BM25) and similarity rankings are merged by reciprocal rank fusion, so a
+        chunk that shares the request's rare words or its overall drift both rank well.
+        Chunks clearing neither MIN_BM25 nor MIN_SIMILARITY are left out, so a request the
+        archive has nothing to say about gets no passages at all.
+        """
+        max_tokens = max_tokens or CONTEXT_TOKENS
+        k = k or TOP_K
+        match = fts_query(query, STOPWORDS)
+        if not match:
+            return []
+        scores = {}
+        with self._connect() as db:
+            keyword = db.execute(
+                "SELECT rowid FROM chunks_fts WHERE chunks_fts MATCH ? AND bm25(chunks_fts) <= ? ORDER BY bm25(chunks_fts) LIMIT ?",
+                (match, -MIN_BM25, k * 4),
+            ).fetchall()
+            ranked = [[row[0] for row in keyword]]
+            if self.embed is not None and keyword:
+                hits = self._vector_index(db).search(self.embed(query), k * 4)
+                ranked.append([chunk_id for chunk_id, similarity in hits if similarity >= MIN_SIMILARITY])
+            for ranking in ranked:
+                for rank, chunk_id in enumerate(ranking):
+                    scores[chunk_id] = scores.get(chunk_id, 0) + 1 / (RRF_K + rank)
+            if not scores:
+                return []
+            rows = db.execute(
+                "SELECT chunks.id, chunks.position, chunks.text, chunks.tokens, documents.title, documents.path "
+                f"FROM chunks JOIN documents ON documents.id = chunks.document_id WHERE chunks.id IN ({', '.join('?' * len(scores))})",
+                list(scores),
+            ).fetchall()
+
+        chosen, spent = [], 0
+        for row in sorted(rows, key=lambda row: scores[row["id"]], reverse=True):
+            if spent + row["tokens"] > max_tokens:
+                continue
+            chosen.append(dict(row, score=scores[row["id"]]))
+            spent += row["tokens"]
+            if len(chosen) == k:
+                break
+        return chosen
+
+
+@lru_cache(maxsize=None)
+def get_sermon_archive():
+    return SermonArchive()
+
+
+def archive_prompt(chunks):
+    return "Passages from the pastor's own past sermons:\n\n" + "\n\n".join(f"[{chunk['title']}]\n{chunk['text']}" for chunk in chunks)
+
+
+def with_archive(messages, chunks):
+    """Insert the retrieved passages ahead of the latest message, so replies stay consistent with past preaching."""
+    if not chunks:
+        return messages
+    note = {
+        "role": "system",
+        "content": archive_prompt(chunks) + "\n\nWhere they are relevant, stay consistent with their voice, emphases and "
+        "illustrations, without repeating them at length.",
+    }
+    return messages[:-1] + [note] + messages[-1:]
@@ -0,0 +1,376 @@
+"""Streamlit pieces shared by the chat apps.
+
+Imported as ``sermon_assistant.chat_ui`` rather than from the package root, so the CLI and
+batch code never need Streamlit installed.
+"""
+import hmac
+import os
+import uuid
+from collections import Counter
+from datetime import date, datetime, time
+
+import streamlit as st
+
+from . import metrics
+from .archive import READERS, get_sermon_archive
+from .conversation import Conversation
+from .conversation_store import PAGE_SIZE, get_conversation_store
+from .jobs import get_job_queue
+from .ledger import today
+from .library import get_content_library
+from .resilience import CircuitOpenError
+from .scripture import format_passages
+from .service import REPLY_ERRORS
+from .transcript import SPEAKERS, as_transcript
+
+# Sermons added through the upload box are kept here and indexed like any other folder
+ARCHIVE_UPLOADS_PATH = os.getenv("ARCHIVE_UPLOADS_PATH", os.path.join(os.path.expanduser("~"), ".sermon_assistant", "archive-uploads"))
+# The archive is shared by everyone on the server: only someone with this key may add to it
+# from the apps, by upload or by re-indexing the one folder named in SERMON_ARCHIVE_DIR.
+# Without a key, sermons are added with `python -m sermon_assistant ingest`.
+ARCHIVE_ADMIN_KEY = os.getenv("ARCHIVE_ADMIN_KEY", "")
+ARCHIVE_DIR = os.getenv("SERMON_ARCHIVE_DIR", "")
+# Turns (a question and its reply) shown as full chat bubbles; older ones are collapsed
+CHAT_WINDOW_TURNS = int(os.getenv("CHAT_WINDOW_TURNS", "5"))
+
+# The /metrics endpoint, when METRICS_PORT is set; started once per server process
+metrics.start_metrics_server()
+
+
+def _use(conversation, mode):
+    # Make this the tab's conversation and reset the history view for it
+    st.session_state.conversation = conversation
+    st.session_state.conversation_mode = mode
+    st.session_state.history_shown = PAGE_SIZE
+    st.session_state.history_blocks = {}
+    # Pages of a resumed session read back from the store, and where the next one starts
+    st.session_state.history_loaded = []
+    st.session_state.history_before = conversation.earlier_id
+    return conversation
+
+
+def session_owner():
+    """This browser's id, kept in ``?owner=``; stored sessions are only listed and resumed for their owner."""
+    owner = st.query_params.get("owner") or st.session_state.setdefault("owner", uuid.uuid4().hex)
+    st.query_params["owner"] = owner
+    return owner
+
+
+def new_conversation(app, mode, system_prompt, greeting=None):
+    """Start a stored session for this mode and make it the one in the page URL."""
+    store = get_conversation_store()
+    conversation = Conversation(
+        system_prompt, greeting, store=store, session_id=store.create_session(app, mode, session_owner()), app=app, mode=mode,
+        library=get_content_library(),
+    )
+    st.query_params["session"] = conversation.session_id
+    return _use(conversation, mode)
+
+
+def open_conversation(app, mode, system_prompt, greeting=None):
+    """Return this browser tab's conversation, resuming the session named in the URL if there is one.
+
+    The session id lives in ``?session=``, so a refresh or a server restart picks up where
+    the user left off. Switching mode starts a new session; the old one stays in the store.
+    """
+    conversation = st.session_state.get("conversation")
+    if conversation is not None and st.session_state.get("conversation_mode") == mode:
+        return conversation
+    store = get_conversation_store()
+    owner = session_owner()
+    session = store.session(st.query_params.get("session", ""), owner)
+    if session and session["app"] == app and session["mode"] == mode:
+        return _use(Conversation.resume(store, session["id"], library=get_content_library(), owner=owner), mode)
+    return new_conversation(app, mode, system_prompt, greeting)
+
+
+def _resume(session, mode_key):
+    st.query_params["session"] = session["id"]
+    st.session_state[mode_key] = session["mode"]
+    st.session_state.pop("conversation", None)
+
+
+def past_sessions(app, mode_key, modes, format_mode=str):
+    """Sidebar list of earlier sessions. Call before the mode selectbox keyed ``mode_key``.
+
+    Also puts the selectbox back on the URL session's mode after a refresh, so
+    open_conversation() can resume it.
+    """
+    store = get_conversation_store()
+    owner = session_owner()
+    if "conversation" not in st.session_state:
+        session = store.session(st.query_params.get("session", ""), owner)
+        if session and session["app"] == app and session["mode"] in modes:
+            st.session_state[mode_key] = session["mode"]
+
+    # Sessions the user never typed into have no title and are not worth listing
+    sessions = [s for s in store.sessions(app, owner) if s["title"] and s["mode"] in modes]
+    if sessions:
+        st.sidebar.write("### 🗂️ Past conversations")
+        current = st.query_params.get("session")
+        for session in sessions:
+            label = f"{session['title']} — {format_mode(session['mode'])}"
+            st.sidebar.button(
+                label, key=f"resume_{session['id']}", disabled=session["id"] == current,
+                on_click=_resume, args=(session, mode_key),
+            )
+
+
+LIBRARY_KINDS = {"Everything": None, "Generated content": "content", "Conversations": "conversation"}
+
+
+def search_panel(app=None):
+    """Sidebar search over everything saved in the content library, so past work can be reused.
+
+    Only this browser's own conversations are found. Those from ``app`` link back to their
+    session; everything else opens in place.
+    """
+    library = get_content_library()
+    with st.sidebar.expander("🔎 Search past work"):
+        query = st.text_input("Search", key="library_query", placeholder="e.g. grief, Psalm 23, forgiveness")
+        kind = LIBRARY_KINDS[st.radio("Look in", list(LIBRARY_KINDS), key="library_kind", horizontal=True)]
+        since = st.date_input("Since", value=None, key="library_since")
+        similar = library.similarity_available and st.toggle("Similar meaning, not just the same words", key="library_similar")
+        if not query.strip():
+            return
+        since = datetime.combine(since, time()).timestamp() if isinstance(since, date) else None
+        sessions = get_conversation_store().session_ids(session_owner())
+        results = (library.similar if similar else library.search)(query, limit=10, since=since, sessions=sessions, kind=kind)
+        if not results:
+            st.caption("Nothing found.")
+        for item in results:
+            when = datetime.fromtimestamp(item["created"]).strftime("%b %d, %Y")
+            st.markdown(f"**{item['title'] or item['topic'] or 'Untitled'}** · {when}")
+            st.caption(item["snippet"])
+            if item["kind"] == "conversation" and item["app"] == app:
+                st.markdown(f"[Open this conversation](?session={item['session_id']}&owner={session_owner()})")
+            elif st.toggle("Show full text", key=f"library_item_{item['id']}"):
+                st.markdown(library.get(item["id"])["text"])
+
+
+def _ingest(archive, folder):
+    # Each file is reported as soon as it is indexed rather than when the whole folder is done
+    status = st.empty()
+    counts = Counter()
+    for result in archive.ingest(folder):
+        counts[result["status"]] += 1
+        status.caption(f"{os.path.basename(result['path'])}: {result['status']}")
+        if result["status"] == "failed":
+            st.warning(f"Could not read {os.path.basename(result['path'])}: {result['error']}")
+    status.caption(", ".join(f"{count} {name}" for name, count in counts.items()) or "No sermon files found.")
+
+
+def archive_panel():
+    """Sidebar panel showing the sermon archive replies draw on; adding to it needs ARCHIVE_ADMIN_KEY."""
+    archive = get_sermon_archive()
+    with st.sidebar.expander("📚 Your sermon archive"):
+        key = st.text_input("Admin key", type="password", key="archive_admin_key") if ARCHIVE_ADMIN_KEY else ""
+        if key and hmac.compare_digest(key, ARCHIVE_ADMIN_KEY):
+            uploads = st.file_uploader(
+                "Add past sermons", type=[extension.lstrip(".") for extension in READERS], accept_multiple_files=True,
+                key="archive_uploads",
+            )
+            if ARCHIVE_DIR:
+                st.caption(f"Indexing also picks up changes in {ARCHIVE_DIR}.")
+            if st.button("Index sermons", key="archive_index"):
+                if uploads:
+                    os.makedirs(ARCHIVE_UPLOADS_PATH, exist_ok=True)
+                    for upload in uploads:
+                        with open(os.path.join(ARCHIVE_UPLOADS_PATH, os.path.basename(upload.name)), "wb") as f:
+                            f.write(upload.getvalue())
+                    _ingest(archive, ARCHIVE_UPLOADS_PATH)
+                if ARCHIVE_DIR:
+                    _ingest(archive, ARCHIVE_DIR)
+        elif key:
+            st.error("That is not the admin key.")
+        else:
+            st.caption("Sermons are added by the administrator (`python -m sermon_assistant ingest <folder>`).")
+        stats = archive.stats()
+        st.caption(f"{stats['documents']} sermons indexed as {stats['chunks']} passages.")
+
+
+def show_sources(chunks):
+    # Which past sermons the reply drew on; only their relevant passages were sent
+    if chunks:
+        st.caption("📚 Drawing on your past sermons: " + ", ".join(dict.fromkeys(chunk["title"] for chunk in chunks)))
+
+
+def _show_more():
+    st.session_state.history_shown = st.session_state.get("history_shown", PAGE_SIZE) + PAGE_SIZE
+
+
+def _load_earlier(conversation):
+    # Older messages of a resumed session are read from the store a page at a time, only when asked for
+    before = st.session_state.get("history_before")
+    page = get_conversation_store().messages(conversation.session_id, before_id=before, limit=PAGE_SIZE)
+    chat = [m for m in page if m["role"] in SPEAKERS]
+    if chat:
+        st.session_state.history_loaded = [_markdown(chat)] + st.session_state.get("history_loaded", [])
+    st.session_state.history_before = page[0]["id"] if len(page) == PAGE_SIZE else None
+
+
+def _markdown(messages):
+    return "\n\n".join(f"**{SPEAKERS[m['role']]}:** {m['content']}" for m in messages)
+
+
+def _history_block(messages, start, end):
+    # History only ever grows at the end, so a full page of older messages never changes:
+    # its markdown is built once and reused on every rerun
+    blocks = st.session_state.setdefault("history_blocks", {})
+    markdown = blocks.get(start)
+    if markdown is None:
+        markdown = _markdown(messages[start:end])
+        if end - start == PAGE_SIZE:
+            blocks[start] = markdown
+    return markdown
+
+
+@metrics.timed("render_history")
+def show_history(conversation):
+    """Render the last CHAT_WINDOW_TURNS turns in full, with older turns collapsed above them.
+
+    Collapsed turns are not sent to the browser at all until the user opens them, and then
+    only a page at a time, each page as a single cached markdown block. Messages of a resumed
+    session that were never loaded are read from the store once the loaded ones are all shown.
+    """
+    messages = conversation.chat_messages()
+    older = max(0, len(messages) - CHAT_WINDOW_TURNS * 2)
+    before = st.session_state.get("history_before")
+    label = f"{older}+" if conversation.earlier_id else str(older)
+    if (older or conversation.earlier_id) and st.toggle(f"🕰️ Earlier in this conversation ({label} messages)", key="show_earlier"):
+        shown = st.session_state.get("history_shown", PAGE_SIZE)
+        # Pages are counted from the start of the conversation so full pages keep their cache key
+        first_page = max(0, (older - 1) // PAGE_SIZE - (shown - 1) // PAGE_SIZE)
+        if first_page:
+            st.button(f"⬆️ Show earlier messages ({first_page * PAGE_SIZE} more)", on_click=_show_more)
+        elif before:
+            st.button("⬆️ Load earlier messages", on_click=_load_earlier, args=(conversation,))
+        with st.container(border=True):
+            if not first_page:
+                for markdown in st.session_state.get("history_loaded", []):
+                    st.markdown(markdown)
+            for start in range(first_page * PAGE_SIZE, older, PAGE_SIZE):
+                st.markdown(_history_block(messages, start, min(start + PAGE_SIZE, older)))
+    for msg in messages[older:]:
+        with st.chat_message(msg["role"]):
+            st.markdown(msg["content"])
+
+
+def session_user():
+    # This browser session, as the scheduler's unit of per-user rate limiting; kept across "Start Over"
+    return st.session_state.setdefault("scheduler_user", uuid.uuid4().hex)
+
+
+def waiting_line(settings):
+    """Scheduler keywords for stream_reply(): this session's user, the mode's priority and a place-in-line notice.
+
+    Call it inside the reply bubble; the notice shows there while the request is queued.
+    """
+    notice = st.empty()
+
+    def on_wait(position):
+        if position:
+            notice.info(f"⏳ Many people are asking right now. You're number {position} in line; your reply will start shortly.")
+        else:
+            notice.empty()
+
+    return {"user": session_user(), "priority": settings.get("priority"), "on_wait": on_wait}
+
+
+def follow_job(job_id, on_progress=None):
+    """Wait for a background job, passing its text so far to ``on_progress``; returns the finished job.
+
+    The job runs off the script thread, so a rerun while waiting only stops the waiting: call
+    this again with the same id and it carries on from wherever the job has got to.
+    """
+    return get_job_queue().wait(job_id, on_progress=on_progress and (lambda job: on_progress(job["progress"] or "")))
+
+
+def export_button(label, content, file_name, key=None, session_id=None):
+    """A download button whose file, in the format its extension names, is built by a background job when clicked.
+
+    Nothing is built while the page merely reruns. The job is keyed on the transcript's digest,
+    so clicking again before anything has changed hands back the same file. With ``session_id``,
+    the stored conversation is exported whole rather than the part of it this page loaded.
+    """
+    transcript = as_transcript(content)
+    params = {"format": file_name.rsplit(".", 1)[-1], "digest": transcript.digest().hex(), "session_id": session_id}
+    payload = None if session_id else {"turns": transcript.turns}
+    user = session_user()
+
+    def build():
+        # Runs off the script thread once the button is clicked, so it cannot use st.* calls
+        jobs = get_job_queue()
+        job = jobs.wait(jobs.submit("export", params, user=user, payload=payload))
+        if job["status"] == "failed":
+            raise RuntimeError(f"Could not build {file_name}: {job['error']}")
+        return job["data"]
+
+    st.download_button(label, build, file_name=file_name, key=key, on_click="ignore")
+
+
+def _retry():
+    st.session_state.retry_reply = True
+
+
+def retry_input(conversation):
+    """The last message again, when "Try again" was pressed after its reply failed; else None."""
+    if st.session_state.pop("retry_reply", False) and conversation.messages[-1]["role"] == "user":
+        return conversation.messages[-1]["content"]
+    return None
+
+
+def _failure(error):
+    if isinstance(error, CircuitOpenError):
+        return f"The AI service is having trouble right now, so requests are paused for about {error.retry_in:.0f} seconds."
+    if getattr(error, "status_code", None) == 429:
+        return "The AI service is too busy to answer right now."
+    if isinstance(error, TimeoutError) or "Timeout" in type(error).__name__:
+        return "The reply took too long to arrive."
+    return "The AI service could not answer just now."
+
+
+def write_reply(reply):
+    """st.write_stream() for a ReplyStream, explaining a failed reply instead of ending the page with a traceback.
+
+    When no text arrived the script stops after the explanation; the message stays in the
+    history and "Try again" asks for its reply once more (see retry_input()). A reply cut off
+    part way keeps what arrived, with a note under it.
+    """
+    try:
+        st.write_stream(reply)
+    except REPLY_ERRORS as error:
+        st.error(f"😔 {_failure(error)} Your message is saved.")
+        st.button("🔁 Try again", on_click=_retry)
+        st.stop()
+    if reply.error is not None:
+        st.caption("⚠️ The connection dropped before this reply was finished, so it ends early. Ask to continue for the rest.")
+
+
+def show_scripture(passages):
+    """Quote the looked-up passages in the reply bubble; returns them as the reply's prefix for the history."""
+    quoted = format_passages(passages)
+    if not quoted:
+        return ""
+    st.markdown(quoted)
+    return quoted + "\n\n"
+
+
+def show_costs(conversation, turn=None, format_mode=str):
+    """"Behind the Scenes" figures from the cost ledger: the last reply, this conversation and today."""
+    ledger = conversation.ledger
+    with st.expander("💡 Behind the Scenes"):
+        session = ledger.totals(session_id=conversation.session_id)
+        if not session["calls"]:
+            st.write("Send a message to view token details.")
+            return
+        if turn:
+            st.write(f"This reply: {turn['input_tokens']} input + {turn['output_tokens']} output tokens (${turn['cost']:.4f})")
+        st.write(
+            f"This conversation: {session['input_tokens']} input + {session['output_tokens']} output tokens "
+            f"over {session['calls']} calls (${session['cost']:.4f})"
+        )
+        by_mode = ledger.breakdown("mode", day=today(), app=conversation.app)
+        st.write("Today, by mode: " + " | ".join(f"{format_mode(row['mode'])}: ${row['cost']:.4f}" for row in by_mode))
+        if session["estimated"]:
+            st.caption(f"{session['estimated']} call(s) came back without usage figures and were counted locally.")
@@ -0,0 +1,268 @@
+"""Headless entry point: generate ministry content without a Streamlit server.
+
+    python -m sermon_assistant generate --type "Devotional" --topic "Hope" --scripture "Romans 5:5"
+    python -m sermon_assistant generate --type "Sermon Outline" --topic "Grace" --output grace.docx
+    python -m sermon_assistant batch devotionals.jsonl --output results.jsonl
+    python -m sermon_assistant ingest ~/Sermons
+    python -m sermon_assistant search "grief" --type devotional --since 2025-03-01
+    python -m sermon_assistant types
+    python -m sermon_assistant prompts --file edited-prompts.json
+
+The reply streams to stdout; token and cost lines go to stderr so stdout stays pipeable.
+Batch input is JSON Lines, one request per line:
+
+    {"type": "Devotional", "topic": "Hope", "scripture": "Romans 5:5", "audience": "Youth"}
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import datetime
+
+from .exporters import export_docx, export_html, export_json, export_markdown, export_pdf, export_text
+from .library import get_content_library
+from .prompts import PromptRegistry, catalog
+
+EXPORTERS = {
+    ".txt": export_text,
+    ".md": export_markdown,
+    ".html": export_html,
+    ".json": export_json,
+    ".docx": export_docx,
+    ".pdf": export_pdf,
+}
+
+
+def _choice(kind, value, choices):
+    # Accept any casing, e.g. --type devotional
+    for choice in choices:
+        if choice.casefold() == value.casefold():
+            return choice
+    raise argparse.ArgumentTypeError(f"unknown {kind} {value!r}; choose from: {', '.join(choices)}")
+
+
+# Checked against the prompt file as written, so parsing never compiles or tokenizes the prompts
+def content_type_arg(value):
+    return _choice("content type", value, list(catalog()["content_types"]))
+
+
+def audience_arg(value):
+    return _choice("audience", value, catalog()["audiences"])
+
+
+def write_export(path, text):
+    exporter = EXPORTERS.get(os.path.splitext(path)[1].lower())
+    if exporter is None:
+        raise SystemExit(f"Cannot export to {path}: use one of {', '.join(EXPORTERS)}")
+    with open(path, "wb") as f:
+        f.write(exporter(text).getvalue())
+
+
+def print_usage(result, out):
+    note = " (served from cache, not charged)" if result["cached"] else ""
+    print(f"Tokens: Input: {result['input_tokens']} | Output: {result['output_tokens']}", file=out)
+    print(f"Estimated Cost: ${result['cost']:.4f} (Input: ${result['input_cost']:.4f} | Output: ${result['output_cost']:.4f}){note}", file=out)
+
+
+def one_line(error):
+    return " ".join(str(error).split()) or type(error).__name__
+
+
+def run_generate(args):
+    # The API client is imported only by the commands that call it
+    from .generation import generate
+    from .service import REPLY_ERRORS
+
+    def on_text(chunk):
+        sys.stdout.write(chunk)
+        sys.stdout.flush()
+
+    try:
+        result = generate(
+            args.type, args.topic, args.scripture, args.audience,
+            use_cache=not args.no_cache,
+            on_text=None if args.json else on_text,
+        )
+    except REPLY_ERRORS as error:
+        # No reply at all (API down, out of retries, circuit open): one line instead of a traceback
+        print(f"Error: {one_line(error)}", file=sys.stderr)
+        return 1
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False))
+    else:
+        sys.stdout.write("\n")
+    if result.get("partial"):
+        # Cut off part way: what arrived is shown, but not saved as if it were the whole piece
+        print("Warning: the reply was cut off part way; it is incomplete" + (f" and {args.output} was not written" if args.output else ""), file=sys.stderr)
+    elif args.output:
+        write_export(args.output, result["text"])
+    print_usage(result, sys.stderr)
+    return 1 if result.get("partial") else 0
+
+
+def read_jsonl(f):
+    requests = []
+    for number, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+            requests.append({
+                "content_type": content_type_arg(item.get("type") or item.get("content_type") or ""),
+                "topic": item["topic"],
+                "scripture": item.get("scripture", ""),
+                "audience": audience_arg(item.get("audience") or "General"),
+            })
+        except (ValueError, KeyError, argparse.ArgumentTypeError) as error:
+            raise SystemExit(f"Line {number}: {error}")
+    return requests
+
+
+def run_batch(args):
+    from .generation import generate_batch, summarize_batch
+
+    if args.input == "-":
+        requests = read_jsonl(sys.stdin)
+    else:
+        with open(args.input, encoding="utf-8") as f:
+            requests = read_jsonl(f)
+
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    results = []
+    try:
+        for result in generate_batch(requests, use_cache=not args.no_cache, max_workers=args.concurrency):
+            results.append(result)
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            # A cut-off item stays in the output, marked "partial": true
+            status = f"failed ({one_line(result['error'])})" if "error" in result else (
+                "partial" if result.get("partial") else "cached" if result["cached"] else "done")
+            print(f"[{len(results)}/{len(requests)}] {status}: {result['content_type']} — {result['topic']}", file=sys.stderr)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    totals = summarize_batch(results)
+    print(
+        f"{totals['items']} generated ({totals['cached']} from cache, {totals['partial']} cut off, {totals['failed']} failed) | "
+        f"Tokens: Input: {totals['input_tokens']} | Output: {totals['output_tokens']} | "
+        f"Estimated Cost: ${totals['cost']:.4f}",
+        file=sys.stderr,
+    )
+    return 1 if totals["failed"] or totals["partial"] else 0
+
+
+def date_arg(value):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").timestamp()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a date like 2025-03-01, not {value!r}")
+
+
+def run_search(args):
+    library = get_content_library()
+    if args.similar and not library.similarity_available:
+        raise SystemExit("--similar needs NumPy installed")
+    search = library.similar if args.similar else library.search
+    results = search(args.query, limit=args.limit, since=args.since, kind=args.kind, content_type=args.type)
+    for item in results:
+        if args.json:
+            print(json.dumps(dict(item, text=library.get(item["id"])["text"]), ensure_ascii=False))
+            continue
+        when = datetime.fromtimestamp(item["created"]).strftime("%Y-%m-%d")
+        print(f"#{item['id']}  {when}  {item['kind']}  {item['title'] or item['topic'] or ''}")
+        print("    " + " ".join(item["snippet"].split()))
+    if not results:
+        print("Nothing found.", file=sys.stderr)
+    return 0
+
+
+def run_ingest(args):
+    # One line per file as it is indexed, so a large archive shows progress
+    from .archive import get_sermon_archive
+
+    archive = get_sermon_archive()
+    failed = unchanged = 0
+    for result in archive.ingest(args.folder, workers=args.workers, prune=not args.keep_missing):
+        failed += result["status"] == "failed"
+        if result["status"] == "unchanged":
+            unchanged += 1
+            continue
+        detail = result.get("error") or (f"{result['chunks']} passages" if "chunks" in result else "")
+        print(f"{result['status']}: {result['path']}" + (f" ({detail})" if detail else ""), file=sys.stderr)
+    stats = archive.stats()
+    if unchanged:
+        print(f"{unchanged} unchanged since the last run", file=sys.stderr)
+    print(f"Archive: {stats['documents']} sermons, {stats['chunks']} passages, {stats['tokens']} tokens", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def run_types(args):
+    for content_type in catalog()["content_types"]:
+        print(content_type)
+    return 0
+
+
+def run_prompts(args):
+    # Check a prompt file compiles before pointing PROMPTS_PATH at it, and show what each prompt costs
+    try:
+        prompts = PromptRegistry(args.file).current()
+    except (OSError, ValueError, KeyError, TypeError) as error:
+        raise SystemExit(f"Prompt file does not compile: {error!r}")
+    for kind, entries in [("mode", prompts.modes), ("content type", prompts.content_types)] + [
+        (f"{name} role", role_set["roles"]) for name, role_set in prompts.roles.items()
+    ]:
+        for name, settings in entries.items():
+            print(f"{kind}: {name} — {prompts.tokens[settings['system_prompt']]} tokens, {settings['profile']} profile")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m sermon_assistant", description="Generate ministry content from the command line.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    gen = commands.add_parser("generate", help="generate one item, streaming it to stdout")
+    gen.add_argument("--type", required=True, type=content_type_arg, help="content type, e.g. 'Devotional'")
+    gen.add_argument("--topic", required=True)
+    gen.add_argument("--scripture", default="")
+    gen.add_argument("--audience", default="General", type=audience_arg, help="e.g. 'Youth'")
+    gen.add_argument("--output", help="also export to a .txt, .md, .html, .json, .docx or .pdf file")
+    gen.add_argument("--json", action="store_true", help="print the result as one JSON object instead of streaming text")
+    gen.add_argument("--no-cache", action="store_true", help="always regenerate instead of reusing a saved result")
+    gen.set_defaults(run=run_generate)
+
+    batch = commands.add_parser("batch", help="generate every request in a JSON Lines file")
+    batch.add_argument("input", help="JSONL file of requests, or - for stdin")
+    batch.add_argument("--output", help="write JSONL results here instead of stdout")
+    batch.add_argument("--concurrency", type=int, help="items generated in parallel (default: BATCH_CONCURRENCY)")
+    batch.add_argument("--no-cache", action="store_true")
+    batch.set_defaults(run=run_batch)
+
+    ingest = commands.add_parser("ingest", help="add a folder of past sermons (.txt, .md, .docx, .pdf) to the archive")
+    ingest.add_argument("folder")
+    ingest.add_argument("--workers", type=int, help="files read in parallel (default: ARCHIVE_INGEST_WORKERS)")
+    ingest.add_argument("--keep-missing", action="store_true", help="keep sermons whose files have been deleted")
+    ingest.set_defaults(run=run_ingest)
+
+    search = commands.add_parser("search", help="search everything generated or discussed before")
+    search.add_argument("query")
+    search.add_argument("--similar", action="store_true", help="rank by similarity instead of matching words")
+    search.add_argument("--kind", choices=["content", "conversation"])
+    search.add_argument("--type", type=content_type_arg, help="only this content type")
+    search.add_argument("--since", type=date_arg, help="only items from this date on, e.g. 2025-03-01")
+    search.add_argument("--limit", type=int, default=10)
+    search.add_argument("--json", action="store_true", help="print each match, full text included, as a JSON line")
+    search.set_defaults(run=run_search)
+
+    types = commands.add_parser("types", help="list the available content types")
+    types.set_defaults(run=run_types)
+
+    prompts = commands.add_parser("prompts", help="check a prompt file and list each system prompt's token count")
+    prompts.add_argument("--file", help="prompt file to check (default: PROMPTS_PATH)")
+    prompts.set_defaults(run=run_prompts)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.run(args)
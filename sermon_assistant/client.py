@@ -0,0 +1,58 @@
+from functools import lru_cache
+
+import tiktoken
+
+from . import metrics
+from .service import get_service
+
+MODEL = "gpt-3.5-turbo"
+
+
+# The pooled client behind the completion service, shared by every session and rerun
+def get_client():
+    return get_service().client
+
+
+# Built once per process, like st.cache_resource
+@lru_cache(maxsize=None)
+def get_tokenizer(model=MODEL):
+    return metrics.timed_tokenizer(tiktoken.encoding_for_model(model))
+
+
+def complete(messages, model=MODEL, temperature=0.7, max_tokens=1200, on_response=None, timeout=None, fallback_models=(),
+             user=None, priority=None, deadline=None):
+    # on_response gets the full response, e.g. to record its usage in the cost ledger;
+    # user and priority place the request in the scheduler's line; deadline bounds retries and fallbacks
+    response = get_service().complete(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        timeout=timeout,
+        fallback_models=fallback_models,
+        user=user,
+        priority=priority,
+        deadline=deadline,
+    )
+    if on_response:
+        on_response(response)
+    return response.choices[0].message.content
+
+
+def stream_reply(messages, model=MODEL, temperature=0.7, max_tokens=1200, timeout=None, fallback_models=(),
+                 user=None, priority=None, on_wait=None, deadline=None):
+    # Iterate for the reply text chunk by chunk as the model generates it; afterwards the
+    # returned ReplyStream holds the full text and the API-reported usage. on_wait(position)
+    # hears the request's place in line while it is queued
+    return get_service().stream(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        timeout=timeout,
+        fallback_models=fallback_models,
+        user=user,
+        priority=priority,
+        on_wait=on_wait,
+        deadline=deadline,
+    )
@@ -0,0 +1,154 @@
+import os
+
+from .service import REPLY_ERRORS
+
+# Chat format overhead: each message is wrapped as <|start|>{role}<|message|>{content}<|end|>
+# and every reply is primed with <|start|>assistant<|message|>
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+# Defaults can be tuned per deployment without touching the apps
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+CONTEXT_KEEP_TURNS = int(os.getenv("CONTEXT_KEEP_TURNS", "6"))
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "300"))
+
+SUMMARY_PREFIX = "Summary of the earlier conversation: "
+
+
+def message_tokens(tokenizer, msg):
+    # Reuse the count cached on the message when it was appended, otherwise count it once now
+    if "tokens" not in msg:
+        msg["tokens"] = TOKENS_PER_MESSAGE + len(tokenizer.encode(msg["role"])) + len(tokenizer.encode(msg["content"]))
+    return msg["tokens"]
+
+
+def llm_summarizer(complete, model):
+    # Summarize with the same chat model, capped so the summary itself stays cheap
+    def summarize(summary, messages):
+        lines = [f"{m['role'].capitalize()}: {m['content']}" for m in messages]
+        prompt = (
+            "Update the running summary of this conversation with the new turns below. "
+            "Keep names, Scripture references, prayer requests and anything the person shared about "
+            "their situation. Write in the third person, in one short paragraph.\n\n"
+            f"Current summary: {summary or '(none)'}\n\nNew turns:\n" + "\n".join(lines)
+        )
+        return complete(
+            [{"role": "user", "content": prompt}],
+            model=model,
+            temperature=0.3,
+            max_tokens=SUMMARY_MAX_TOKENS,
+        )
+    return summarize
+
+
+def extractive_summarizer(summary, messages):
+    # No-API fallback: keep the older turns as plain lines, trimmed to the summary budget later
+    lines = [f"{m['role'].capitalize()}: {m['content']}" for m in messages]
+    return "\n".join(([summary] if summary else []) + lines)
+
+
+class ContextWindow:
+    """Builds the message list actually sent to the model for one conversation.
+
+    The system prompt and the most recent turns go through verbatim, older turns are
+    folded into a single rolling summary message, and the total is held under a token
+    budget. Folding happens in batches of ``keep_turns`` turns so the summarizer is
+    called once every few turns rather than on every reply, and no single summarizer call
+    is sent more than the budget.
+    """
+
+    def __init__(self, tokenizer, summarize=None, max_tokens=None, keep_turns=None, summary_tokens=None):
+        self.tokenizer = tokenizer
+        self.summarize = summarize or extractive_summarizer
+        self.max_tokens = max_tokens or CONTEXT_TOKEN_BUDGET
+        self.keep_turns = keep_turns or CONTEXT_KEEP_TURNS
+        self.summary_tokens = summary_tokens or SUMMARY_MAX_TOKENS
+        self.reset()
+
+    def reset(self):
+        self.summary = ""
+        self.summary_message = None
+        self.folded = 0
+        self.tokens = 0
+
+    def restore(self, summary, folded, earlier=()):
+        """Pick up a resumed session's rolling summary, which covers the first ``folded`` messages after the system prompt.
+
+        ``earlier`` are stored messages, older than any loaded, that the summary does not cover yet; they are folded in now.
+        """
+        self.reset()
+        if summary:
+            self._set_summary(summary)
+        if earlier:
+            self._fold(earlier)
+        self.folded = folded
+
+    def _set_summary(self, summary):
+        self.summary = summary
+        self.summary_message = {"role": "system", "content": SUMMARY_PREFIX + summary}
+        message_tokens(self.tokenizer, self.summary_message)
+
+    def _fold(self, messages):
+        # However much is waiting (a long session just resumed), the summarizer is sent at most
+        # a budget's worth of turns at a time, oldest first
+        limit = max(1, self.max_tokens - self.summary_tokens)
+        batch, batch_tokens = [], 0
+        for message in messages:
+            tokens = message_tokens(self.tokenizer, message)
+            if batch and batch_tokens + tokens > limit:
+                self._fold_batch(batch)
+                batch, batch_tokens = [], 0
+            batch.append(message)
+            batch_tokens += tokens
+        if batch:
+            self._fold_batch(batch)
+
+    def _fold_batch(self, messages):
+        try:
+            summary = self.summarize(self.summary, messages)
+        except REPLY_ERRORS:
+            # The summary model could not answer: fold these turns as plain lines rather than fail the reply
+            summary = extractive_summarizer(self.summary, messages)
+        encoded = self.tokenizer.encode(summary)
+        if len(encoded) > self.summary_tokens:
+            # Keep the most recent part of an over-long summary
+            summary = self.tokenizer.decode(encoded[-self.summary_tokens:])
+        self._set_summary(summary)
+
+    def build(self, messages):
+        if messages and messages[0]["role"] == "system":
+            system, history = messages[:1], messages[1:]
+        else:
+            system, history = [], messages
+
+        # The conversation was reset or switched mode under us
+        if self.folded > len(history):
+            self.reset()
+
+        # Fold a whole batch once the verbatim tail grows past twice the window
+        keep = self.keep_turns * 2
+        if len(history) - self.folded > keep * 2:
+            cutoff = len(history) - keep
+            self._fold(history[self.folded:cutoff])
+            self.folded = cutoff
+
+        fixed = sum(message_tokens(self.tokenizer, m) for m in system) + TOKENS_PER_REPLY
+        recent = history[self.folded:]
+        recent_tokens = sum(message_tokens(self.tokenizer, m) for m in recent)
+        summary_tokens = message_tokens(self.tokenizer, self.summary_message) if self.summary_message else 0
+
+        # Over budget: fold the oldest verbatim messages too, but always send the latest one
+        if fixed + summary_tokens + recent_tokens > self.max_tokens and len(recent) > 1:
+            drop, dropped_tokens = 0, 0
+            while drop < len(recent) - 1 and fixed + self.summary_tokens + recent_tokens - dropped_tokens > self.max_tokens:
+                dropped_tokens += message_tokens(self.tokenizer, recent[drop])
+                drop += 1
+            self._fold(recent[:drop])
+            self.folded += drop
+            recent = recent[drop:]
+            recent_tokens -= dropped_tokens
+            summary_tokens = message_tokens(self.tokenizer, self.summary_message)
+
+        self.tokens = fixed + summary_tokens + recent_tokens
+        window = system + ([self.summary_message] if self.summary_message else []) + recent
+        return [{"role": m["role"], "content": m["content"]} for m in window]
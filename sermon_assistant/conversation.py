@@ -0,0 +1,171 @@
+from functools import partial
+
+from . import metrics
+from .client import MODEL, complete, get_tokenizer
+from .context import ContextWindow, TOKENS_PER_MESSAGE, llm_summarizer
+from .conversation_store import RESUME_MESSAGES, TITLE_LENGTH
+from .ledger import get_cost_ledger
+from .prompts import get_prompts
+from .routing import route
+from .transcript import SPEAKERS, Transcript
+
+
+class Conversation:
+    """One chat session: the message history, its running token total and the context window."""
+
+    def __init__(self, system_prompt, greeting=None, tokenizer=None, summarize=None, store=None, session_id=None,
+                 ledger=None, app=None, mode=None, library=None):
+        self.tokenizer = tokenizer or get_tokenizer()
+        self.messages = []
+        self.prompt_tokens = 0
+        # Speaker turns for export, extended as messages are added instead of rebuilt per rerun
+        self.transcript = Transcript()
+        # Every API call this conversation makes, summaries included, is charged to the ledger
+        self.ledger = ledger or get_cost_ledger()
+        self.app = app
+        self.mode = mode
+        # With a library, each question and reply is indexed for search as it is added
+        self.library = library
+        if summarize is None:
+            # Summaries are short, so they go to the light model
+            light = route("light")
+            summarize = llm_summarizer(
+                partial(complete, on_response=self._charge_summary, fallback_models=light["fallback_models"]), light["model"]
+            )
+        self.window = ContextWindow(self.tokenizer, summarize)
+        # With a store, every message is saved as it is added, so the session survives a restart
+        self.store = store
+        self.session_id = session_id
+        # After a resume, the id of the oldest message loaded when older ones are left in the store
+        self.earlier_id = None
+        # The last stored message the context window's summary covers
+        self.folded_id = None
+        self._turn = None
+        # Prompts from the registry were tokenized when it was loaded
+        static_tokens = get_prompts().tokens if self.tokenizer is get_tokenizer() else {}
+        self.add("system", system_prompt, static_tokens.get(system_prompt))
+        if greeting:
+            self.add("assistant", greeting, static_tokens.get(greeting))
+
+    @classmethod
+    def resume(cls, store, session_id, tokenizer=None, summarize=None, ledger=None, library=None, owner=None):
+        """Rebuild a stored session; token counts come from the store, so nothing is re-encoded.
+
+        Only the system prompt and the last RESUME_MESSAGES messages are loaded; ``earlier_id``
+        is where to page back from for the rest. The context window's rolling summary is restored
+        from the store; messages older than those loaded that it does not cover yet (a session saved
+        before summaries were kept) are summarized now. With an ``owner``, only that owner's session
+        can be resumed (KeyError otherwise).
+        """
+        session = store.session(session_id, owner)
+        if session is None:
+            raise KeyError(session_id)
+        system = store.first_message(session_id)
+        messages = [m for m in store.messages(session_id, limit=RESUME_MESSAGES) if m["id"] != system["id"]]
+        conversation = cls(
+            system["content"], tokenizer=tokenizer, summarize=summarize,
+            ledger=ledger, app=session["app"], mode=session["mode"], library=library,
+        )
+        if len(messages) == RESUME_MESSAGES:
+            conversation.earlier_id = messages[0]["id"]
+        messages.insert(0, system)
+        conversation.messages = messages
+        conversation.transcript = Transcript.from_messages(messages)
+        conversation.prompt_tokens = sum(m["tokens"] for m in messages)
+        conversation.store = store
+        conversation.session_id = session_id
+        folded_id = session["folded_id"] or system["id"]
+        earlier = []
+        if conversation.earlier_id and folded_id < conversation.earlier_id:
+            earlier = [m for m in store.messages(session_id) if folded_id < m["id"] < conversation.earlier_id]
+        conversation.folded_id = earlier[-1]["id"] if earlier else session["folded_id"]
+        conversation.window.restore(session["summary"], sum(m["id"] <= folded_id for m in messages[1:]), earlier)
+        if earlier:
+            conversation._save_summary()
+        return conversation
+
+    def add(self, role, content, content_tokens=None):
+        # Count each message once as it joins the history and keep a running prompt total
+        if role == "user":
+            # A user message opens a turn for the metrics; add_reply() closes it
+            self._turn = metrics.start_turn(app=self.app, mode=self.mode, session_id=self.session_id)
+        if content_tokens is None:
+            content_tokens = len(self.tokenizer.encode(content))
+        tokens = TOKENS_PER_MESSAGE + len(self.tokenizer.encode(role)) + content_tokens
+        message = {"role": role, "content": content, "tokens": tokens}
+        if self.store is not None:
+            message["id"] = self.store.append(self.session_id, role, content, tokens)
+        self.messages.append(message)
+        self.transcript.append(role, content)
+        self.prompt_tokens += tokens
+
+    def charge(self, usage, model=MODEL, text="", purpose="reply"):
+        """Record one API call in the cost ledger and return its entry.
+
+        The counts come from the API's ``usage``; only when it reported none are they
+        estimated, from the last prompt() size and a local count of ``text``.
+        """
+        if usage is not None:
+            input_tokens, output_tokens, source = usage.prompt_tokens, usage.completion_tokens, "api"
+        else:
+            input_tokens, output_tokens, source = self.input_tokens, len(self.tokenizer.encode(text)), "estimate"
+        return self.ledger.record(
+            model, input_tokens, output_tokens, source,
+            session_id=self.session_id, app=self.app, mode=self.mode, purpose=purpose,
+        )
+
+    def _charge_summary(self, response):
+        if response.usage is not None:
+            self.charge(response.usage, response.model, purpose="summary")
+
+    def add_reply(self, reply, suffix="", prefix=""):
+        """Charge a finished streamed reply and add it, plus any locally written prefix and suffix, to the history.
+
+        Only the prefix and suffix are tokenized here when the API reported usage. Returns the ledger entry.
+        """
+        entry = self.charge(reply.usage, reply.model, reply.text)
+        local_tokens = len(self.tokenizer.encode(prefix + suffix)) if prefix or suffix else 0
+        self.add("assistant", prefix + reply.text + suffix, entry["output_tokens"] + local_tokens)
+        if self.library is not None:
+            self._index_turn()
+        metrics.finish_turn(
+            self._turn, model=entry["model"], input_tokens=entry["input_tokens"], output_tokens=entry["output_tokens"],
+            cost=entry["cost"], source=entry["source"],
+        )
+        self._turn = None
+        return entry
+
+    def _index_turn(self):
+        question = next((m["content"] for m in reversed(self.messages) if m["role"] == "user"), "")
+        reply = self.messages[-1]["content"]
+        self.library.add(
+            "conversation", f"{SPEAKERS['user']}: {question}\n\n{SPEAKERS['assistant']}: {reply}",
+            key=f"{self.session_id}:{len(self.messages)}", title=" ".join(question.split())[:TITLE_LENGTH],
+            app=self.app, mode=self.mode, session_id=self.session_id,
+        )
+
+    @metrics.timed("context_window")
+    def prompt(self):
+        # The messages actually sent to the model, held under the window's token budget
+        folded = self.window.folded
+        window = self.window.build(self.messages)
+        if self.store is not None and self.window.folded != folded:
+            self._save_summary()
+        return window
+
+    def _save_summary(self):
+        # Kept with the session, so a resume does not lose what was folded out of the loaded tail
+        folded = self.window.folded
+        if not self.window.summary:
+            self.folded_id = None
+        elif folded:
+            self.folded_id = self.messages[folded]["id"]
+        self.store.save_summary(self.session_id, self.window.summary, self.folded_id)
+
+    @property
+    def input_tokens(self):
+        # Size of the last prompt() result, including the reply priming
+        return self.window.tokens
+
+    def chat_messages(self):
+        return [m for m in self.messages if m["role"] in ("user", "assistant")]
@@ -0,0 +1,142 @@
+import os
+import sqlite3
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from functools import lru_cache
+
+STORE_PATH = os.getenv("CONVERSATION_STORE_PATH", os.path.join(os.path.expanduser("~"), ".sermon_assistant", "conversations.sqlite3"))
+PAGE_SIZE = int(os.getenv("CONVERSATION_PAGE_SIZE", "20"))
+# Messages loaded when a session is resumed; older ones are read a page at a time when asked for
+RESUME_MESSAGES = int(os.getenv("CONVERSATION_RESUME_MESSAGES", "100"))
+TITLE_LENGTH = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    app TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    title TEXT,
+    owner TEXT,
+    summary TEXT,
+    folded_id INTEGER,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_app_updated ON sessions (app, updated);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL REFERENCES sessions (id),
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    tokens INTEGER NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, id);
+"""
+
+
+class ConversationStore:
+    """Chat sessions and their messages in SQLite, appended one message at a time as they are produced."""
+
+    def __init__(self, path=None):
+        self.path = path or STORE_PATH
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+            columns = {row["name"] for row in db.execute("PRAGMA table_info(sessions)")}
+            # Stores made before sessions had owners; their sessions are listed to no one
+            if "owner" not in columns:
+                db.execute("ALTER TABLE sessions ADD COLUMN owner TEXT")
+            # Stores made before the rolling summary was kept; it is rebuilt when such a session is resumed
+            for name, kind in [("summary", "TEXT"), ("folded_id", "INTEGER")]:
+                if name not in columns:
+                    db.execute(f"ALTER TABLE sessions ADD COLUMN {name} {kind}")
+            db.execute("CREATE INDEX IF NOT EXISTS sessions_owner ON sessions (owner, app, updated)")
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=10)
+        db.row_factory = sqlite3.Row
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def create_session(self, app, mode, owner=None):
+        session_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO sessions (id, app, mode, owner, created, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                (session_id, app, mode, owner, now, now),
+            )
+        return session_id
+
+    def session(self, session_id, owner=None):
+        # With an owner, someone else's session is not found at all
+        with self._connect() as db:
+            if owner is None:
+                row = db.execute("SELECT * FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            else:
+                row = db.execute("SELECT * FROM sessions WHERE id = ? AND owner = ?", (session_id, owner)).fetchone()
+        return dict(row) if row else None
+
+    def sessions(self, app, owner, limit=20):
+        # The owner's sessions, most recently active first
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT * FROM sessions WHERE app = ? AND owner = ? ORDER BY updated DESC LIMIT ?", (app, owner, limit)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def session_ids(self, owner):
+        # Every app's sessions for this owner
+        with self._connect() as db:
+            return [row[0] for row in db.execute("SELECT id FROM sessions WHERE owner = ?", (owner,))]
+
+    def append(self, session_id, role, content, tokens):
+        now = time.time()
+        # The first thing the user says names the session in the history list
+        title = " ".join(content.split())[:TITLE_LENGTH] if role == "user" else None
+        with self._connect() as db:
+            cursor = db.execute(
+                "INSERT INTO messages (session_id, role, content, tokens, created) VALUES (?, ?, ?, ?, ?)",
+                (session_id, role, content, tokens, now),
+            )
+            db.execute("UPDATE sessions SET updated = ?, title = COALESCE(title, ?) WHERE id = ?", (now, title, session_id))
+        return cursor.lastrowid
+
+    def save_summary(self, session_id, summary, folded_id):
+        # The context window's rolling summary, covering every message up to and including folded_id
+        with self._connect() as db:
+            db.execute("UPDATE sessions SET summary = ?, folded_id = ? WHERE id = ?", (summary, folded_id, session_id))
+
+    def messages(self, session_id, before_id=None, limit=None):
+        """The session's messages in order; with a ``limit``, only the last ``limit`` before ``before_id``."""
+        with self._connect() as db:
+            if limit is None:
+                rows = db.execute(
+                    "SELECT id, role, content, tokens FROM messages WHERE session_id = ? ORDER BY id", (session_id,)
+                ).fetchall()
+            else:
+                rows = db.execute(
+                    "SELECT id, role, content, tokens FROM messages WHERE session_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                    (session_id, sys.maxsize if before_id is None else before_id, limit),
+                ).fetchall()[::-1]
+        return [dict(row) for row in rows]
+
+    def first_message(self, session_id):
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT id, role, content, tokens FROM messages WHERE session_id = ? ORDER BY id LIMIT 1", (session_id,)
+            ).fetchone()
+        return dict(row) if row else None
+
+
+@lru_cache(maxsize=None)
+def get_conversation_store():
+    return ConversationStore()
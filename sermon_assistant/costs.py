@@ -0,0 +1,59 @@
+import json
+import os
+
+from .client import MODEL
+from .routing import ROUTES
+
+# USD per 1K tokens as (input, output). MODEL_PRICES overrides or extends the table with a
+# JSON object, or the path to a JSON file, e.g. {"gpt-4o-mini": [0.00015, 0.0006]}
+DEFAULT_PRICES = {
+    "gpt-3.5-turbo": (0.0015, 0.002),
+    "gpt-4o-mini": (0.00015, 0.0006),
+    "gpt-4o": (0.0025, 0.01),
+    "gpt-4-turbo": (0.01, 0.03),
+    "gpt-4": (0.03, 0.06),
+}
+
+
+def load_prices(setting=None):
+    prices = dict(DEFAULT_PRICES)
+    setting = os.getenv("MODEL_PRICES", "") if setting is None else setting
+    if setting.strip():
+        if not setting.lstrip().startswith("{"):
+            with open(setting, encoding="utf-8") as f:
+                setting = f.read()
+        prices.update({model: tuple(price) for model, price in json.loads(setting).items()})
+    return prices
+
+
+PRICES = load_prices()
+
+
+def price_for(model):
+    """(input, output) USD per 1K tokens; dated snapshots such as gpt-3.5-turbo-0125 use their family's price."""
+    if model in PRICES:
+        return PRICES[model]
+    family = max((name for name in PRICES if model.startswith(name)), key=len, default=None)
+    if family is None:
+        raise KeyError(f"No price for model {model!r}; add it to MODEL_PRICES")
+    return PRICES[family]
+
+
+def check_prices(routes=None):
+    """Fail at startup, rather than after a reply has streamed, when a routed or fallback model has no price."""
+    for name, settings in (routes or ROUTES).items():
+        for model in [settings["model"], *settings.get("fallbacks", ())]:
+            try:
+                price_for(model)
+            except KeyError:
+                raise KeyError(f"No price for model {model!r} in the {name!r} route; add it to MODEL_PRICES")
+
+
+def estimate_cost(input_tokens, output_tokens, model=MODEL):
+    price_in, price_out = price_for(model)
+    input_cost = (input_tokens / 1000) * price_in
+    output_cost = (output_tokens / 1000) * price_out
+    return input_cost, output_cost, input_cost + output_cost
+
+
+check_prices()
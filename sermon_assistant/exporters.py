@@ -0,0 +1,226 @@
+import html
+import json
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache, wraps
+from io import BytesIO
+
+from . import metrics
+from .transcript import SPEAKERS, as_transcript, paragraphs
+
+# Built files are kept per format, keyed by the transcript's running hash, so a rerun that
+# did not change the conversation hands back the same bytes instead of rebuilding them
+EXPORT_CACHE_SIZE = 32
+_export_cache = OrderedDict()
+_export_lock = threading.Lock()
+
+
+def cached_export(build):
+    # Exporters take a Transcript or a plain string and build from the Transcript
+    @wraps(build)
+    def export(content):
+        transcript = as_transcript(content)
+        key = (build.__name__, transcript.digest())
+        with _export_lock:
+            data = _export_cache.get(key)
+            if data is not None:
+                _export_cache.move_to_end(key)
+        metrics.count("sermon_cache_requests_total", cache="export", result="miss" if data is None else "hit")
+        if data is None:
+            with metrics.span("export", format=build.__name__.replace("export_", "")):
+                data = build(transcript).getvalue()
+            with _export_lock:
+                _export_cache[key] = data
+                if len(_export_cache) > EXPORT_CACHE_SIZE:
+                    _export_cache.popitem(last=False)
+        # Fresh buffer every time: download buttons read their data to the end
+        return BytesIO(data)
+    return export
+
+
+def export_text(content):
+    return BytesIO(as_transcript(content).text.encode())
+
+
+@cached_export
+def export_markdown(transcript):
+    blocks = []
+    for role, content in transcript.turns:
+        if role:
+            blocks.append(f"### {SPEAKERS[role]}")
+        blocks.append(content)
+    return BytesIO("\n\n".join(blocks).encode())
+
+
+HTML_PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Conversation</title>
+<style>
+body {{ font-family: sans-serif; max-width: 46em; margin: 2em auto; line-height: 1.5; }}
+.turn {{ margin-bottom: 1.5em; }}
+.speaker {{ font-weight: bold; margin-bottom: 0.25em; }}
+.user .speaker {{ color: #1f5fa8; }}
+.assistant .speaker {{ color: #5b3a91; }}
+</style></head>
+<body>
+{body}
+</body></html>
+"""
+
+
+@cached_export
+def export_html(transcript):
+    turns = []
+    for role, content in transcript.turns:
+        body = "".join(f"<p>{html.escape(paragraph).replace(chr(10), '<br>')}</p>" for paragraph in paragraphs(content))
+        speaker = f'<div class="speaker">{SPEAKERS[role]}</div>' if role else ""
+        turns.append(f'<div class="turn {role or ""}">{speaker}{body}</div>')
+    return BytesIO(HTML_PAGE.format(body="\n".join(turns)).encode())
+
+
+@cached_export
+def export_json(transcript):
+    turns = [{"role": role, "speaker": SPEAKERS.get(role), "content": content} for role, content in transcript.turns]
+    return BytesIO(json.dumps({"turns": turns}, ensure_ascii=False, indent=2).encode())
+
+
+@cached_export
+def export_docx(transcript):
+    # Imported here so the headless CLI only pays for python-docx when it writes a .docx
+    from docx import Document
+
+    doc = Document()
+    for role, content in transcript.turns:
+        if role:
+            doc.add_paragraph().add_run(SPEAKERS[role]).bold = True
+        for paragraph in paragraphs(content):
+            doc.add_paragraph(paragraph)
+    buffer = BytesIO()
+    doc.save(buffer)
+    buffer.seek(0)
+    return buffer
+
+
+# A Unicode TTF keeps em-dashes, smart quotes and Greek/Hebrew in Bible study notes intact.
+# PDF_FONT_PATH wins; otherwise the first common system font found is embedded.
+PDF_FONT_CANDIDATES = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/TTF/DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/noto/NotoSans-Regular.ttf",
+    "/Library/Fonts/Arial Unicode.ttf",
+    "/System/Library/Fonts/Supplemental/Arial Unicode.ttf",
+    "C:\\Windows\\Fonts\\arial.ttf",
+]
+PDF_BOLD_SUFFIXES = [("DejaVuSans.ttf", "DejaVuSans-Bold.ttf"), ("-Regular.ttf", "-Bold.ttf"), ("arial.ttf", "arialbd.ttf")]
+
+
+@lru_cache(maxsize=None)
+def find_pdf_font():
+    """Return (regular, bold) TTF paths for PDF export; bold may be None, both None without a font."""
+    candidates = [os.getenv("PDF_FONT_PATH")] + PDF_FONT_CANDIDATES
+    regular = next((path for path in candidates if path and os.path.isfile(path)), None)
+    if regular is None:
+        return None, None
+    bold = os.getenv("PDF_FONT_BOLD_PATH")
+    if not bold:
+        for plain, heavy in PDF_BOLD_SUFFIXES:
+            if regular.endswith(plain) and os.path.isfile(regular[:-len(plain)] + heavy):
+                bold = regular[:-len(plain)] + heavy
+                break
+    return regular, bold
+
+
+class _Latin1Table(dict):
+    # str.translate table for the built-in Helvetica fallback: typographic punctuation gets
+    # an ASCII stand-in and anything else outside Latin-1 becomes "?", decided once per character
+    def __missing__(self, codepoint):
+        self[codepoint] = codepoint if codepoint < 256 else ord("?")
+        return self[codepoint]
+
+
+class _UnicodeTable(dict):
+    # Emoji and other astral-plane symbols are not in text fonts, so they are dropped
+    def __missing__(self, codepoint):
+        self[codepoint] = None if codepoint > 0xFFFF or codepoint == 0xFE0F else codepoint
+        return self[codepoint]
+
+
+LATIN1_TABLE = _Latin1Table(str.maketrans({
+    "—": "-",    # em-dash
+    "–": "-",    # en-dash
+    "“": '"',    # left quote
+    "”": '"',    # right quote
+    "‘": "'",    # left apostrophe
+    "’": "'",    # right apostrophe
+    "…": "...",  # ellipsis
+}))
+UNICODE_TABLE = _UnicodeTable()
+
+
+def sanitize_text(text):
+    return text.translate(LATIN1_TABLE)
+
+
+def write_wrapped(pdf, text, line_height, widths):
+    """Lay out a paragraph with a greedy word wrap, one cell per output line.
+
+    Word widths are measured once per distinct word and kept in ``widths`` (one dict per
+    document and font), which is far cheaper than fpdf's per-character line breaker.
+    Single newlines inside the paragraph stay line breaks.
+    """
+    max_width = pdf.epw
+    space = pdf.get_string_width(" ")
+    for raw_line in text.split("\n"):
+        words = raw_line.split(" ")
+        measured = []
+        for word in words:
+            width = widths.get(word)
+            if width is None:
+                width = widths[word] = pdf.get_string_width(word)
+            measured.append(width)
+        if measured and max(measured) > max_width:
+            # A word wider than the page (e.g. a long URL) needs fpdf's character-level breaking
+            pdf.multi_cell(0, line_height, raw_line, align="L", new_x="LMARGIN", new_y="NEXT")
+            continue
+        line, line_width = [], 0.0
+        for word, width in zip(words, measured):
+            if line and line_width + space + width > max_width:
+                pdf.cell(0, line_height, " ".join(line), new_x="LMARGIN", new_y="NEXT")
+                line, line_width = [], 0.0
+            line_width = line_width + space + width if line else width
+            line.append(word)
+        pdf.cell(0, line_height, " ".join(line), new_x="LMARGIN", new_y="NEXT")
+
+
+@cached_export
+def export_pdf(transcript):
+    from fpdf import FPDF
+
+    pdf = FPDF()
+    pdf.set_auto_page_break(auto=True, margin=15)
+    regular, bold = find_pdf_font()
+    if regular:
+        pdf.add_font("Body", "", regular)
+        if bold:
+            pdf.add_font("Body", "B", bold)
+        family, bold_style, table = "Body", "B" if bold else "", UNICODE_TABLE
+    else:
+        family, bold_style, table = "Helvetica", "B", LATIN1_TABLE
+    pdf.set_font(family, size=12)
+    pdf.add_page()
+
+    widths = {}
+    for role, content in transcript.turns:
+        if role:
+            pdf.set_font(family, bold_style, 12)
+            pdf.cell(0, 7, SPEAKERS[role], new_x="LMARGIN", new_y="NEXT")
+            pdf.set_font(family, "", 12)
+        for paragraph in paragraphs(content.translate(table)):
+            write_wrapped(pdf, paragraph, 6, widths)
+            pdf.ln(4)
+
+    buffer = BytesIO()
+    pdf.output(buffer)
+    buffer.seek(0)
+    return buffer
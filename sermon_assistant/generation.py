@@ -0,0 +1,148 @@
+import csv
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from . import metrics
+from .archive import archive_prompt, get_sermon_archive
+from .client import complete, get_tokenizer, stream_reply
+from .costs import estimate_cost
+from .ledger import get_cost_ledger
+from .library import get_content_library
+from .prompts import get_prompts
+from .response_cache import get_response_cache
+from .routing import route
+from .scheduler import BATCH_PRIORITY
+from .scripture import find_passages, scripture_prompt
+
+LEDGER_APP = "content_generator"
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "6"))
+
+
+@metrics.timed("generate")
+def generate(content_type, topic, scripture, audience, use_cache=True, on_text=None, use_archive=True, user=None, priority=None):
+    """Generate one piece of content, serving it from the response cache when allowed.
+
+    With ``on_text`` the reply is streamed and each chunk is passed to it as it arrives; a
+    stream cut off part way returns what arrived with ``partial`` set, and is not cached.
+    With ``use_archive`` the most relevant passages of the church's past sermons go into
+    the prompt; their titles are returned as ``sources``. ``user`` and ``priority`` (by
+    default the content type's) place the request in the scheduler's line.
+    """
+    prompts = get_prompts()
+    system_prompt = prompts.content_types[content_type]["system_prompt"]
+    user_prompt = prompts.content_user_prompt(content_type, topic, scripture, audience)
+    # The exact verses from the local Bible, so the model quotes rather than recalls them
+    passages = find_passages(scripture) if scripture else []
+    if passages:
+        user_prompt += f"\n\n{scripture_prompt(passages)}\n\nQuote Scripture only from this text."
+    # Only the best-matching chunks of past sermons, within the archive's token budget
+    sources = get_sermon_archive().retrieve(f"{topic} {scripture}") if use_archive else []
+    if sources:
+        user_prompt += f"\n\n{archive_prompt(sources)}\n\nKeep it consistent with this past preaching where relevant."
+    result = {
+        "content_type": content_type, "topic": topic, "scripture": scripture, "audience": audience,
+        "passages": passages, "sources": list(dict.fromkeys(chunk["title"] for chunk in sources)),
+    }
+    # Each content type's model, length budget and fallbacks
+    settings = route(prompts.content_types[content_type]["profile"])
+    if priority is None:
+        priority = prompts.content_types[content_type].get("priority")
+
+    cache = get_response_cache()
+    cache_key = cache.key(system_prompt, user_prompt, settings["model"], settings["temperature"])
+    cached = cache.get(cache_key) if use_cache else None
+    if cached:
+        input_cost, output_cost, total_cost = estimate_cost(cached["input_tokens"], cached["output_tokens"], settings["model"])
+        result.update(text=cached["text"], input_tokens=cached["input_tokens"], output_tokens=cached["output_tokens"], cached=True)
+        if on_text:
+            on_text(cached["text"])
+    else:
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ]
+        if on_text:
+            reply = stream_reply(messages, user=user, priority=priority, **settings)
+            for chunk in reply:
+                on_text(chunk)
+            text, usage, model, partial = reply.text, reply.usage, reply.model, reply.error is not None
+        else:
+            responses = []
+            text = complete(messages, on_response=responses.append, user=user, priority=priority, **settings)
+            usage, model, partial = responses[0].usage, responses[0].model, False
+        if usage is not None:
+            input_tokens, output_tokens, source = usage.prompt_tokens, usage.completion_tokens, "api"
+        else:
+            tokenizer = get_tokenizer()
+            input_tokens = len(tokenizer.encode(system_prompt)) + len(tokenizer.encode(user_prompt))
+            output_tokens, source = len(tokenizer.encode(text)), "estimate"
+        entry = get_cost_ledger().record(
+            model or settings["model"], input_tokens, output_tokens, source, app=LEDGER_APP, mode=content_type, purpose="content"
+        )
+        input_cost, output_cost, total_cost = entry["input_cost"], entry["output_cost"], entry["cost"]
+        if not partial:
+            cache.put(cache_key, text, input_tokens, output_tokens, total_cost)
+            # Kept in the content library, so it can be found and reused long after the cache entry expires
+            get_content_library().add(
+                "content", text, key=cache_key, title=f"{content_type}: {topic}", app=LEDGER_APP,
+                content_type=content_type, topic=topic, scripture=scripture, audience=audience,
+            )
+        result.update(text=text, input_tokens=input_tokens, output_tokens=output_tokens, cached=False, partial=partial)
+
+    result.update(input_cost=input_cost, output_cost=output_cost, cost=total_cost)
+    return result
+
+
+def batch_requests(rows, content_types=None):
+    # One request per (topic row, content type), in sermon-series order
+    content_types = content_types or list(get_prompts().content_types)
+    return [
+        {"content_type": content_type, "topic": row["topic"], "scripture": row.get("scripture", ""), "audience": row.get("audience") or "General"}
+        for row in rows
+        for content_type in content_types
+    ]
+
+
+def read_topics_csv(data):
+    """Parse a sermon-series CSV with a ``topic`` column and optional ``scripture`` and ``audience``."""
+    if isinstance(data, bytes):
+        data = data.decode("utf-8-sig")
+    reader = csv.DictReader(io.StringIO(data))
+    rows = []
+    for row in reader:
+        row = {(key or "").strip().lower(): (value or "").strip() for key, value in row.items()}
+        if row.get("topic"):
+            rows.append(row)
+    if not rows:
+        raise ValueError("The CSV needs a 'topic' column with at least one filled-in row")
+    return rows
+
+
+def generate_batch(requests, use_cache=True, max_workers=None):
+    """Run many generate() requests with bounded parallelism, yielding results as they finish.
+
+    A batch takes about as long as its slowest items rather than the sum of all of them.
+    Failed items are yielded with an ``error`` instead of stopping the rest of the batch.
+    Items queue behind interactive requests, so a big series never holds up a chat reply.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers or BATCH_CONCURRENCY, thread_name_prefix="batch") as executor:
+        futures = {executor.submit(generate, use_cache=use_cache, priority=BATCH_PRIORITY, **request): request for request in requests}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as error:
+                yield dict(futures[future], error=str(error))
+
+
+def summarize_batch(results):
+    done = [r for r in results if "error" not in r]
+    return {
+        "items": len(done),
+        "failed": len(results) - len(done),
+        "cached": sum(1 for r in done if r["cached"]),
+        "partial": sum(1 for r in done if r.get("partial")),
+        "input_tokens": sum(r["input_tokens"] for r in done),
+        "output_tokens": sum(r["output_tokens"] for r in done),
+        "cost": sum(r["cost"] for r in done if not r["cached"]),
+    }
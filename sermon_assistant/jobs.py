@@ -0,0 +1,306 @@
+"""Background jobs for work that should outlive a Streamlit rerun: long generations and large exports.
+
+Jobs are rows in SQLite, run by worker threads in the server process and claimed with an
+atomic update, so every app process sharing the file can pick up queued work. A click while
+a sermon outline is being written reruns the page but not the job: the page finds the job
+again by its id and carries on showing it. Submitting the same request while it is queued or
+running returns the job already under way instead of paying for the request twice.
+"""
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from functools import lru_cache
+
+from .conversation_store import get_conversation_store
+from .exporters import export_docx, export_html, export_json, export_markdown, export_pdf, export_text
+from .generation import generate
+from .scheduler import DEFAULT_PRIORITY
+from .transcript import Transcript
+
+JOBS_PATH = os.getenv("JOBS_PATH", os.path.join(os.path.expanduser("~"), ".sermon_assistant", "jobs.sqlite3"))
+# Enough for a batch (BATCH_CONCURRENCY) with room for interactive jobs alongside it
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "8"))
+# A running job whose process has not sent a heartbeat in this long (and, on this host, is
+# no longer running) has stopped; it is queued again. Heartbeats go every quarter of this.
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "300"))
+# Finished jobs, and their results, are kept this long
+JOB_TTL = float(os.getenv("JOB_TTL", str(24 * 3600)))
+POLL_SECONDS = 0.25
+# Streamed text is written to the job at most this often
+PROGRESS_SECONDS = 0.5
+ACTIVE = ("queued", "running")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    key TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    payload TEXT,
+    worker TEXT,
+    user TEXT,
+    priority INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    progress TEXT,
+    result TEXT,
+    data BLOB,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key, updated);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, priority, created);
+"""
+
+EXPORTERS = {
+    "txt": export_text, "md": export_markdown, "html": export_html,
+    "json": export_json, "docx": export_docx, "pdf": export_pdf,
+}
+
+
+def _generate(params, user, priority, progress):
+    parts = []
+
+    def on_text(chunk):
+        parts.append(chunk)
+        progress("".join(parts))
+
+    return generate(**params, on_text=on_text, user=user, priority=priority), None
+
+
+def _export(params, user, priority, progress):
+    if params["format"] not in EXPORTERS:
+        raise ValueError(f"Cannot export as {params['format']!r}")
+    if params.get("session_id"):
+        # A stored conversation is exported whole, including messages its page never loaded
+        transcript = Transcript.from_messages(get_conversation_store().messages(params["session_id"]))
+    else:
+        transcript = Transcript(tuple(turn) for turn in params["turns"])
+    return None, EXPORTERS[params["format"]](transcript).getvalue()
+
+
+# Each kind's runner, returning (JSON result, bytes), and how long a finished job is handed
+# out again for the same request: exports are the same bytes every time, while a generation
+# asked for again after it finished is a deliberate "regenerate"
+KINDS = {
+    "generate": (_generate, 0),
+    "export": (_export, JOB_TTL),
+}
+
+
+class JobQueue:
+    """Jobs in SQLite with ``workers`` threads running them; 0 workers only queues and reads them."""
+
+    def __init__(self, path=None, workers=None, stale_seconds=None):
+        self.path = path or JOBS_PATH
+        self.stale_seconds = JOB_STALE_SECONDS if stale_seconds is None else stale_seconds
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+            columns = {row["name"] for row in db.execute("PRAGMA table_info(jobs)")}
+            for column in ("payload", "worker"):
+                if column not in columns:
+                    db.execute(f"ALTER TABLE jobs ADD COLUMN {column} TEXT")
+        # Wakes idle workers on a submit and waiters on a finish in this process; other
+        # processes' jobs are noticed by polling
+        self._changed = threading.Condition()
+        self._swept = 0.0
+        # Which process is running a job, and the jobs this one is running
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self._running = set()
+        workers = JOB_WORKERS if workers is None else workers
+        for number in range(workers):
+            threading.Thread(target=self._work, name=f"job-worker-{number}", daemon=True).start()
+        if workers:
+            threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True).start()
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=10)
+        db.row_factory = sqlite3.Row
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def key(self, kind, params):
+        return hashlib.sha256(json.dumps([kind, params], sort_keys=True).encode()).hexdigest()
+
+    def _existing(self, db, key, reuse_seconds, now):
+        row = db.execute(
+            "SELECT id FROM jobs WHERE key = ? AND (status IN (?, ?) OR (status = 'done' AND updated >= ?)) "
+            "ORDER BY created DESC LIMIT 1",
+            (key, *ACTIVE, now - reuse_seconds),
+        ).fetchone()
+        return row and row["id"]
+
+    def submit(self, kind, params, user=None, priority=None, payload=None):
+        """Queue a job and return its id, or the id of the same request already queued, running or reusable.
+
+        ``params`` identify the request; ``payload`` holds bulky inputs (a transcript to export)
+        that ``params`` already identify, e.g. by a digest. It is stored with a new job, merged
+        into its params when it runs, and left out of the key.
+        """
+        reuse_seconds = KINDS[kind][1]
+        key = self.key(kind, params)
+        now = time.time()
+        # Most repeat submissions (a double click, a second download) are answered by a read
+        with self._connect() as db:
+            job_id = self._existing(db, key, reuse_seconds, now)
+        if job_id:
+            return job_id
+        with self._connect() as db:
+            # Check again holding the write lock, so two clicks racing each other still make one job
+            db.execute("BEGIN IMMEDIATE")
+            job_id = self._existing(db, key, reuse_seconds, now)
+            if job_id:
+                return job_id
+            job_id = uuid.uuid4().hex
+            db.execute(
+                "INSERT INTO jobs (id, key, kind, params, payload, user, priority, status, created, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, 'queued', ?, ?)",
+                (
+                    job_id, key, kind, json.dumps(params), None if payload is None else json.dumps(payload), user,
+                    DEFAULT_PRIORITY if priority is None else priority, now, now,
+                ),
+            )
+            db.execute("DELETE FROM jobs WHERE status NOT IN (?, ?) AND updated < ?", (*ACTIVE, now - JOB_TTL))
+        with self._changed:
+            self._changed.notify_all()
+        return job_id
+
+    def get(self, job_id):
+        """The job as a dict: status ("queued", "running", "done" or "failed"), progress, result, data and error."""
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT id, kind, status, progress, result, data, error, created, updated FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def wait(self, job_id, timeout=None, on_progress=None):
+        """Poll until the job finishes (or ``timeout`` passes), passing each new bit of progress to ``on_progress``."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        progress = None
+        while True:
+            job = self.get(job_id)
+            if job is None or job["status"] not in ACTIVE:
+                return job
+            if on_progress and job["progress"] != progress:
+                progress = job["progress"]
+                on_progress(job)
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return job
+            with self._changed:
+                self._changed.wait(POLL_SECONDS if remaining is None else min(POLL_SECONDS, remaining))
+
+    def _heartbeat(self):
+        # Marks this process's jobs alive however long they go without progress, e.g. a PDF being laid out
+        while True:
+            time.sleep(self.stale_seconds / 4)
+            running = list(self._running)
+            if not running:
+                continue
+            try:
+                with self._connect() as db:
+                    db.execute(
+                        f"UPDATE jobs SET updated = ? WHERE status = 'running' AND id IN ({', '.join('?' * len(running))})",
+                        (time.time(), *running),
+                    )
+            except sqlite3.OperationalError:
+                pass
+
+    def _alive(self, worker):
+        # Only a process on this host can be checked; elsewhere the missed heartbeats decide
+        host, _, pid = (worker or "").rpartition(":")
+        if host != socket.gethostname() or not pid.isdigit():
+            return False
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return False
+        except OSError:
+            pass
+        return True
+
+    def _claim(self):
+        now = time.time()
+        with self._connect() as db:
+            if now - self._swept > self.stale_seconds / 4:
+                self._swept = now
+                # Jobs left running by a process that stopped go back in the line
+                for row in db.execute(
+                    "SELECT id, worker FROM jobs WHERE status = 'running' AND updated < ?", (now - self.stale_seconds,)
+                ).fetchall():
+                    if not self._alive(row["worker"]):
+                        db.execute(
+                            "UPDATE jobs SET status = 'queued', worker = NULL WHERE id = ? AND status = 'running' AND updated < ?",
+                            (row["id"], now - self.stale_seconds),
+                        )
+            for row in db.execute(
+                "SELECT id, kind, params, payload, user, priority FROM jobs WHERE status = 'queued' ORDER BY priority, created LIMIT 8"
+            ).fetchall():
+                # Another worker, here or in another process, may have taken it first
+                if db.execute(
+                    "UPDATE jobs SET status = 'running', worker = ?, updated = ? WHERE id = ? AND status = 'queued'",
+                    (self.worker, now, row["id"]),
+                ).rowcount:
+                    return row
+        return None
+
+    def _work(self):
+        while True:
+            try:
+                job = self._claim()
+                if job is not None:
+                    self._run(job)
+                    continue
+            except sqlite3.OperationalError:
+                # Database busy past its timeout; a job caught mid-way is picked up again once stale
+                pass
+            with self._changed:
+                self._changed.wait(POLL_SECONDS * 4)
+
+    def _update(self, job_id, **fields):
+        fields["updated"] = time.time()
+        with self._connect() as db:
+            db.execute(f"UPDATE jobs SET {', '.join(f'{name} = ?' for name in fields)} WHERE id = ?", (*fields.values(), job_id))
+
+    def _run(self, job):
+        run = KINDS[job["kind"]][0]
+        written = [0.0]
+
+        def progress(text):
+            if time.monotonic() - written[0] >= PROGRESS_SECONDS:
+                written[0] = time.monotonic()
+                self._update(job["id"], progress=text)
+
+        self._running.add(job["id"])
+        try:
+            params = dict(json.loads(job["params"]), **json.loads(job["payload"] or "{}"))
+            result, data = run(params, job["user"], job["priority"], progress)
+        except Exception as error:
+            self._update(job["id"], status="failed", error=str(error) or type(error).__name__)
+        else:
+            self._update(job["id"], status="done", result=None if result is None else json.dumps(result), data=data)
+        finally:
+            self._running.discard(job["id"])
+        with self._changed:
+            self._changed.notify_all()
+
+
+@lru_cache(maxsize=None)
+def get_job_queue():
+    return JobQueue()
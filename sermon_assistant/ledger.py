@@ -0,0 +1,114 @@
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+
+from . import metrics
+from .costs import estimate_cost
+
+LEDGER_PATH = os.getenv("COST_LEDGER_PATH", os.path.join(os.path.expanduser("~"), ".sermon_assistant", "costs.sqlite3"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS calls (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created REAL NOT NULL,
+    day TEXT NOT NULL,
+    session_id TEXT,
+    app TEXT,
+    mode TEXT,
+    purpose TEXT NOT NULL,
+    model TEXT NOT NULL,
+    input_tokens INTEGER NOT NULL,
+    output_tokens INTEGER NOT NULL,
+    input_cost REAL NOT NULL,
+    output_cost REAL NOT NULL,
+    cost REAL NOT NULL,
+    source TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS calls_session ON calls (session_id);
+CREATE INDEX IF NOT EXISTS calls_day ON calls (day);
+"""
+GROUPS = ("day", "app", "mode", "model", "purpose", "session_id")
+
+
+def today():
+    return time.strftime("%Y-%m-%d")
+
+
+class CostLedger:
+    """One row per API call with the tokens it used and what it cost, in SQLite.
+
+    ``source`` is "api" when the counts came from the response's usage and "estimate"
+    when the API reported none and they were counted locally.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or LEDGER_PATH
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=10)
+        db.row_factory = sqlite3.Row
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def record(self, model, input_tokens, output_tokens, source="api", session_id=None, app=None, mode=None, purpose="reply"):
+        input_cost, output_cost, cost = estimate_cost(input_tokens, output_tokens, model)
+        entry = {
+            "created": time.time(), "day": today(), "session_id": session_id, "app": app, "mode": mode,
+            "purpose": purpose, "model": model, "input_tokens": input_tokens, "output_tokens": output_tokens,
+            "input_cost": input_cost, "output_cost": output_cost, "cost": cost, "source": source,
+        }
+        with self._connect() as db:
+            db.execute(f"INSERT INTO calls ({', '.join(entry)}) VALUES ({', '.join('?' * len(entry))})", tuple(entry.values()))
+        metrics.count("sermon_tokens_total", input_tokens, model=model, kind="input")
+        metrics.count("sermon_tokens_total", output_tokens, model=model, kind="output")
+        metrics.count("sermon_cost_dollars_total", cost, model=model)
+        return entry
+
+    def _where(self, filters):
+        filters = {name: value for name, value in filters.items() if value is not None}
+        for name in filters:
+            if name not in GROUPS:
+                raise ValueError(f"Cannot filter the ledger by {name!r}")
+        clause = " AND ".join(f"{name} = ?" for name in filters)
+        return (f" WHERE {clause}" if clause else ""), tuple(filters.values())
+
+    def totals(self, **filters):
+        """Sum of calls matching filters such as session_id=..., mode=..., day=..."""
+        where, params = self._where(filters)
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT COUNT(*) AS calls, COALESCE(SUM(input_tokens), 0) AS input_tokens, "
+                "COALESCE(SUM(output_tokens), 0) AS output_tokens, COALESCE(SUM(cost), 0.0) AS cost, "
+                "COALESCE(SUM(source = 'estimate'), 0) AS estimated FROM calls" + where,
+                params,
+            ).fetchone()
+        return dict(row)
+
+    def breakdown(self, by, **filters):
+        """Totals grouped by one of GROUPS (e.g. by="mode", day=today()), most expensive first."""
+        if by not in GROUPS:
+            raise ValueError(f"Cannot group the ledger by {by!r}")
+        where, params = self._where(filters)
+        with self._connect() as db:
+            rows = db.execute(
+                f"SELECT {by}, COUNT(*) AS calls, SUM(input_tokens) AS input_tokens, "
+                f"SUM(output_tokens) AS output_tokens, SUM(cost) AS cost FROM calls{where} "
+                f"GROUP BY {by} ORDER BY cost DESC",
+                params,
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+
+@lru_cache(maxsize=None)
+def get_cost_ledger():
+    return CostLedger()
@@ -0,0 +1,284 @@
+"""Everything the assistant has written, kept and searchable.
+
+Generated content and chat replies are stored with their metadata (app, mode, content
+type, topic, scripture, audience, date) and indexed twice: an SQLite FTS5 index for
+keyword search, and, when NumPy is installed, a vector per item for similarity search.
+The default vectors hash words and word pairs, so nothing leaves the machine; any
+``embed(text) -> float32 array`` can be passed in instead.
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from functools import lru_cache
+
+from . import metrics
+
+try:
+    import numpy as np
+except ImportError:  # similarity search is optional
+    np = None
+
+LIBRARY_PATH = os.getenv("CONTENT_LIBRARY_PATH", os.path.join(os.path.expanduser("~"), ".sermon_assistant", "library.sqlite3"))
+EMBEDDING_DIMENSIONS = 1024
+# Above this many items, similarity search probes the nearest clusters instead of scanning every vector
+IVF_MIN_ITEMS = int(os.getenv("LIBRARY_IVF_MIN_ITEMS", "5000"))
+IVF_PROBES = 8
+SNIPPET_LENGTH = 200
+FILTERS = ("kind", "app", "mode", "content_type", "audience", "session_id")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT UNIQUE,
+    kind TEXT NOT NULL,
+    app TEXT,
+    mode TEXT,
+    content_type TEXT,
+    topic TEXT,
+    scripture TEXT,
+    audience TEXT,
+    session_id TEXT,
+    title TEXT,
+    text TEXT NOT NULL,
+    vector BLOB,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS items_created ON items (created);
+CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(
+    title, topic, scripture, text, content='items', content_rowid='id', tokenize='porter unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS items_ai AFTER INSERT ON items BEGIN
+    INSERT INTO items_fts (rowid, title, topic, scripture, text) VALUES (new.id, new.title, new.topic, new.scripture, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS items_ad AFTER DELETE ON items BEGIN
+    INSERT INTO items_fts (items_fts, rowid, title, topic, scripture, text) VALUES ('delete', old.id, old.title, old.topic, old.scripture, old.text);
+END;
+CREATE TRIGGER IF NOT EXISTS items_au AFTER UPDATE OF title, topic, scripture, text ON items BEGIN
+    INSERT INTO items_fts (items_fts, rowid, title, topic, scripture, text) VALUES ('delete', old.id, old.title, old.topic, old.scripture, old.text);
+    INSERT INTO items_fts (rowid, title, topic, scripture, text) VALUES (new.id, new.title, new.topic, new.scripture, new.text);
+END;
+"""
+COLUMNS = "id, key, kind, app, mode, content_type, topic, scripture, audience, session_id, title, created"
+WORD_RE = re.compile(r"\w+")
+
+
+def hashed_embedding(text, dimensions=EMBEDDING_DIMENSIONS):
+    """A unit vector of the text's words and word pairs, hashed into ``dimensions`` buckets."""
+    words = WORD_RE.findall(text.casefold())
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    vector = np.zeros(dimensions, dtype=np.float32)
+    if not features:
+        return vector
+    hashes = np.fromiter((zlib.crc32(feature.encode()) for feature in features), dtype=np.uint32, count=len(features))
+    # The top bit picks the sign, so colliding features tend to cancel rather than pile up
+    signs = np.where(hashes >> 31, -1.0, 1.0).astype(np.float32)
+    np.add.at(vector, hashes % dimensions, signs)
+    # Dampen repeated words, then normalise so a dot product is the cosine similarity
+    vector = np.sign(vector) * np.log1p(np.abs(vector))
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def fts_query(text, stopwords=()):
+    # Plain words only, each quoted, so punctuation in a search box is never FTS5 syntax
+    return " OR ".join(f'"{word}"' for word in WORD_RE.findall(text) if word.casefold() not in stopwords)
+
+
+def _where(filters, since=None, until=None, prefix="", sessions=None):
+    clauses, params = [], []
+    for name, value in filters.items():
+        if name not in FILTERS:
+            raise TypeError(f"unknown filter {name!r}")
+        if value is not None:
+            clauses.append(f"{prefix}{name} = ?")
+            params.append(value)
+    if since is not None:
+        clauses.append(f"{prefix}created >= ?")
+        params.append(since)
+    if until is not None:
+        clauses.append(f"{prefix}created < ?")
+        params.append(until)
+    if sessions is not None:
+        # Someone else's conversations are never search results
+        clauses.append(f"({prefix}kind != 'conversation' OR {prefix}session_id IN ({', '.join('?' * len(sessions))}))")
+        params.extend(sessions)
+    return (" AND ".join(clauses) or "1"), params
+
+
+class VectorIndex:
+    """Every stored vector as one matrix, clustered once the library is big enough."""
+
+    def __init__(self, ids, matrix):
+        self.ids = ids
+        self.matrix = matrix
+        self.centroids = self.lists = None
+        if len(ids) >= IVF_MIN_ITEMS:
+            self._cluster()
+
+    def _cluster(self, iterations=8):
+        # A few rounds of k-means over about sqrt(n) clusters; each vector is listed under its nearest centroid
+        rng = np.random.default_rng(0)
+        count = int(np.sqrt(len(self.ids)))
+        centroids = self.matrix[rng.choice(len(self.ids), count, replace=False)]
+        for _ in range(iterations):
+            assignment = np.argmax(self.matrix @ centroids.T, axis=1)
+            for cluster in range(count):
+                members = self.matrix[assignment == cluster]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[cluster] = centroid / (np.linalg.norm(centroid) or 1)
+        self.centroids = centroids
+        self.lists = [np.flatnonzero(assignment == cluster) for cluster in range(count)]
+
+    def search(self, query, limit, allowed=None):
+        if self.centroids is None:
+            candidates = np.arange(len(self.ids))
+        else:
+            nearest = np.argsort(self.centroids @ query)[-IVF_PROBES:]
+            candidates = np.concatenate([self.lists[cluster] for cluster in nearest])
+        if allowed is not None:
+            candidates = candidates[np.isin(self.ids[candidates], allowed)]
+        scores = self.matrix[candidates] @ query
+        top = np.argsort(scores)[::-1][:limit]
+        return [(int(self.ids[candidates[i]]), float(scores[i])) for i in top if scores[i] > 0]
+
+
+class ContentLibrary:
+    """Generated items and chat replies in SQLite, with full-text and similarity search."""
+
+    def __init__(self, path=None, embed=None):
+        self.path = path or LIBRARY_PATH
+        self.embed = embed or (hashed_embedding if np is not None else None)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._vectors = None
+        self._vectors_version = None
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=10)
+        db.row_factory = sqlite3.Row
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    @property
+    def similarity_available(self):
+        return self.embed is not None
+
+    @metrics.timed("library_index")
+    def add(self, kind, text, key=None, title=None, **metadata):
+        """Store an item, or refresh the one already saved under ``key``. Returns its id.
+
+        ``kind`` is "content" or "conversation"; metadata are the FILTERS columns plus
+        topic and scripture.
+        """
+        now = time.time()
+        vector = self.embed(text).astype("float32").tobytes() if self.embed else None
+        row = dict(
+            key=key, kind=kind, title=title, text=text, vector=vector, created=now, updated=now,
+            **{name: metadata.get(name) for name in ("app", "mode", "content_type", "topic", "scripture", "audience", "session_id")},
+        )
+        names = ", ".join(row)
+        with self._connect() as db:
+            cursor = db.execute(
+                f"INSERT INTO items ({names}) VALUES ({', '.join('?' * len(row))}) "
+                "ON CONFLICT (key) DO UPDATE SET title = excluded.title, text = excluded.text, "
+                "vector = excluded.vector, updated = excluded.updated",
+                list(row.values()),
+            )
+            if key is None:
+                return cursor.lastrowid
+            return db.execute("SELECT id FROM items WHERE key = ?", (key,)).fetchone()[0]
+
+    def get(self, item_id):
+        with self._connect() as db:
+            row = db.execute("SELECT * FROM items WHERE id = ?", (item_id,)).fetchone()
+        if row is None:
+            return None
+        item = dict(row)
+        item.pop("vector")
+        return item
+
+    def recent(self, limit=10, since=None, until=None, sessions=None, **filters):
+        where, params = _where(filters, since, until, sessions=sessions)
+        with self._connect() as db:
+            rows = db.execute(
+                f"SELECT {COLUMNS}, substr(text, 1, {SNIPPET_LENGTH}) AS snippet FROM items WHERE {where} ORDER BY created DESC LIMIT ?",
+                params + [limit],
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def search(self, query, limit=10, since=None, until=None, sessions=None, **filters):
+        """Keyword search, best matches first, with the matching words **marked** in each snippet.
+
+        Any word may match; FTS5's BM25 ranking puts items matching more, and rarer, words first.
+        With ``sessions``, conversations are only found from those session ids.
+        """
+        match = fts_query(query)
+        if not match:
+            return self.recent(limit, since, until, sessions, **filters)
+        where, params = _where(filters, since, until, prefix="items.", sessions=sessions)
+        with self._connect() as db:
+            rows = db.execute(
+                f"SELECT {', '.join('items.' + c for c in COLUMNS.split(', '))}, "
+                "snippet(items_fts, 3, '**', '**', '…', 24) AS snippet, bm25(items_fts, 4, 4, 2, 1) AS rank "
+                f"FROM items_fts JOIN items ON items.id = items_fts.rowid WHERE items_fts MATCH ? AND {where} "
+                "ORDER BY rank LIMIT ?",
+                [match] + params + [limit],
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def _vector_index(self):
+        # Rebuilt only when an item has been added or changed since the last search
+        with self._connect() as db:
+            version = tuple(db.execute("SELECT count(*), max(updated) FROM items").fetchone())
+            with self._lock:
+                if version != self._vectors_version:
+                    dimensions = len(self.embed(""))
+                    rows = db.execute(
+                        "SELECT id, vector FROM items WHERE length(vector) = ? ORDER BY id", (dimensions * 4,)
+                    ).fetchall()
+                    ids = np.array([row[0] for row in rows], dtype=np.int64)
+                    matrix = np.frombuffer(b"".join(row[1] for row in rows), dtype=np.float32).reshape(len(rows), dimensions)
+                    self._vectors = VectorIndex(ids, matrix)
+                    self._vectors_version = version
+                return self._vectors
+
+    def similar(self, text, limit=10, since=None, until=None, sessions=None, **filters):
+        """Items closest to ``text`` by vector similarity, each with a ``score`` from 0 to 1; ``sessions`` as for search()."""
+        if not self.similarity_available:
+            raise RuntimeError("Similarity search needs NumPy; install it or use search()")
+        index = self._vector_index()
+        allowed = None
+        if any(value is not None for value in (*filters.values(), since, until, sessions)):
+            where, params = _where(filters, since, until, sessions=sessions)
+            with self._connect() as db:
+                allowed = np.array([row[0] for row in db.execute(f"SELECT id FROM items WHERE {where}", params)], dtype=np.int64)
+        hits = index.search(self.embed(text), limit, allowed)
+        if not hits:
+            return []
+        scores = dict(hits)
+        with self._connect() as db:
+            rows = db.execute(
+                f"SELECT {COLUMNS}, substr(text, 1, {SNIPPET_LENGTH}) AS snippet FROM items "
+                f"WHERE id IN ({', '.join('?' * len(scores))})",
+                list(scores),
+            ).fetchall()
+        results = [dict(row, score=scores[row["id"]]) for row in rows]
+        return sorted(results, key=lambda item: item["score"], reverse=True)
+
+
+@lru_cache(maxsize=None)
+def get_content_library():
+    return ContentLibrary()
@@ -0,0 +1,268 @@
+"""Timers, counters and per-turn logs for the hot paths, exposed in Prometheus text format.
+
+Off unless METRICS_PORT, METRICS_LOG or METRICS_ENABLED=1 is set; while off, ``span()`` hands
+back a shared no-op context manager and ``count()``/``observe()`` return at once, so the
+instrumentation costs a flag check. With METRICS_PORT the Streamlit apps serve
+``http://127.0.0.1:<port>/metrics``; with METRICS_LOG each chat turn is written as one JSON
+line (to that file, or to stderr for "-") with where its time went, its tokens and its cost.
+"""
+import bisect
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+from functools import lru_cache, wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_LOG = os.getenv("METRICS_LOG", "")
+ENABLED = bool(METRICS_PORT or METRICS_LOG or os.getenv("METRICS_ENABLED") == "1")
+# Seconds; wide enough for a 1 ms tokenizer call and a 60 s sermon
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+HELP = {
+    "sermon_stage_seconds": ("histogram", "Time spent in each stage of a request"),
+    "sermon_turn_seconds": ("histogram", "Time from a chat message to its saved reply"),
+    "sermon_time_to_first_token_seconds": ("histogram", "Time from asking for a streamed reply to its first text, queueing included"),
+    "sermon_queue_wait_seconds": ("histogram", "Time a request waited in the scheduler's line"),
+    "sermon_tokens_total": ("counter", "Tokens charged to the cost ledger"),
+    "sermon_cost_dollars_total": ("counter", "Estimated cost charged to the cost ledger"),
+    "sermon_cache_requests_total": ("counter", "Response and export cache lookups"),
+    "sermon_errors_total": ("counter", "Stages that ended in an exception"),
+    "sermon_api_responses_total": ("counter", "HTTP responses from the model API, retried ones included"),
+    "sermon_fallbacks_total": ("counter", "Requests moved on to a fallback model"),
+    "sermon_retries_total": ("counter", "API calls retried after a transient error, by model and reason"),
+    "sermon_circuit_opens_total": ("counter", "Times a model's circuit breaker opened"),
+    "sermon_partial_replies_total": ("counter", "Streamed replies cut off after some text had arrived"),
+    "sermon_queue_waiting": ("gauge", "Requests waiting in the scheduler's line"),
+    "sermon_queue_running": ("gauge", "Requests running on the completion pool"),
+}
+
+_NOOP = contextlib.nullcontext()
+_local = threading.local()
+
+
+def _labels(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Registry:
+    """Counters, histograms and scrape-time gauges, safe to update from any thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+
+    def inc(self, name, value, labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            # Per bucket counts, then the sum and the count
+            values = self.histograms.get(key)
+            if values is None:
+                values = self.histograms[key] = [0] * (len(BUCKETS) + 2)
+            values[bisect.bisect_left(BUCKETS, seconds)] += 1
+            values[-2] += seconds
+            values[-1] += 1
+
+    def gauge(self, name, read):
+        self.gauges[name] = read
+
+    def render(self):
+        """Everything recorded so far, in the Prometheus text exposition format."""
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = {key: list(values) for key, values in self.histograms.items()}
+        lines, described = [], set()
+
+        def describe(name):
+            if name not in described:
+                kind, text = HELP.get(name, ("untyped", name))
+                lines.extend([f"# HELP {name} {text}", f"# TYPE {name} {kind}"])
+                described.add(name)
+
+        for (name, labels), value in sorted(counters.items()):
+            describe(name)
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), values in sorted(histograms.items()):
+            describe(name)
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), values):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {values[-2]}")
+            lines.append(f"{name}_count{_format_labels(labels)} {values[-1]}")
+        for name, read in sorted(self.gauges.items()):
+            describe(name)
+            lines.append(f"{name} {read()}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def count(name, value=1, **labels):
+    if ENABLED:
+        REGISTRY.inc(name, value, labels)
+
+
+def observe(name, seconds, **labels):
+    if ENABLED:
+        REGISTRY.observe(name, seconds, labels)
+
+
+def gauge(name, read):
+    # ``read()`` is called at scrape time, so nothing is kept up to date in between
+    if ENABLED:
+        REGISTRY.gauge(name, read)
+
+
+class _Span:
+    __slots__ = ("stage", "labels", "start")
+
+    def __init__(self, stage, labels):
+        self.stage = stage
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, kind, error, traceback):
+        _record(self.stage, time.perf_counter() - self.start, self.labels)
+        if kind is not None and not issubclass(kind, GeneratorExit):
+            REGISTRY.inc("sermon_errors_total", 1, {"stage": self.stage, "error": kind.__name__})
+
+
+def _record(stage, seconds, labels):
+    REGISTRY.observe("sermon_stage_seconds", seconds, dict(labels, stage=stage))
+    turn = getattr(_local, "turn", None)
+    if turn is not None:
+        turn["stages"][stage] = turn["stages"].get(stage, 0) + seconds
+
+
+def stage_time(stage, seconds, **labels):
+    """Record a stage timed by the caller, for work that a ``with`` block cannot wrap (a generator's lifetime)."""
+    if ENABLED:
+        _record(stage, seconds, labels)
+
+
+def span(stage, **labels):
+    """Time a block as one ``stage``; exceptions leaving it are counted as errors of that stage."""
+    if not ENABLED:
+        return _NOOP
+    return _Span(stage, labels)
+
+
+def timed(stage):
+    """Decorator form of span(); while metrics are off the function is returned untouched."""
+    def decorate(function):
+        if not ENABLED:
+            return function
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with _Span(stage, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+class _TimedTokenizer:
+    # Times encode() and passes everything else straight through
+    def __init__(self, tokenizer):
+        self._tokenizer = tokenizer
+
+    def encode(self, text, *args, **kwargs):
+        with _Span("tokenize", {}):
+            return self._tokenizer.encode(text, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._tokenizer, name)
+
+
+def timed_tokenizer(tokenizer):
+    return _TimedTokenizer(tokenizer) if ENABLED else tokenizer
+
+
+def start_turn(**fields):
+    """Begin a chat turn on this thread; stages timed on it until finish_turn() are added to its log line."""
+    if not ENABLED:
+        return None
+    turn = _local.turn = {"started": time.perf_counter(), "stages": {}, **fields}
+    return turn
+
+
+def finish_turn(turn, **fields):
+    if turn is None:
+        return
+    if getattr(_local, "turn", None) is turn:
+        _local.turn = None
+    seconds = time.perf_counter() - turn.pop("started")
+    REGISTRY.observe("sermon_turn_seconds", seconds, {"app": turn.get("app")})
+    if METRICS_LOG:
+        record = dict(turn, **fields, time=time.time(), seconds=round(seconds, 4))
+        record["stages"] = {stage: round(value, 4) for stage, value in record["stages"].items()}
+        _write_log(json.dumps(record, ensure_ascii=False))
+
+
+_log_lock = threading.Lock()
+
+
+def _write_log(line):
+    with _log_lock:
+        if METRICS_LOG == "-":
+            print(line, file=sys.stderr, flush=True)
+        else:
+            with open(METRICS_LOG, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0].rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        data = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@lru_cache(maxsize=None)
+def start_metrics_server(port=None):
+    """Serve /metrics on a background thread, once per process; None when no port is configured or it is taken."""
+    port = port or METRICS_PORT
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer((METRICS_HOST, port), MetricsHandler)
+    except OSError as error:
+        # Another process (a second app on the same server) already serves it
+        print(f"Metrics endpoint not started on port {port}: {error}", file=sys.stderr)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
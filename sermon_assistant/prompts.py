@@ -0,0 +1,151 @@
+"""Every mode, role and content type in one declarative file, compiled once and reloaded when it changes.
+
+The bundled ``data/prompts.json`` can be replaced with an editable copy through PROMPTS_PATH.
+Edits are picked up by the running server within PROMPTS_RELOAD_SECONDS; a file that no
+longer compiles is reported in ``PromptRegistry.error`` and the last good version stays live.
+"""
+import json
+import os
+import threading
+import time
+from functools import lru_cache
+
+from .routing import ROUTES
+from .triggers import TriggerEngine
+
+PROMPTS_PATH = os.getenv("PROMPTS_PATH", os.path.join(os.path.dirname(__file__), "data", "prompts.json"))
+RELOAD_SECONDS = float(os.getenv("PROMPTS_RELOAD_SECONDS", "2"))
+
+
+def _fields(mode):
+    return {name: "\n".join(f"- {item}" for item in value) if isinstance(value, list) else value for name, value in mode.items()}
+
+
+class Prompts:
+    """One compiled version of the prompt file.
+
+    Mode system prompts are built from the template here rather than per request, the trigger
+    rules are compiled into one matcher, and every static text (system prompts, greetings,
+    follow-ups, trigger texts) is tokenized up front into ``tokens``.
+    """
+
+    def __init__(self, data, tokenizer):
+        template = data["mode_system_prompt"]
+        self.modes = {}
+        for key, mode in data["modes"].items():
+            mode = dict(mode)
+            if not mode.get("system_prompt"):
+                # A mode's flags add their guidance after the template
+                parts = [template.format(**mode)]
+                if mode.get("emotionally_healthy"):
+                    parts.append(data.get("emotionally_healthy_prompt", ""))
+                if mode.get("gospel_clarity_level"):
+                    parts.append(data.get("gospel_clarity_prompts", {}).get(mode["gospel_clarity_level"], ""))
+                mode["system_prompt"] = " ".join(part for part in parts if part)
+            self.modes[key] = mode
+        self.triggers = TriggerEngine(data["triggers"])
+        # Each rule's text for each mode it applies to, with that mode's lists filled in as bullets
+        self.trigger_texts = {}
+        for name, rule in data["triggers"].items():
+            for key in rule.get("modes") or self.modes:
+                if key not in self.modes:
+                    raise ValueError(f"trigger {name}: unknown mode {key!r}")
+                self.trigger_texts[name, key] = rule["text"].format(**_fields(self.modes[key]))
+        self.content_prompt = data["content_prompt"]
+        self.content_types = data["content_types"]
+        self.audiences = data["audiences"]
+        self.roles = data["roles"]
+        for name, settings in self._role_settings():
+            if settings["profile"] not in ROUTES:
+                raise ValueError(f"{name}: unknown routing profile {settings['profile']!r}")
+        self.tokens = {text: len(tokenizer.encode(text)) for text in self._static_texts()}
+
+    def _role_settings(self):
+        yield from self.modes.items()
+        yield from self.content_types.items()
+        for role_set in self.roles.values():
+            yield from role_set["roles"].items()
+
+    def _static_texts(self):
+        for _, settings in self._role_settings():
+            yield settings["system_prompt"]
+        for mode in self.modes.values():
+            yield mode["starting_prompt"]
+            yield from mode["follow_ups"]
+        for role_set in self.roles.values():
+            if role_set.get("greeting"):
+                yield role_set["greeting"]
+            yield from role_set.get("follow_ups", ())
+        yield from self.trigger_texts.values()
+
+    def triggered(self, mode_key, user_input):
+        """The texts of the trigger rules a message sets off in a mode (crisis resources, hints, the gospel anchor)."""
+        return [self.trigger_texts[name, mode_key] for name in self.triggers.match(user_input, mode_key)]
+
+    def content_user_prompt(self, content_type, topic, scripture, audience):
+        return self.content_prompt.format(topic=topic, scripture=scripture, audience=audience, content_type=content_type.lower())
+
+
+class PromptRegistry:
+    """The live Prompts, recompiled when the file's modification time or size changes."""
+
+    def __init__(self, path=None, tokenizer=None, reload_seconds=None):
+        if tokenizer is None:
+            # Imported here so listing prompt names with catalog() does not load the API client
+            from .client import get_tokenizer
+            tokenizer = get_tokenizer()
+        self.path = path or PROMPTS_PATH
+        self.tokenizer = tokenizer
+        self.reload_seconds = RELOAD_SECONDS if reload_seconds is None else reload_seconds
+        self.error = None
+        self._lock = threading.Lock()
+        self._signature = self._stat()
+        self._prompts = self._compile()
+        self._checked = time.monotonic()
+
+    def _stat(self):
+        stat = os.stat(self.path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _compile(self):
+        with open(self.path, encoding="utf-8") as f:
+            return Prompts(json.load(f), self.tokenizer)
+
+    def current(self):
+        """The compiled prompts; checks the file at most once every ``reload_seconds``."""
+        if time.monotonic() - self._checked >= self.reload_seconds and self._lock.acquire(blocking=False):
+            try:
+                self._checked = time.monotonic()
+                signature = self._stat()
+                if signature != self._signature:
+                    self._signature = signature
+                    self.reload()
+            except OSError as error:
+                self.error = f"Cannot read {self.path}: {error}"
+            finally:
+                self._lock.release()
+        return self._prompts
+
+    def reload(self):
+        try:
+            self._prompts = self._compile()
+            self.error = None
+        except (ValueError, KeyError, TypeError) as error:
+            # A half-finished edit must not take the apps down; keep serving the last good version
+            self.error = f"{self.path} was not reloaded: {error!r}"
+        return self._prompts
+
+
+@lru_cache(maxsize=None)
+def get_prompt_registry():
+    return PromptRegistry()
+
+
+def get_prompts():
+    return get_prompt_registry().current()
+
+
+def catalog(path=None):
+    """The prompt file as written, for listing content types and audiences without compiling or tokenizing it."""
+    with open(path or PROMPTS_PATH, encoding="utf-8") as f:
+        return json.load(f)
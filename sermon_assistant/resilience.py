@@ -0,0 +1,153 @@
+"""Retries, deadlines and circuit breaking for calls to the model API.
+
+A transient failure (429, 5xx, a timeout or a dropped connection) is retried after an
+exponential backoff with jitter, or after the server's Retry-After when it sends one, but
+never past the call's deadline: a retry that could not finish in time is not started. Each
+model has a circuit breaker that opens after BREAKER_FAILURES failures in a row, so while
+the provider is degraded requests move straight to a fallback model, or fail at once with
+CircuitOpenError, instead of every user waiting out their own timeouts.
+"""
+import email.utils
+import os
+import random
+import threading
+import time
+
+import httpx
+import openai
+
+# One call, retries and fallback models included; a stream's deadline is for its first text
+DEADLINE = float(os.getenv("OPENAI_DEADLINE", "90"))
+BACKOFF_BASE = float(os.getenv("OPENAI_BACKOFF_BASE", "0.5"))
+BACKOFF_MAX = float(os.getenv("OPENAI_BACKOFF_MAX", "20"))
+BREAKER_FAILURES = int(os.getenv("OPENAI_BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("OPENAI_BREAKER_RESET_SECONDS", "30"))
+
+# Status codes worth another try: timeout, conflict, rate limit and server errors
+RETRY_STATUSES = {408, 409, 429}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a model whose circuit breaker is open."""
+
+    def __init__(self, model, retry_in):
+        super().__init__(f"{model} is failing; not retrying for another {retry_in:.0f}s")
+        self.model = model
+        self.retry_in = retry_in
+
+
+def as_api_error(error):
+    """An httpx error raised while reading a stream, as the openai error the client raises for it.
+
+    The client only wraps errors up to the response headers; a stall or dropped connection
+    while the streamed body is read comes through as httpx's own error.
+    """
+    if not isinstance(error, httpx.TransportError):
+        return error
+    try:
+        request = error.request
+    except RuntimeError:
+        request = httpx.Request("POST", "/chat/completions")
+    if isinstance(error, httpx.TimeoutException):
+        return openai.APITimeoutError(request=request)
+    return openai.APIConnectionError(message=str(error) or type(error).__name__, request=request)
+
+
+def is_retryable(error):
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, TimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRY_STATUSES or error.status_code >= 500
+    return False
+
+
+def is_outage(error):
+    # What the breaker counts: the provider failing, not it telling us to slow down
+    return is_retryable(error) and getattr(error, "status_code", None) != 429
+
+
+def retry_after(error):
+    """Seconds the server asked us to wait (Retry-After or retry-after-ms), or None."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            # The HTTP-date form
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff(attempt, error=None):
+    """Seconds to wait before retry number ``attempt`` (0 for the first retry).
+
+    Half the exponential step plus a random share of the other half, so a burst of clients
+    failing together do not retry together; a Retry-After from the server takes precedence.
+    """
+    requested = retry_after(error) if error is not None else None
+    if requested is not None:
+        return requested
+    step = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)
+    return step / 2 + random.uniform(0, step / 2)
+
+
+class CircuitBreaker:
+    """Closed until ``failures`` outages in a row, then open for ``reset_seconds``, then one trial call."""
+
+    def __init__(self, failures=None, reset_seconds=None):
+        self.failures = BREAKER_FAILURES if failures is None else failures
+        self.reset_seconds = BREAKER_RESET_SECONDS if reset_seconds is None else reset_seconds
+        self._lock = threading.Lock()
+        self.failed = 0
+        self.opened = None
+        # The thread making the half-open trial call, if one is under way
+        self._trial = None
+
+    @property
+    def state(self):
+        if self.opened is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened >= self.reset_seconds else "open"
+
+    def retry_in(self):
+        return 0.0 if self.opened is None else max(0.0, self.opened + self.reset_seconds - time.monotonic())
+
+    def allow(self):
+        """Whether a call may go ahead now; once the reset time is up, only one trial call at a time."""
+        with self._lock:
+            if self.opened is None:
+                return True
+            if time.monotonic() - self.opened < self.reset_seconds or self._trial is not None:
+                return False
+            self._trial = threading.get_ident()
+            return True
+
+    def release(self):
+        """End this thread's trial call without a verdict, e.g. after an unexpected error; call it in a finally."""
+        with self._lock:
+            if self._trial == threading.get_ident():
+                self._trial = None
+
+    def success(self):
+        with self._lock:
+            self.failed, self.opened, self._trial = 0, None, None
+
+    def failure(self):
+        """Count an outage; returns True when this one opened the circuit."""
+        with self._lock:
+            self.failed += 1
+            reopened = self._trial is not None
+            self._trial = None
+            if reopened or (self.opened is None and self.failed >= self.failures):
+                self.opened = time.monotonic()
+                return True
+            return False
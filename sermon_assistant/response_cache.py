@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+
+from . import metrics
+
+CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", os.path.join(os.path.expanduser("~"), ".sermon_assistant", "responses.sqlite3"))
+CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", str(30 * 24 * 3600)))
+CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    text TEXT NOT NULL,
+    input_tokens INTEGER NOT NULL,
+    output_tokens INTEGER NOT NULL,
+    cost REAL NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value REAL NOT NULL);
+"""
+
+
+def normalize(text):
+    # "James 1:2-4" and " james  1:2-4 " ask for the same thing
+    return " ".join(text.split()).casefold()
+
+
+class ResponseCache:
+    """Persistent cache of generated content in SQLite, with a TTL and LRU eviction by last use."""
+
+    def __init__(self, path=None, ttl=None, max_entries=None):
+        self.path = path or CACHE_PATH
+        self.ttl = CACHE_TTL if ttl is None else ttl
+        self.max_entries = max_entries or CACHE_MAX_ENTRIES
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=10)
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def key(self, system_prompt, user_prompt, model, temperature):
+        payload = json.dumps([normalize(system_prompt), normalize(user_prompt), model, round(float(temperature), 3)])
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT text, input_tokens, output_tokens, cost, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                metrics.count("sermon_cache_requests_total", cache="response", result="miss")
+                self._bump(db, "misses", 1)
+                return None
+            if now - row[4] > self.ttl:
+                db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                metrics.count("sermon_cache_requests_total", cache="response", result="miss")
+                self._bump(db, "misses", 1)
+                return None
+            metrics.count("sermon_cache_requests_total", cache="response", result="hit")
+            db.execute("UPDATE responses SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key))
+            self._bump(db, "hits", 1)
+            self._bump(db, "saved_cost", row[3])
+        return {"text": row[0], "input_tokens": row[1], "output_tokens": row[2], "cost": row[3]}
+
+    def put(self, key, text, input_tokens, output_tokens, cost):
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO responses (key, text, input_tokens, output_tokens, cost, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, text, input_tokens, output_tokens, cost, now, now),
+            )
+            # Drop the least recently used entries past the size bound
+            db.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def _bump(self, db, name, amount):
+        db.execute(
+            "INSERT INTO stats (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, amount),
+        )
+
+    def stats(self):
+        with self._connect() as db:
+            values = dict(db.execute("SELECT name, value FROM stats").fetchall())
+            entries = db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        hits, misses = int(values.get("hits", 0)), int(values.get("misses", 0))
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "saved_cost": values.get("saved_cost", 0.0),
+            "entries": entries,
+        }
+
+
+@lru_cache(maxsize=None)
+def get_response_cache():
+    return ResponseCache()
@@ -0,0 +1,75 @@
+import json
+import os
+
+from .triggers import phrase_pattern
+
+# Model settings per kind of request. Each mode and content type names one of these
+# profiles in data/prompts.json. "fallbacks" are tried in order when the model errors or times out.
+# MODEL_ROUTES overrides or extends profiles with a JSON object, or the path to a JSON file,
+# e.g. {"long_form": {"model": "gpt-4o-mini", "max_tokens": 1500}}
+PROFILES = {
+    # Short conversational turns and one-line posts
+    "light": {"model": "gpt-4o-mini", "max_tokens": 400, "temperature": 0.8, "timeout": 20, "fallbacks": ["gpt-3.5-turbo"]},
+    # Ordinary back-and-forth
+    "chat": {"model": "gpt-3.5-turbo", "max_tokens": 700, "temperature": 0.7, "timeout": 30, "fallbacks": ["gpt-4o-mini"]},
+    # Full sermons, devotionals, study guides and lessons
+    "long_form": {"model": "gpt-4o", "max_tokens": 1800, "temperature": 0.7, "timeout": 90, "fallbacks": ["gpt-3.5-turbo"]},
+}
+SHORT_TURN_WORDS = int(os.getenv("SHORT_TURN_WORDS", "40"))
+# A chat message asking to write one of these wants real writing, however short the request:
+# a verb followed within LONG_FORM_GAP words by the piece, as in "write me a short devotional".
+# Either alone ("I wrote to my sister", "the sermon on Sunday upset me") is ordinary conversation.
+LONG_FORM_VERBS = phrase_pattern(["writ*", "draft*", "prepar*", "compos*", "creat*", "outline", "put together", "give me", "come up with"])
+LONG_FORM_PIECES = phrase_pattern(["sermon*", "outline*", "devotional*", "homil*", "study guide*", "bible study", "lesson*"])
+LONG_FORM_GAP = 3
+
+
+def long_form_request(user_text):
+    for verb in LONG_FORM_VERBS.finditer(user_text):
+        piece = LONG_FORM_PIECES.search(user_text, verb.end())
+        if piece and len(user_text[verb.end():piece.start()].split()) <= LONG_FORM_GAP:
+            return True
+    return False
+
+
+def load_routes(setting=None):
+    profiles = {name: dict(profile) for name, profile in PROFILES.items()}
+    setting = os.getenv("MODEL_ROUTES", "") if setting is None else setting
+    if setting.strip():
+        if not setting.lstrip().startswith("{"):
+            with open(setting, encoding="utf-8") as f:
+                setting = f.read()
+        for name, overrides in json.loads(setting).items():
+            profiles.setdefault(name, dict(PROFILES["chat"])).update(overrides)
+    return profiles
+
+
+ROUTES = load_routes()
+
+
+def chat_profile(user_text):
+    # Right-size a chat turn: short check-ins go to the light model, requests for a full
+    # piece of writing to the long-form one
+    if long_form_request(user_text):
+        return "long_form"
+    if len(user_text.split()) <= SHORT_TURN_WORDS:
+        return "light"
+    return "chat"
+
+
+def route(profile, user_text=None):
+    """Keyword arguments for complete()/stream_reply() under a profile.
+
+    For the "chat" profile, passing the user's message lets the turn be routed by
+    chat_profile(). Returns model, max_tokens, temperature, timeout and fallback_models.
+    """
+    if profile == "chat" and user_text is not None:
+        profile = chat_profile(user_text)
+    settings = ROUTES[profile]
+    return {
+        "model": settings["model"],
+        "max_tokens": settings["max_tokens"],
+        "temperature": settings["temperature"],
+        "timeout": settings.get("timeout"),
+        "fallback_models": tuple(settings.get("fallbacks", ())),
+    }
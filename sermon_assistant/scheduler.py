@@ -0,0 +1,177 @@
+"""Fair, rate-limited admission of completion requests from every session on the server.
+
+Requests wait in one queue and start in order of priority, then of how many requests their
+user already has running, then round-robin between users, then in order of arrival. Each user has token buckets for requests and
+tokens per minute, so one person resubmitting cannot crowd out everyone else, and the whole
+process has buckets sized to the provider's RPM and TPM limits, so a Sunday-morning rush
+queues here instead of coming back from the API as a burst of 429s.
+"""
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+from . import metrics
+
+# The provider's limits for the API key; 0 turns a limit off
+PROVIDER_RPM = int(os.getenv("OPENAI_RPM", "500"))
+PROVIDER_TPM = int(os.getenv("OPENAI_TPM", "200000"))
+# What one user (one browser session) may use; requests without a user are not limited per user
+USER_RPM = int(os.getenv("USER_RPM", "6"))
+USER_TPM = int(os.getenv("USER_TPM", "20000"))
+# Lower starts sooner; modes and content types set theirs with "priority" in prompts.json
+DEFAULT_PRIORITY = 5
+BATCH_PRIORITY = 9
+IDLE_USER_SECONDS = 600
+
+
+class TokenBucket:
+    """``per_minute`` units refilled continuously, up to a burst of a full minute's worth."""
+
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def wait_time(self, amount, now):
+        # A request bigger than the whole bucket goes through once the bucket is full, rather than never
+        if not self.rate:
+            return 0
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        return max(0.0, (min(amount, self.capacity) - self.level) / self.rate)
+
+    def take(self, amount):
+        if self.rate:
+            self.level -= amount
+
+
+class _Ticket:
+    __slots__ = ("future", "fn", "args", "user", "priority", "tokens", "seq", "submitted")
+
+    def __init__(self, fn, args, user, priority, tokens, seq):
+        self.future = Future()
+        self.submitted = time.monotonic()
+        self.fn, self.args = fn, args
+        self.user, self.priority, self.tokens, self.seq = user, priority, tokens, seq
+
+
+class Scheduler:
+    """Starts queued calls on ``executor`` as limits allow, never more than ``max_concurrency`` at once."""
+
+    def __init__(self, executor, max_concurrency, rpm=None, tpm=None, user_rpm=None, user_tpm=None):
+        self.executor = executor
+        self.max_concurrency = max_concurrency
+        self.user_rpm = USER_RPM if user_rpm is None else user_rpm
+        self.user_tpm = USER_TPM if user_tpm is None else user_tpm
+        self.requests = TokenBucket(PROVIDER_RPM if rpm is None else rpm)
+        self.tokens = TokenBucket(PROVIDER_TPM if tpm is None else tpm)
+        self._condition = threading.Condition()
+        self._waiting = []
+        self._running = {}
+        self._users = {}
+        # When each user last had a request started, for taking turns
+        self._served = {}
+        self._seq = itertools.count()
+        threading.Thread(target=self._dispatch, name="scheduler", daemon=True).start()
+
+    def submit(self, fn, *args, user=None, priority=None, tokens=0):
+        """Queue ``fn(*args)``; returns a Future that is pending while queued and running once started.
+
+        Cancelling the Future while it is still queued takes it out of the line.
+        """
+        ticket = _Ticket(fn, args, user, DEFAULT_PRIORITY if priority is None else priority, tokens, next(self._seq))
+        with self._condition:
+            self._waiting.append(ticket)
+            self._condition.notify()
+        return ticket.future
+
+    def _order(self):
+        self._waiting = [ticket for ticket in self._waiting if not ticket.future.cancelled()]
+        return sorted(self._waiting, key=lambda ticket: (
+            ticket.priority, self._running.get(ticket.user, 0), self._served.get(ticket.user, -1), ticket.seq
+        ))
+
+    def position(self, future):
+        """1 for the next request to start, 2 for the one after, ...; 0 once it has started."""
+        with self._condition:
+            for position, ticket in enumerate(self._order(), 1):
+                if ticket.future is future:
+                    return position
+        return 0
+
+    def status(self):
+        with self._condition:
+            return {"waiting": len(self._order()), "running": sum(self._running.values()), "users": len(self._users)}
+
+    def _user_buckets(self, user, now):
+        buckets = self._users.get(user)
+        if buckets is None:
+            buckets = self._users[user] = [TokenBucket(self.user_rpm), TokenBucket(self.user_tpm), now]
+        buckets[2] = now
+        return buckets
+
+    def _next(self, now):
+        """The ticket to start now, or how long until one might be allowed to (None: until something changes)."""
+        delay = None
+        for ticket in self._order():
+            # Work not on behalf of one user (the CLI, batches) is held back by priority instead
+            buckets = self._user_buckets(ticket.user, now) if ticket.user is not None else None
+            wait = buckets and max(buckets[0].wait_time(1, now), buckets[1].wait_time(ticket.tokens, now))
+            if wait:
+                # Over their own limit: they keep their place and everyone else goes ahead
+                delay = wait if delay is None else min(delay, wait)
+                continue
+            wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(ticket.tokens, now))
+            if wait:
+                # The provider limit applies to everyone, so the line holds in order
+                return None, wait if delay is None else min(delay, wait)
+            if buckets:
+                buckets[0].take(1)
+                buckets[1].take(ticket.tokens)
+            return ticket, None
+        return None, delay
+
+    def _dispatch(self):
+        while True:
+            with self._condition:
+                while True:
+                    now = time.monotonic()
+                    if sum(self._running.values()) < self.max_concurrency:
+                        ticket, delay = self._next(now)
+                        if ticket is not None:
+                            break
+                    else:
+                        delay = None
+                    self._prune(now)
+                    self._condition.wait(delay)
+                self._waiting.remove(ticket)
+                if not ticket.future.set_running_or_notify_cancel():
+                    continue
+                self.requests.take(1)
+                self.tokens.take(ticket.tokens)
+                self._running[ticket.user] = self._running.get(ticket.user, 0) + 1
+                self._served[ticket.user] = ticket.seq
+            metrics.observe("sermon_queue_wait_seconds", time.monotonic() - ticket.submitted)
+            self.executor.submit(self._run, ticket)
+
+    def _run(self, ticket):
+        try:
+            ticket.future.set_result(ticket.fn(*ticket.args))
+        except BaseException as error:
+            ticket.future.set_exception(error)
+        finally:
+            with self._condition:
+                self._running[ticket.user] -= 1
+                if not self._running[ticket.user]:
+                    del self._running[ticket.user]
+                self._condition.notify()
+
+    def _prune(self, now):
+        # Forget users idle long enough that their buckets would have refilled anyway
+        for user, (_, _, seen) in list(self._users.items()):
+            if now - seen > IDLE_USER_SECONDS and user not in self._running:
+                del self._users[user]
+                self._served.pop(user, None)
@@ -0,0 +1,221 @@
+"""Scripture references: find them in text and look up their exact wording locally.
+
+The bundled translation is the World English Bible (public domain), stored in
+``data/web.tsv.gz`` as one ``<verse id>\\t<text>`` line per verse with footnotes removed.
+A verse id is book * 1_000_000 + chapter * 1_000 + verse, so John 3:16 is 43003016 and a
+passage is one range scan. The first lookup builds a SQLite index from it.
+"""
+import gzip
+import html
+import os
+import re
+import sqlite3
+import threading
+from collections import namedtuple
+from functools import lru_cache
+
+from . import metrics
+
+TRANSLATION = "WEB"
+SOURCE_PATH = os.path.join(os.path.dirname(__file__), "data", "web.tsv.gz")
+INDEX_PATH = os.getenv("SCRIPTURE_INDEX_PATH", os.path.join(os.path.expanduser("~"), ".sermon_assistant", "scripture-web-2.sqlite3"))
+MAX_VERSES = int(os.getenv("SCRIPTURE_MAX_VERSES", "30"))
+
+# (name, abbreviations) in canonical order; numbered books list the name without the number
+BOOKS = [
+    ("Genesis", "Gen Gn"), ("Exodus", "Exod Exo Ex"), ("Leviticus", "Lev Lv"), ("Numbers", "Num Nm"),
+    ("Deuteronomy", "Deut Dt"), ("Joshua", "Josh Jos"), ("Judges", "Judg Jdg"), ("Ruth", "Rth"),
+    ("1 Samuel", "Sam Sm Sa"), ("2 Samuel", "Sam Sm Sa"), ("1 Kings", "Kgs Kin Ki"), ("2 Kings", "Kgs Kin Ki"),
+    ("1 Chronicles", "Chron Chr Ch"), ("2 Chronicles", "Chron Chr Ch"), ("Ezra", "Ezr"), ("Nehemiah", "Neh"),
+    ("Esther", "Esth Est"), ("Job", "Jb"), ("Psalms", "Psalm Psa Psm Pss Ps"), ("Proverbs", "Prov Prv Pr"),
+    ("Ecclesiastes", "Eccles Eccl Ecc Qoh"), ("Song of Solomon", "Song of Songs|Canticles|Song|SOS"),
+    ("Isaiah", "Isa Is"), ("Jeremiah", "Jer Jr"), ("Lamentations", "Lam"), ("Ezekiel", "Ezek Eze Ezk"),
+    ("Daniel", "Dan Dn"), ("Hosea", "Hos"), ("Joel", "Jl"), ("Amos", "Am"), ("Obadiah", "Obad Ob"),
+    ("Jonah", "Jnh Jon"), ("Micah", "Mic"), ("Nahum", "Nah"), ("Habakkuk", "Hab"), ("Zephaniah", "Zeph Zep"),
+    ("Haggai", "Hag"), ("Zechariah", "Zech Zec"), ("Malachi", "Mal"),
+    ("Matthew", "Matt Mt"), ("Mark", "Mrk Mk"), ("Luke", "Luk Lk"), ("John", "Jhn Jn"), ("Acts", "Ac"),
+    ("Romans", "Rom Rm Ro"), ("1 Corinthians", "Cor Co"), ("2 Corinthians", "Cor Co"), ("Galatians", "Gal"),
+    ("Ephesians", "Ephes Eph"), ("Philippians", "Phil Php"), ("Colossians", "Col"),
+    ("1 Thessalonians", "Thess Thes Th"), ("2 Thessalonians", "Thess Thes Th"), ("1 Timothy", "Tim Ti"),
+    ("2 Timothy", "Tim Ti"), ("Titus", "Tit"), ("Philemon", "Philem Phm"), ("Hebrews", "Heb"), ("James", "Jas Jm"),
+    ("1 Peter", "Pet Pt Pe"), ("2 Peter", "Pet Pt Pe"), ("1 John", "Jhn Jn Jo"), ("2 John", "Jhn Jn Jo"),
+    ("3 John", "Jhn Jn Jo"), ("Jude", "Jud"), ("Revelation", "Revelations Rev"),
+]
+SINGLE_CHAPTER_BOOKS = {"Obadiah", "Philemon", "2 John", "3 John", "Jude"}
+# Roman numerals and words need a space after them, so "Isa" stays Isaiah rather than "I Sa"
+ORDINALS = {"1": ("1", "1 ", "1st ", "First ", "I "), "2": ("2", "2 ", "2nd ", "Second ", "II "), "3": ("3", "3 ", "3rd ", "Third ", "III ")}
+
+Reference = namedtuple("Reference", "book chapter verse end_chapter end_verse")
+
+
+def _key(spelling):
+    return " ".join(spelling.split()).casefold()
+
+
+def _spellings():
+    # Every way of writing each book, mapped from its normalised form to the book name
+    spellings = {}
+    for name, abbreviations in BOOKS:
+        ordinal, _, base = name.partition(" ") if name[0].isdigit() else ("", "", name)
+        separator = "|" if "|" in abbreviations else " "
+        for spelling in [base] + abbreviations.split(separator):
+            for prefix in ORDINALS.get(ordinal, ("",)):
+                spellings.setdefault(prefix + spelling, name)
+    return spellings
+
+
+SPELLINGS = _spellings()
+BOOK_BY_KEY = {_key(spelling): name for spelling, name in SPELLINGS.items()}
+
+
+def _spelling_pattern(spelling):
+    pattern = re.escape(spelling).replace(r"\ ", r"\s+")
+    # Bare two-letter abbreviations must be capitalised ("Is 40:31"), so "is 3:15" in a sentence is not Isaiah
+    return pattern if len(spelling) <= 2 else f"(?i:{pattern})"
+
+
+# Longest spelling first so "Song of Songs 2:1" is not read as "Song"
+REFERENCE_RE = re.compile(
+    r"(?<!\w)(?P<book>" + "|".join(map(_spelling_pattern, sorted(SPELLINGS, key=len, reverse=True))) + r")\.?\s*"
+    r"(?P<chapter>\d{1,3})(?::(?P<verse>\d{1,3})(?:\s*[-–]\s*(?:(?P<end_chapter>\d{1,3}):)?(?P<end_verse>\d{1,3}))?)?(?![\d:])"
+)
+
+
+def find_references(text):
+    """Every Scripture reference in ``text``, e.g. "James 1:2-4" or "Psalm 23", in order of appearance."""
+    references = []
+    for match in REFERENCE_RE.finditer(text):
+        book = BOOK_BY_KEY[_key(match["book"])]
+        chapter, verse = int(match["chapter"]), match["verse"]
+        if verse is None:
+            if book in SINGLE_CHAPTER_BOOKS:
+                # "Jude 3" is verse 3 of the only chapter
+                references.append(Reference(book, 1, chapter, 1, chapter))
+            elif not match["book"][0].islower():
+                # A whole chapter only counts when the book is written like a reference
+                references.append(Reference(book, chapter, None, chapter, None))
+            continue
+        verse = int(verse)
+        end_chapter = int(match["end_chapter"] or chapter)
+        end_verse = int(match["end_verse"] or verse)
+        references.append(Reference(book, chapter, verse, end_chapter, end_verse))
+    return references
+
+
+def format_reference(reference):
+    book, chapter, verse, end_chapter, end_verse = reference
+    if verse is None:
+        return f"{book} {chapter}"
+    label = f"{book} {chapter}:{verse}"
+    if end_chapter != chapter:
+        return f"{label}-{end_chapter}:{end_verse}"
+    return f"{label}-{end_verse}" if end_verse != verse else label
+
+
+BOOK_NUMBERS = {name: number for number, (name, _) in enumerate(BOOKS, 1)}
+
+
+def verse_id(book, chapter, verse):
+    return BOOK_NUMBERS[book] * 1_000_000 + chapter * 1_000 + verse
+
+
+def clean_verse(text):
+    # The source escapes HTML and marks Psalm superscriptions with a leading "> "
+    return html.unescape(text).removeprefix("> ")
+
+
+class VerseIndex:
+    """The bundled translation in SQLite, keyed by verse id, read through memory-mapped I/O."""
+
+    def __init__(self, path=None, source=None):
+        self.path = path or INDEX_PATH
+        self.source = source or SOURCE_PATH
+        self._local = threading.local()
+        if not os.path.exists(self.path):
+            self._build()
+
+    def _build(self):
+        # Written to a temporary file first so a half-built index is never opened
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        partial = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        db = sqlite3.connect(partial)
+        try:
+            db.execute("CREATE TABLE verses (id INTEGER PRIMARY KEY, text TEXT NOT NULL)")
+            with gzip.open(self.source, "rt", encoding="utf-8") as f:
+                rows = (line.rstrip("\n").split("\t", 1) for line in f)
+                db.executemany("INSERT INTO verses VALUES (?, ?)", ((id, clean_verse(text)) for id, text in rows))
+            db.commit()
+        finally:
+            db.close()
+        os.replace(partial, self.path)
+
+    @property
+    def db(self):
+        # One read-only connection per thread, reused for every lookup
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            db.execute("PRAGMA mmap_size = 67108864")
+        return db
+
+    def verses(self, reference):
+        """[(chapter, verse, text), ...] for a reference, at most MAX_VERSES of them."""
+        book, chapter, verse, end_chapter, end_verse = reference
+        first = verse_id(book, chapter, verse or 1)
+        last = verse_id(book, end_chapter, end_verse or 999)
+        rows = self.db.execute(
+            "SELECT id, text FROM verses WHERE id BETWEEN ? AND ? ORDER BY id LIMIT ?", (first, last, MAX_VERSES)
+        ).fetchall()
+        return [(id // 1_000 % 1_000, id % 1_000, text) for id, text in rows]
+
+
+@lru_cache(maxsize=None)
+def get_verse_index():
+    return VerseIndex()
+
+
+@lru_cache(maxsize=1024)
+def lookup(reference):
+    """The passage text for a reference, verse numbers inline when it spans several verses."""
+    verses = get_verse_index().verses(reference)
+    if len(verses) == 1:
+        return verses[0][2]
+    return " ".join(f"[{chapter}:{verse}] {text}" if reference.end_chapter != reference.chapter else f"[{verse}] {text}"
+                    for chapter, verse, text in verses)
+
+
+@metrics.timed("scripture")
+def find_passages(text, limit=3):
+    """Look up the first ``limit`` distinct references in ``text`` that exist in the translation."""
+    passages = []
+    for reference in dict.fromkeys(find_references(text)):
+        passage = lookup(reference)
+        if passage:
+            passages.append({"reference": format_reference(reference), "text": passage})
+            if len(passages) == limit:
+                break
+    return passages
+
+
+def format_passages(passages):
+    # Markdown shown to the user above the model's reply
+    return "\n\n".join(f"> {p['text']}\n>\n> — *{p['reference']} ({TRANSLATION})*" for p in passages)
+
+
+def scripture_prompt(passages):
+    return (
+        f"Exact text of the Scripture referenced, from the {TRANSLATION}:\n\n"
+        + "\n\n".join(f"{p['reference']}: {p['text']}" for p in passages)
+    )
+
+
+def ground_prompt(messages, passages):
+    """Insert the passages' exact text ahead of the latest message so the model neither misquotes nor re-quotes them."""
+    if not passages:
+        return messages
+    note = {
+        "role": "system",
+        "content": scripture_prompt(passages) + "\n\nThe user already sees this text above your reply: "
+        "refer to it by reference instead of quoting it in full, and quote only from it.",
+    }
+    return messages[:-1] + [note] + messages[-1:]
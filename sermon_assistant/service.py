@@ -0,0 +1,289 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import httpx
+import openai
+
+from . import metrics
+from .resilience import DEADLINE, CircuitBreaker, CircuitOpenError, as_api_error, backoff, is_outage, is_retryable
+from .scheduler import Scheduler
+
+# Process-wide limits, shared by every Streamlit session on this server
+MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "16"))
+REQUEST_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "30"))
+# How often a queued stream reports its place in line
+QUEUE_POLL_SECONDS = 0.5
+
+_DONE = object()
+# Errors after which the next fallback model is tried (timeouts and connection errors included)
+FALLBACK_ERRORS = (openai.APIError, TimeoutError)
+# What a caller can get from complete() or a ReplyStream when the API could not answer
+REPLY_ERRORS = FALLBACK_ERRORS + (CircuitOpenError, httpx.TransportError)
+
+
+def estimate_tokens(request):
+    # What the provider's TPM limit counts a request as: roughly four characters a token, plus max_tokens
+    return sum(len(str(message.get("content") or "")) for message in request["messages"]) // 4 + request.get("max_tokens", 0)
+
+
+class CompletionService:
+    """Runs chat completions on a bounded worker pool over one pooled, keep-alive HTTP client.
+
+    Every session submits here instead of calling the OpenAI client inline, so the number
+    of requests in flight is capped per process and connections are reused between turns.
+    Requests are admitted by a Scheduler, which applies per-user and provider rate limits
+    and starts the most urgent work first; ``user`` and ``priority`` are passed on to it.
+    Transient errors are retried here rather than by the OpenAI client, within each call's
+    deadline and behind a circuit breaker per model (see ``resilience``).
+    ``base_url`` can point at a local stub server such as ``sermon_assistant.stub_server``.
+    """
+
+    def __init__(self, api_key=None, base_url=None, max_concurrency=None, timeout=None, max_retries=None, deadline=None):
+        self.max_concurrency = max_concurrency or MAX_CONCURRENCY
+        self.timeout = timeout or REQUEST_TIMEOUT
+        self.max_retries = MAX_RETRIES if max_retries is None else max_retries
+        self.deadline = deadline or DEADLINE
+        self.breakers = {}
+        self._breakers_lock = threading.Lock()
+        self.http_client = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=self.max_concurrency,
+                max_keepalive_connections=self.max_concurrency,
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(self.timeout, connect=CONNECT_TIMEOUT),
+            # Every HTTP response, so retries the OpenAI client makes on its own show up too
+            event_hooks={"response": [lambda response: metrics.count("sermon_api_responses_total", status=response.status_code)]},
+        )
+        self.client = openai.OpenAI(
+            api_key=api_key or os.getenv("OPENAI_API_KEY"),
+            base_url=base_url or os.getenv("OPENAI_BASE_URL"),
+            http_client=self.http_client,
+            timeout=self.timeout,
+            max_retries=0,
+        )
+        self.executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="completion")
+        self.scheduler = Scheduler(self.executor, self.max_concurrency)
+        metrics.gauge("sermon_queue_waiting", lambda: self.scheduler.status()["waiting"])
+        metrics.gauge("sermon_queue_running", lambda: self.scheduler.status()["running"])
+
+    def breaker(self, model):
+        with self._breakers_lock:
+            return self.breakers.setdefault(model, CircuitBreaker())
+
+    def create(self, request, fallback_models=(), timeout=None, deadline=None):
+        """Create a completion, retrying transient errors and moving on to the next fallback model.
+
+        Each model gets up to ``max_retries`` retries with backoff; a model whose circuit breaker
+        is open is skipped. No attempt or wait runs past ``deadline`` seconds from now, and each
+        attempt's timeout is cut to what is left of it.
+        """
+        return self._create(request, fallback_models, timeout, deadline)[1]
+
+    def _create(self, request, fallback_models=(), timeout=None, deadline=None):
+        # create(), returning (model, response) so a stream knows which model, perhaps a fallback, is answering
+        models = [request["model"], *fallback_models]
+        # A deadline of 0 (e.g. what a stream has left after its retries) means no time left, not the default
+        deadline = self.deadline if deadline is None else deadline
+        end = time.monotonic() + deadline
+        error = None
+        for model in models:
+            breaker = self.breaker(model)
+            for attempt in range(self.max_retries + 1):
+                remaining = end - time.monotonic()
+                if remaining <= 0:
+                    raise error or TimeoutError(f"No reply within the {max(deadline, 0)}s deadline")
+                if not breaker.allow():
+                    error = CircuitOpenError(model, breaker.retry_in())
+                    break
+                client = self.client.with_options(timeout=min(timeout or self.timeout, remaining))
+                try:
+                    # For a stream this is the wait for the response headers; the text is timed by ReplyStream
+                    with metrics.span("api_request", model=model):
+                        response = client.chat.completions.create(**dict(request, model=model))
+                except FALLBACK_ERRORS as caught:
+                    error = caught
+                    if not is_outage(caught):
+                        # The provider answered (a 429, a bad request): it is up, whatever it said
+                        breaker.success()
+                    elif breaker.failure():
+                        # That was the last straw for this model; no point waiting to retry it
+                        metrics.count("sermon_circuit_opens_total", model=model)
+                        break
+                    if not is_retryable(caught) or attempt == self.max_retries:
+                        break
+                    delay = backoff(attempt, caught)
+                    if time.monotonic() + delay >= end:
+                        # A retry that cannot finish in time only makes the user wait longer for the error
+                        break
+                    metrics.count("sermon_retries_total", model=model, reason=getattr(caught, "status_code", None) or type(caught).__name__)
+                    time.sleep(delay)
+                else:
+                    breaker.success()
+                    return model, response
+                finally:
+                    # Any other exception must not leave the breaker waiting on this trial for good
+                    breaker.release()
+            if model != models[-1]:
+                metrics.count("sermon_fallbacks_total", model=model)
+        raise error
+
+    def submit(self, timeout=None, fallback_models=(), user=None, priority=None, deadline=None, **request):
+        # Returns a Future resolving to the full ChatCompletion response, pending while it waits in line;
+        # the deadline starts once it leaves the line
+        return self.scheduler.submit(
+            self.create, request, fallback_models, timeout, deadline, user=user, priority=priority, tokens=estimate_tokens(request)
+        )
+
+    def complete(self, timeout=None, fallback_models=(), user=None, priority=None, deadline=None, **request):
+        return self.submit(
+            timeout=timeout, fallback_models=fallback_models, user=user, priority=priority, deadline=deadline, **request
+        ).result()
+
+    def stream(self, timeout=None, fallback_models=(), user=None, priority=None, on_wait=None, deadline=None, **request):
+        """Stream a reply; iterate the returned ReplyStream for its text chunks.
+
+        While the request waits in line, ``on_wait(position)`` is called every QUEUE_POLL_SECONDS
+        from the iterating thread, and once more with 0 when it starts.
+        """
+        return ReplyStream(self, timeout, request, fallback_models, user, priority, on_wait, deadline)
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.http_client.close()
+
+
+class ReplyStream:
+    """Reply text chunks, read by a pool worker while the caller iterates.
+
+    The worker slot is held for the whole stream and released as soon as the consumer
+    stops iterating, even part way through; a consumer that stops while the request is
+    still queued gives up its place in line. The reply timeout starts once it leaves the queue. Once iteration finishes, ``text`` is the full
+    reply and ``usage``/``model`` are what the API reported (``usage`` is None if it sent none).
+    A request that fails before any text has arrived, including a stream that stalls or drops
+    before its first chunk, is retried or moved to a fallback model. If it fails
+    after some text has arrived, iteration ends there instead of raising: ``text`` is what
+    arrived and ``error`` says why the rest did not.
+    """
+
+    def __init__(self, service, timeout, request, fallback_models=(), user=None, priority=None, on_wait=None, deadline=None):
+        self.service = service
+        self.timeout = timeout
+        self.fallback_models = fallback_models
+        self.user = user
+        self.priority = priority
+        self.on_wait = on_wait
+        self.deadline = deadline
+        self.request = dict(request, stream=True)
+        # Ask for the token counts in a final chunk, so the reply needs no local tokenizing
+        self.request.setdefault("stream_options", {"include_usage": True})
+        self.text = ""
+        self.usage = None
+        self.error = None
+        self.model = request.get("model")
+
+    def __iter__(self):
+        chunks = queue.Queue()
+        cancelled = threading.Event()
+        timeout = self.timeout or self.service.timeout
+        deadline = self.service.deadline if self.deadline is None else self.deadline
+
+        def produce():
+            end = time.monotonic() + deadline
+            delivered = False
+            attempt = 0
+            while True:
+                try:
+                    serving, stream = self.service._create(self.request, self.fallback_models, self.timeout, end - time.monotonic())
+                except Exception as error:
+                    # create() has already retried and fallen back as far as it could
+                    chunks.put(error)
+                    return
+                self.model = serving
+                try:
+                    try:
+                        for chunk in stream:
+                            if cancelled.is_set():
+                                break
+                            # The model that actually answered, which may be a fallback
+                            self.model = chunk.model or self.model
+                            if chunk.usage:
+                                self.usage = chunk.usage
+                            if chunk.choices and chunk.choices[0].delta.content:
+                                chunks.put(chunk.choices[0].delta.content)
+                                delivered = True
+                    finally:
+                        stream.close()
+                    chunks.put(_DONE)
+                    return
+                except Exception as caught:
+                    error = as_api_error(caught)
+                if delivered or cancelled.is_set() or not is_retryable(error) or attempt == self.service.max_retries:
+                    chunks.put(error)
+                    return
+                # The stream stalled or dropped before any text: nothing is lost by asking again.
+                # The failure is charged to the model that was answering, which may be a fallback
+                if is_outage(error) and self.service.breaker(serving).failure():
+                    metrics.count("sermon_circuit_opens_total", model=serving)
+                delay = backoff(attempt, error)
+                if time.monotonic() + delay >= end:
+                    chunks.put(error)
+                    return
+                metrics.count("sermon_retries_total", model=serving, reason=type(error).__name__)
+                time.sleep(delay)
+                attempt += 1
+
+        scheduler = self.service.scheduler
+        future = scheduler.submit(produce, user=self.user, priority=self.priority, tokens=estimate_tokens(self.request))
+        parts = []
+        waited = False
+        started = time.perf_counter()
+        try:
+            while True:
+                queued = not (future.running() or future.done())
+                # Until the first text, retries may be under way, so the whole deadline is allowed
+                wait = timeout if parts else max(timeout, deadline)
+                try:
+                    item = chunks.get(timeout=QUEUE_POLL_SECONDS if queued else wait)
+                except queue.Empty:
+                    if not queued:
+                        item = TimeoutError(f"No reply chunk within {wait}s")
+                    else:
+                        position = scheduler.position(future)
+                        if self.on_wait and position:
+                            self.on_wait(position)
+                            waited = True
+                        continue
+                if waited:
+                    self.on_wait(0)
+                    waited = False
+                if not parts and isinstance(item, str):
+                    metrics.observe("sermon_time_to_first_token_seconds", time.perf_counter() - started, model=self.model)
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    if not parts:
+                        raise item
+                    # Cut off part way: keep what arrived rather than lose the whole reply
+                    self.error = item
+                    metrics.count("sermon_partial_replies_total", model=self.model, error=type(item).__name__)
+                    return
+                parts.append(item)
+                yield item
+        finally:
+            cancelled.set()
+            future.cancel()
+            self.text = "".join(parts)
+            metrics.stage_time("stream", time.perf_counter() - started)
+
+
+@lru_cache(maxsize=None)
+def get_service():
+    return CompletionService()
@@ -0,0 +1,161 @@
+"""Minimal local stand-in for the OpenAI chat completions endpoint.
+
+    python -m sermon_assistant.stub_server --port 8765 --latency 0.2
+    python -m sermon_assistant.stub_server --latency 0.4 --token-rate 40 --chunk-words 3 --reply-words 300
+    python -m sermon_assistant.stub_server --fail-rate 0.3 --fail-status 503 --drop-rate 0.1 --seed 1
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=stub streamlit run digital_barnabas_app.py
+
+Answers ``POST /v1/chat/completions`` with a canned reply, either as one JSON body or as
+a server-sent event stream when the request asks for ``stream: true``. Each word of the
+reply counts as one token: ``token_rate`` paces them like a real model (0 sends them all at
+once) and ``chunk_words`` sets how many go in each streamed chunk.
+
+For testing the retry and fallback paths it can also misbehave: the first ``fail_first``
+requests, then a ``fail_rate`` share of the rest, get a ``fail_status`` error (with a
+Retry-After of ``retry_after`` seconds, if set), and a ``drop_rate`` share of streams are cut
+off half way through the reply.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLY = (
+    "Consider it pure joy, my brothers and sisters, whenever you face trials of many kinds, "
+    "because you know that the testing of your faith produces perseverance."
+)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        if status >= 400 and self.server.retry_after is not None:
+            self.send_header("Retry-After", str(self.server.retry_after))
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        if self.path.rstrip("/") not in ("/v1/chat/completions", "/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            fail = server.requests <= server.fail_first or server.random.random() < server.fail_rate
+            drop = server.random.random() < server.drop_rate
+        time.sleep(server.latency)
+        if fail:
+            server.failures += 1
+            self._send_json(server.fail_status, {"error": {"message": "Injected fault", "type": "server_error"}})
+            return
+
+        words = self.server.reply.split(" ")
+        rate, size = self.server.token_rate, max(1, self.server.chunk_words)
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) + 4 for m in request.get("messages", []))
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(words), "total_tokens": prompt_tokens + len(words)}
+        base = {"id": "chatcmpl-stub", "created": int(time.time()), "model": request.get("model", "stub")}
+
+        if not request.get("stream"):
+            if rate:
+                time.sleep(len(words) / rate)
+            self._send_json(200, dict(base, object="chat.completion", usage=usage, choices=[
+                {"index": 0, "message": {"role": "assistant", "content": self.server.reply}, "finish_reason": "stop"}
+            ]))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def event(payload):
+            data = f"data: {payload}\n\n".encode()
+            self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        for i in range(0, len(words), size):
+            if drop and i >= len(words) // 2:
+                # The connection dies mid-reply: no closing chunk, no [DONE]
+                self.close_connection = True
+                return
+            if rate:
+                time.sleep(len(words[i:i + size]) / rate)
+            delta = {"content": ("" if i == 0 else " ") + " ".join(words[i:i + size])}
+            event(json.dumps(dict(base, object="chat.completion.chunk", choices=[
+                {"index": 0, "delta": delta, "finish_reason": None}
+            ])))
+        event(json.dumps(dict(base, object="chat.completion.chunk", choices=[
+            {"index": 0, "delta": {}, "finish_reason": "stop"}
+        ])))
+        if (request.get("stream_options") or {}).get("include_usage"):
+            event(json.dumps(dict(base, object="chat.completion.chunk", choices=[], usage=usage)))
+        event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def start_stub_server(port=0, latency=0.0, reply=REPLY, token_rate=0.0, chunk_words=1, reply_words=None,
+                      fail_rate=0.0, fail_first=0, fail_status=503, retry_after=None, drop_rate=0.0, seed=None):
+    """Serve on a background thread; returns the server, whose ``base_url`` the client can use.
+
+    ``reply_words`` repeats or cuts ``reply`` to that many words. The fault settings are
+    attributes of the server and can be changed while it runs; ``failures`` counts the errors sent.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    if reply_words:
+        words = reply.split(" ")
+        reply = " ".join(words[i % len(words)] for i in range(reply_words))
+    server.reply = reply
+    server.token_rate = token_rate
+    server.chunk_words = chunk_words
+    server.requests = 0
+    server.failures = 0
+    server.fail_rate, server.fail_first, server.fail_status = fail_rate, fail_first, fail_status
+    server.retry_after, server.drop_rate = retry_after, drop_rate
+    server.random = random.Random(seed)
+    server.lock = threading.Lock()
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stub of the OpenAI chat completions API")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to wait before answering")
+    parser.add_argument("--token-rate", type=float, default=0.0, help="reply tokens per second (0: no pacing)")
+    parser.add_argument("--chunk-words", type=int, default=1, help="words per streamed chunk")
+    parser.add_argument("--reply-words", type=int, help="length of the canned reply in words")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of requests answered with an error")
+    parser.add_argument("--fail-first", type=int, default=0, help="answer the first N requests with an error")
+    parser.add_argument("--fail-status", type=int, default=503, help="HTTP status of injected errors, e.g. 429 or 500")
+    parser.add_argument("--retry-after", type=float, help="Retry-After seconds sent with injected errors")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="share of streams cut off half way")
+    parser.add_argument("--seed", type=int, help="seed for the injected faults, for repeatable runs")
+    args = parser.parse_args()
+    server = start_stub_server(
+        args.port, args.latency, token_rate=args.token_rate, chunk_words=args.chunk_words, reply_words=args.reply_words,
+        fail_rate=args.fail_rate, fail_first=args.fail_first, fail_status=args.fail_status, retry_after=args.retry_after,
+        drop_rate=args.drop_rate, seed=args.seed,
+    )
+    print(f"Stub chat completions server on {server.base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
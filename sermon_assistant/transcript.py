@@ -0,0 +1,53 @@
+import hashlib
+
+SPEAKERS = {"user": "You", "assistant": "Assistant"}
+
+
+def paragraphs(content):
+    return [paragraph.strip("\n") for paragraph in content.split("\n\n") if paragraph.strip()]
+
+
+class Transcript:
+    """A chat as a list of (role, content) turns, kept up to date as messages are added.
+
+    A turn with role ``None`` is plain content with no speaker, e.g. a single generated
+    devotional. Exporters render from the turns, so a reply spanning several paragraphs
+    stays one turn under one speaker.
+    """
+
+    def __init__(self, turns=()):
+        self.turns = []
+        self._digest = hashlib.sha1()
+        self._text = None
+        for role, content in turns:
+            self.append(role, content)
+
+    @classmethod
+    def from_messages(cls, messages):
+        return cls((m["role"], m["content"]) for m in messages)
+
+    def append(self, role, content):
+        # System prompts are not part of what the user saves
+        if role is not None and role not in SPEAKERS:
+            return
+        self.turns.append((role, content))
+        self._digest.update(f"{role}\0{content}\0".encode())
+        self._text = None
+
+    def digest(self):
+        # Running hash of every turn so far; identifies the transcript without rehashing it
+        return self._digest.digest()
+
+    @property
+    def text(self):
+        # Plain-text rendering, rebuilt only after a new turn is appended
+        if self._text is None:
+            self._text = "\n\n".join(f"{SPEAKERS[role]}: {content}" if role else content for role, content in self.turns)
+        return self._text
+
+    def __len__(self):
+        return len(self.turns)
+
+
+def as_transcript(content):
+    return content if isinstance(content, Transcript) else Transcript([(None, content)])
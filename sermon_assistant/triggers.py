@@ -0,0 +1,80 @@
+"""Keyword triggers: every rule's phrases compiled into one pattern, matched in one pass per message.
+
+A phrase matches whole words only, case-insensitively, so "god" does not fire on "godfather"
+and "why" not on "anywhere". A trailing ``*`` matches any ending ("believ*" covers "believe",
+"believer" and "believed"), and spaces match any run of whitespace. The phrases are merged
+into a character trie before compiling, so the regex tries one branch per letter instead of
+one per phrase and a message costs about the same however many rules there are.
+"""
+import re
+
+END, PREFIX = "\0", "*"
+
+
+def _insert(trie, phrase, name):
+    phrase = " ".join(phrase.lower().split())
+    prefix = phrase.endswith(PREFIX)
+    node = trie
+    for char in phrase.rstrip(PREFIX):
+        node = node.setdefault(char, {})
+    node.setdefault(PREFIX if prefix else END, set()).add(name)
+
+
+def _pattern(node):
+    # Longer continuations are listed before the end of a phrase, so the longest phrase wins
+    branches = [(r"\s+" if char == " " else re.escape(char)) + _pattern(child)
+                for char, child in sorted(node.items()) if char not in (END, PREFIX)]
+    if PREFIX in node:
+        branches.append(r"\w*")
+    if END in node:
+        branches.append("")
+    if len(branches) == 1:
+        return branches[0]
+    return "(?:" + "|".join(branches) + ")"
+
+
+def phrase_pattern(phrases):
+    """One compiled, word-bounded pattern matching any of ``phrases``."""
+    trie = {}
+    for phrase in phrases:
+        _insert(trie, phrase, None)
+    return re.compile(r"(?<!\w)" + _pattern(trie) + r"(?!\w)", re.IGNORECASE)
+
+
+class TriggerEngine:
+    """Rules of the form {name: {"phrases": [...], "modes": [...]}}; a rule without modes applies to every mode."""
+
+    def __init__(self, rules):
+        self.order = {name: position for position, name in enumerate(rules)}
+        self.modes = {name: frozenset(rule["modes"]) if rule.get("modes") else None for name, rule in rules.items()}
+        self._trie = {}
+        for name, rule in rules.items():
+            for phrase in rule["phrases"]:
+                _insert(self._trie, phrase, name)
+        # A lookahead at each word start, so a phrase inside a longer one ("die" in "want to die") still counts
+        self._pattern = re.compile(r"(?<!\w)(?=(" + _pattern(self._trie) + r")(?!\w))", re.IGNORECASE) if self._trie else None
+
+    def _names(self, matched):
+        # Walk the trie along the matched text, collecting every phrase that ends on a word boundary
+        text = " ".join(matched.lower().split())
+        names, node = set(), self._trie
+        for position, char in enumerate(text):
+            node = node.get(char)
+            if node is None:
+                break
+            names.update(node.get(PREFIX, ()))
+            following = text[position + 1:position + 2]
+            if END in node and not (following.isalnum() or following == "_"):
+                names.update(node[END])
+        return names
+
+    def match(self, text, mode=None):
+        """Names of the rules ``text`` triggers, in rule order; with ``mode``, only the rules that apply to it."""
+        if self._pattern is None:
+            return []
+        names = set()
+        for match in self._pattern.finditer(text):
+            names.update(self._names(match[1]))
+        if mode is not None:
+            names = {name for name in names if self.modes[name] is None or mode in self.modes[name]}
+        return sorted(names, key=self.order.get)
@@ -1,128 +1,96 @@
 import streamlit as st
-import openai
-import os
-import tiktoken
-from io import BytesIO
-from docx import Document
-from fpdf import FPDF
 import random
-
-# Initialize OpenAI Client
-client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-MODEL = "gpt-3.5-turbo"
-PRICE_PER_1K_INPUT = 0.0015
-PRICE_PER_1K_OUTPUT = 0.002
-
-tokenizer = tiktoken.encoding_for_model(MODEL)
+from sermon_assistant import (
+    export_text,
+    find_passages,
+    get_prompts,
+    get_sermon_archive,
+    ground_prompt,
+    route,
+    stream_reply,
+    with_archive,
+)
+from sermon_assistant.chat_ui import (
+    archive_panel,
+    export_button,
+    new_conversation,
+    open_conversation,
+    past_sessions,
+    retry_input,
+    search_panel,
+    show_history,
+    show_scripture,
+    show_sources,
+    waiting_line,
+    write_reply,
+)
+
+APP = "ministry_coach"
+# Roles and follow-ups from the prompt registry, re-read on every rerun
+coach = get_prompts().roles["coach"]
 
 st.title("AI Ministry Conversational Assistant (Polished ChatGPT Style)")
 
-content_type = st.selectbox("Select Assistant Style", [
-    "Pastoral Chat & Sermon Coach",
-    "Devotional Guide",
-    "Bible Study Partner",
-    "Small Group Coach",
-    "Children's Lesson Creator",
-    "Social Media Pastor"
-])
-
-system_prompts = {
-    "Pastoral Chat & Sermon Coach": "You are a caring, conversational AI ministry coach...",
-    "Devotional Guide": "You are a devotional companion...",
-    "Bible Study Partner": "You are a Bible study partner...",
-    "Small Group Coach": "You are a small group discussion coach...",
-    "Children's Lesson Creator": "You are a creative, fun children's ministry helper...",
-    "Social Media Pastor": "You are a social media pastor...",
-}
+past_sessions(APP, "role", list(coach["roles"]))
+search_panel(APP)
+archive_panel()
+content_type = st.selectbox("Select Assistant Style", list(coach["roles"]), key="role")
 
-system_prompt = system_prompts[content_type]
+role = coach["roles"][content_type]
+system_prompt = role["system_prompt"]
 
-# Initialize or reset chat based on role change
-if "messages" not in st.session_state or st.session_state.get("last_role") != content_type:
-    st.session_state.messages = [{"role": "system", "content": system_prompt}]
-    st.session_state.last_role = content_type
+# Resume this tab's chat, or start a new saved one when the role changes
+conversation = open_conversation(APP, content_type, system_prompt)
 
-# Display chat history
-for msg in st.session_state.messages:
-    with st.chat_message(msg["role"]):
-        st.write(msg["content"])
+# Display chat history, latest page first
+show_history(conversation)
 
 # --- Chat input ---
 user_input = st.chat_input(f"Chat with your {content_type.lower()}...")
 if user_input:
-    st.session_state.messages.append({"role": "user", "content": user_input})
-
-    all_messages_text = ''.join([m['content'] for m in st.session_state.messages])
-    input_tokens = len(tokenizer.encode(all_messages_text))
-
-    response = client.chat.completions.create(
-        model=MODEL,
-        messages=st.session_state.messages,
-        temperature=0.7,
-        max_tokens=1200,
-    )
-
-    output_text = response.choices[0].message.content
+    conversation.add("user", user_input)
+else:
+    # After a failed reply, "Try again" answers the message already in the history
+    user_input = retry_input(conversation)
+if user_input:
+    # Verses the user cites are looked up locally and their exact text given to the model
+    passages = find_passages(user_input)
+    # Only the passages of past sermons that match this message, within the archive's token budget
+    sources = get_sermon_archive().retrieve(user_input)
+    prompt_messages = with_archive(ground_prompt(conversation.prompt(), passages), sources)
 
-    # Vary follow-up question
-    follow_ups = [
-        "Would you like me to suggest a closing illustration?",
-        "Should I help you create a group discussion starter from this?",
-        "Would you like me to offer a call to action?",
-        "Would you like me to suggest a related Scripture passage?",
-        "Would you like me to help outline the next point?"
-    ]
-    output_text += "\n\n" + random.choice(follow_ups)
+    # Assistant message bubble ONLY with text, streamed as it is generated
+    with st.chat_message("assistant"):
+        scripture = show_scripture(passages)
+        reply = stream_reply(prompt_messages, **route(role["profile"], user_input), **waiting_line(role))
+        write_reply(reply)
+        show_sources(sources)
 
-    output_tokens = len(tokenizer.encode(output_text))
-    input_cost = (input_tokens / 1000) * PRICE_PER_1K_INPUT
-    output_cost = (output_tokens / 1000) * PRICE_PER_1K_OUTPUT
-    total_cost = input_cost + output_cost
+        # Vary follow-up question
+        follow_up = random.choice(coach["follow_ups"])
+        st.write(follow_up)
 
-    # Assistant message bubble ONLY with text
-    with st.chat_message("assistant"):
-        st.write(output_text)
+    # Append assistant message to state, charged from the usage the API reports
+    turn = conversation.add_reply(reply, "\n\n" + follow_up, prefix=scripture)
+    # The reply exactly as it was recorded in the history
+    output_text = conversation.messages[-1]["content"]
+    session = conversation.ledger.totals(session_id=conversation.session_id)
 
     # --- BELOW the chat message: Export & Token Info ---
     col1, col2 = st.columns([1, 1])
 
     with col1:
         st.write("##### 📥 Export")
-        def export_text(content):
-            return BytesIO(content.encode())
-
-        def export_docx(content):
-            doc = Document()
-            doc.add_paragraph(content)
-            buffer = BytesIO()
-            doc.save(buffer)
-            buffer.seek(0)
-            return buffer
-
-        def export_pdf(content):
-            pdf = FPDF()
-            pdf.add_page()
-            pdf.set_auto_page_break(auto=True, margin=15)
-            pdf.set_font("Arial", size=12)
-            for line in content.split('\n'):
-                pdf.multi_cell(0, 10, line)
-            pdf_output = pdf.output(dest='S').encode('latin-1')
-            return BytesIO(pdf_output)
-
-        st.download_button("TXT", export_text(output_text), file_name="chat_content.txt", key=f"txt_{len(st.session_state.messages)}")
-        st.download_button("DOCX", export_docx(output_text), file_name="chat_content.docx", key=f"docx_{len(st.session_state.messages)}")
-        st.download_button("PDF", export_pdf(output_text), file_name="chat_content.pdf", key=f"pdf_{len(st.session_state.messages)}")
+        st.download_button("TXT", export_text(output_text), file_name="chat_content.txt", key=f"txt_{len(conversation.messages)}")
+        export_button("DOCX", output_text, file_name="chat_content.docx", key=f"docx_{len(conversation.messages)}")
+        export_button("PDF", output_text, file_name="chat_content.pdf", key=f"pdf_{len(conversation.messages)}")
 
     with col2:
         st.write("##### 🔢 Tokens & Cost")
-        st.info(f"Input: {input_tokens} | Output: {output_tokens}")
-        st.info(f"💰 Estimated: ${total_cost:.4f}")
-
-    # Append assistant message to state
-    st.session_state.messages.append({"role": "assistant", "content": output_text})
+        st.info(f"Input: {turn['input_tokens']} | Output: {turn['output_tokens']}")
+        st.info(f"💰 This reply: ${turn['cost']:.4f} | This chat: ${session['cost']:.4f}")
 
 # Reset chat button at the bottom
 if st.button("🧹 Reset Chat"):
-    st.session_state.messages = [{"role": "system", "content": system_prompt}]
+    new_conversation(APP, content_type, system_prompt)
     st.success("Chat reset.")
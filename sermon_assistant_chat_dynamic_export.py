@@ -1,104 +1,88 @@
 import streamlit as st
-import openai
-import os
-import tiktoken
-from io import BytesIO
-from docx import Document
-from fpdf import FPDF
-
-# Initialize OpenAI Client
-client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-MODEL = "gpt-3.5-turbo"
-PRICE_PER_1K_INPUT = 0.0015
-PRICE_PER_1K_OUTPUT = 0.002
-
-tokenizer = tiktoken.encoding_for_model(MODEL)
-
+from sermon_assistant import (
+    export_text,
+    find_passages,
+    get_prompts,
+    get_sermon_archive,
+    ground_prompt,
+    route,
+    stream_reply,
+    with_archive,
+)
+from sermon_assistant.chat_ui import (
+    archive_panel,
+    export_button,
+    open_conversation,
+    past_sessions,
+    retry_input,
+    search_panel,
+    show_history,
+    show_scripture,
+    show_sources,
+    waiting_line,
+    write_reply,
+)
+
+APP = "ministry_writer_export"
+# Roles and their model profiles from the prompt registry, re-read on every rerun
+writer = get_prompts().roles["writer"]
+
+# --- APP TITLE ---
 st.title("AI Ministry Chat Assistant (Dynamic Role + Export)")
 
-content_type = st.selectbox("Select Assistant Role", [
-    "Sermon Writer",
-    "Devotional Writer",
-    "Bible Study Guide Writer",
-    "Small Group Discussion Facilitator",
-    "Children's Lesson Creator",
-    "Social Media Content Creator"
-])
+# --- Select assistant behavior dynamically ---
+past_sessions(APP, "role", list(writer["roles"]))
+search_panel(APP)
+archive_panel()
+content_type = st.selectbox("Select Assistant Role", list(writer["roles"]), key="role")
 
-system_prompts = {
-    "Sermon Writer": "You are a friendly sermon assistant...",
-    "Devotional Writer": "You are a devotional writer...",
-    "Bible Study Guide Writer": "You are a Bible study guide writer...",
-    "Small Group Discussion Facilitator": "You are a small group facilitator...",
-    "Children's Lesson Creator": "You are a children's lesson creator...",
-    "Social Media Content Creator": "You are a social media content creator...",
-}
+# Update system prompt based on selected type
+role = writer["roles"][content_type]
+system_prompt = role["system_prompt"]
 
-system_prompt = system_prompts[content_type]
+# Initialize session state, resuming a saved session when there is one
+conversation = open_conversation(APP, content_type, system_prompt)
 
-if "messages" not in st.session_state or st.session_state.get("last_role") != content_type:
-    st.session_state.messages = [{"role": "system", "content": system_prompt}]
-    st.session_state.last_role = content_type
-
-for msg in st.session_state.messages:
-    if msg["role"] == "user":
-        st.chat_message("user").write(msg["content"])
-    elif msg["role"] == "assistant":
-        st.chat_message("assistant").write(msg["content"])
+# Display chat history, latest page first
+show_history(conversation)
 
+# --- Chat input ---
 user_input = st.chat_input(f"Chat with your {content_type.lower()}...")
 if user_input:
-    st.session_state.messages.append({"role": "user", "content": user_input})
-
-    all_messages_text = ''.join([m['content'] for m in st.session_state.messages])
-    input_tokens = len(tokenizer.encode(all_messages_text))
-
-    response = client.chat.completions.create(
-        model=MODEL,
-        messages=st.session_state.messages,
-        temperature=0.7,
-        max_tokens=1200,
+    conversation.add("user", user_input)
+else:
+    # After a failed reply, "Try again" answers the message already in the history
+    user_input = retry_input(conversation)
+if user_input:
+    # Verses the user cites are looked up locally and their exact text given to the model
+    passages = find_passages(user_input)
+    # Only the passages of past sermons that match this message, within the archive's token budget
+    sources = get_sermon_archive().retrieve(user_input)
+    prompt_messages = with_archive(ground_prompt(conversation.prompt(), passages), sources)
+
+    # Each role's model and length budget, with a fallback model if it fails
+    with st.chat_message("assistant"):
+        scripture = show_scripture(passages)
+        reply = stream_reply(prompt_messages, **route(role["profile"], user_input), **waiting_line(role))
+        write_reply(reply)
+        show_sources(sources)
+    # Tokens and cost as reported by the API, recorded in the cost ledger
+    turn = conversation.add_reply(reply, prefix=scripture)
+    # The reply exactly as it was recorded in the history
+    output_text = conversation.messages[-1]["content"]
+    session = conversation.ledger.totals(session_id=conversation.session_id)
+
+    st.info(f"🔢 Tokens Used: Input: {turn['input_tokens']} | Output: {turn['output_tokens']}")
+    st.info(
+        f"💰 Cost: ${turn['cost']:.4f} (Input: ${turn['input_cost']:.4f} | Output: ${turn['output_cost']:.4f})"
+        f" | This conversation: ${session['cost']:.4f}"
     )
 
-    output_text = response.choices[0].message.content
-    output_tokens = len(tokenizer.encode(output_text))
-    input_cost = (input_tokens / 1000) * PRICE_PER_1K_INPUT
-    output_cost = (output_tokens / 1000) * PRICE_PER_1K_OUTPUT
-    total_cost = input_cost + output_cost
-
-    st.chat_message("assistant").write(output_text)
-    st.session_state.messages.append({"role": "assistant", "content": output_text})
-
-    st.info(f"🔢 Estimated Tokens Used: Input: {input_tokens} | Output: {output_tokens}")
-    st.info(f"💰 Estimated Cost: ${total_cost:.4f} (Input: ${input_cost:.4f} | Output: ${output_cost:.4f})")
-
     # --- Export Options ---
     st.write("### 📥 Export Options")
 
-    def export_text(content):
-        return BytesIO(content.encode())
-
-    def export_docx(content):
-        doc = Document()
-        doc.add_paragraph(content)
-        buffer = BytesIO()
-        doc.save(buffer)
-        buffer.seek(0)
-        return buffer
-
-    def export_pdf(content):
-    pdf = FPDF()
-    pdf.add_page()
-    pdf.set_auto_page_break(auto=True, margin=15)
-    pdf.set_font("Arial", size=12)
-    for line in content.split('\n'):
-        pdf.multi_cell(0, 10, line)
-    pdf_output = pdf.output(dest='S').encode('latin-1')
-    return BytesIO(pdf_output)
-
     # Only show export for latest assistant message
     if output_text:
         st.download_button("📄 Download as TXT", export_text(output_text), file_name="generated_content.txt")
-        st.download_button("📄 Download as DOCX", export_docx(output_text), file_name="generated_content.docx")
-        st.download_button("📄 Download as PDF", export_pdf(output_text), file_name="generated_content.pdf")
+        export_button("📄 Download as DOCX", output_text, file_name="generated_content.docx")
+        export_button("📄 Download as PDF", output_text, file_name="generated_content.pdf")
@@ -0,0 +1,116 @@
+"""The completion service against the local stub server: retries, the circuit breaker, fallbacks and cut-off streams.
+
+    python -m pytest -q tests
+"""
+import time
+
+import openai
+import pytest
+
+from sermon_assistant.resilience import CircuitBreaker, CircuitOpenError
+from sermon_assistant.service import CompletionService
+from sermon_assistant.stub_server import start_stub_server
+
+MESSAGES = [{"role": "user", "content": "Hello"}]
+
+
+@pytest.fixture(scope="module")
+def stub():
+    server = start_stub_server(seed=1)
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def server(stub):
+    # Well behaved again for each test; a Retry-After of 0 keeps the retries instant
+    stub.requests = stub.failures = 0
+    stub.fail_first, stub.fail_rate, stub.fail_status, stub.retry_after, stub.drop_rate = 0, 0.0, 503, 0, 0.0
+    return stub
+
+
+@pytest.fixture
+def service(server):
+    service = CompletionService(api_key="stub", base_url=server.base_url, max_retries=2, deadline=10)
+    yield service
+    service.close()
+
+
+def test_transient_errors_are_retried(server, service):
+    server.fail_first = 2
+    response = service.complete(model="gpt-4o-mini", messages=MESSAGES)
+    assert response.choices[0].message.content
+    assert server.requests == 3
+
+
+def test_errors_that_are_not_transient_are_not_retried(server, service):
+    server.fail_first, server.fail_status = 1, 400
+    with pytest.raises(openai.BadRequestError):
+        service.complete(model="gpt-4o-mini", messages=MESSAGES)
+    assert server.requests == 1
+
+
+def test_fallback_model_answers_when_the_first_fails(server):
+    service = CompletionService(api_key="stub", base_url=server.base_url, max_retries=0, deadline=10)
+    server.fail_first = 1
+    response = service.complete(model="gpt-4o", messages=MESSAGES, fallback_models=["gpt-4o-mini"])
+    assert response.model == "gpt-4o-mini"
+    assert server.requests == 2
+    service.close()
+
+
+def test_breaker_opens_and_closes_after_a_successful_trial(server, service):
+    breaker = service.breakers["gpt-4o"] = CircuitBreaker(failures=2, reset_seconds=0.2)
+    server.fail_rate = 1.0
+    with pytest.raises(openai.InternalServerError):
+        service.complete(model="gpt-4o", messages=MESSAGES)
+    assert breaker.state == "open"
+
+    # While open, the model is not called at all
+    requests = server.requests
+    with pytest.raises(CircuitOpenError):
+        service.complete(model="gpt-4o", messages=MESSAGES)
+    assert server.requests == requests
+
+    time.sleep(0.25)
+    assert breaker.state == "half-open"
+    server.fail_rate = 0.0
+    service.complete(model="gpt-4o", messages=MESSAGES)
+    assert breaker.state == "closed"
+
+
+def test_half_open_trial_is_released_after_an_unexpected_error(server, service):
+    breaker = service.breakers["gpt-4o"] = CircuitBreaker(failures=1, reset_seconds=0.1)
+    breaker.failure()
+    time.sleep(0.15)
+    # Not an API error: the trial ends without a verdict, and the next call may try again
+    with pytest.raises(TypeError):
+        service.complete(model="gpt-4o", messages=MESSAGES, not_an_argument=True)
+    assert breaker.state == "half-open"
+    service.complete(model="gpt-4o", messages=MESSAGES)
+    assert breaker.state == "closed"
+
+
+def test_open_breaker_moves_on_to_the_fallback(server, service):
+    breaker = service.breakers["gpt-4o"] = CircuitBreaker(failures=1, reset_seconds=60)
+    breaker.failure()
+    response = service.complete(model="gpt-4o", messages=MESSAGES, fallback_models=["gpt-4o-mini"])
+    assert response.model == "gpt-4o-mini"
+    assert server.requests == 1
+
+
+def test_stream_is_retried_before_its_first_chunk(server, service):
+    server.fail_first = 1
+    reply = service.stream(model="gpt-4o-mini", messages=MESSAGES)
+    assert "".join(reply) == server.reply
+    assert reply.error is None
+    assert reply.usage is not None
+
+
+def test_stream_cut_off_part_way_is_reported_as_partial(server, service):
+    server.drop_rate = 1.0
+    reply = service.stream(model="gpt-4o-mini", messages=MESSAGES)
+    text = "".join(reply)
+    assert text and len(text) < len(server.reply)
+    assert reply.text == text
+    assert isinstance(reply.error, openai.APIConnectionError)